@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Compare compression codecs on typical record values.
+
+For each payload and codec, prints the stored size as a percentage
+of the original, and the time to compress and decompress it. This is
+what lazyboy.compression's defaults are based on.
+
+Run with: python benchmarks/compression.py [loops]
+"""
+
+import os
+import sys
+import bz2
+import json
+import time
+import zlib
+import random
+
+import lazyboy.compression as compression
+
+
+def user_json(num):
+    """Return a verbose JSON profile, as the API serializes it."""
+    return json.dumps({
+            "id": num, "username": "user%06d" % num,
+            "display_name": "User Number %d" % num,
+            "email": "user%06d@example.com" % num,
+            "created_at": "2010-03-%02dT12:34:56Z" % (num % 28 + 1),
+            "settings": {"notifications": True, "theme": "default",
+                         "language": "en-US", "timezone": "US/Pacific"},
+            "friends": range(num, num + 40),
+            "bio": "Writes about technology, science and the internet.",
+            }, indent=2, sort_keys=True)
+
+
+def document_json():
+    """Return a large JSON document, e.g. a cached story listing."""
+    return json.dumps([{"story_id": num, "title": "Story title %d" % num,
+                        "url": "http://example.com/story/%d" % num,
+                        "diggs": num * 7 % 1000, "comments": num % 50,
+                        "topic": random.choice(["tech", "science",
+                                                "world", "sports"])}
+                       for num in range(200)])
+
+
+PAYLOADS = (
+    ("short string", "jcleese@example.com"),
+    ("profile json", user_json(42)),
+    ("listing json", document_json()),
+    ("html", open(__file__).read() * 3),
+    ("random bytes", os.urandom(4096)),
+    )
+
+CODECS = [("zlib-1", lambda data: zlib.compress(data, 1), zlib.decompress),
+          ("zlib-6", lambda data: zlib.compress(data, 6), zlib.decompress),
+          ("zlib-9", lambda data: zlib.compress(data, 9), zlib.decompress),
+          ("bz2-9", lambda data: bz2.compress(data, 9), bz2.decompress)]
+if compression.lzma:
+    CODECS.append(("lzma", compression.lzma.compress,
+                   compression.lzma.decompress))
+
+
+def timed(func, arg, loops):
+    """Return (result, microseconds per call) of func(arg)."""
+    start = time.time()
+    for num in xrange(loops):
+        result = func(arg)
+    return (result, (time.time() - start) * 1e6 / loops)
+
+
+def main(loops=200):
+    """Print the comparison."""
+    print "%-14s %7s %-8s %7s %11s %11s" % ("payload", "bytes", "codec",
+                                            "stored", "compress",
+                                            "decompress")
+    for (name, payload) in PAYLOADS:
+        for (codec, pack, unpack) in CODECS:
+            (packed, pack_time) = timed(pack, payload, loops)
+            (_, unpack_time) = timed(unpack, packed, loops)
+            print "%-14s %7d %-8s %6.0f%% %9.1fus %9.1fus" % (
+                name, len(payload), codec,
+                100.0 * min(len(packed), len(payload)) / len(payload),
+                pack_time, unpack_time)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Time loading wide records which are only partly read.
+
+Each loop injects a fetched row into a new Record and reads a few of
+its items, as a page of a View or KeyRecordSet typically does.
+
+Run with: python benchmarks/record_lazy.py [loops]
+"""
+
+import sys
+import time
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+import lazyboy.fields as fields
+
+WIDTHS = (10, 100, 1000)
+READS = 4
+
+
+class Eager(Record):
+    _fields = {'column-00000': fields.Int64Field()}
+
+
+class Lazy(Eager):
+    _lazy = True
+
+
+def fetched(width):
+    """Return columns as they come back from get_slice."""
+    return [Column("column-%05d" % num, "\x00" * 7 + chr(num % 256),
+                   int(time.time())) for num in range(width)]
+
+
+def timed(record_class, columns, loops):
+    """Return microseconds per load-and-read of a row."""
+    key = Key("Bench", "Records", "row")
+    names = [col.name for col in columns[:READS]]
+    start = time.time()
+    for num in xrange(loops):
+        rec = record_class()._inject(key, columns)
+        for name in names:
+            rec[name]
+    return (time.time() - start) * 1e6 / loops
+
+
+def main(loops=2000):
+    """Print the comparison."""
+    print "%8s %12s %12s" % ("columns", "eager", "lazy")
+    for width in WIDTHS:
+        columns = fetched(width)
+        print "%8d %10.1fus %10.1fus" % (
+            width, timed(Eager, columns, loops),
+            timed(Lazy, columns, loops))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Compare the memory used by a Record before and after compaction.
+
+The `legacy' figures rebuild the structures Record used to keep: the
+values in the dict, a Column per item in _columns, a deep copy of those
+in _original, and _modified/_deleted dicts.
+
+`changed' is a loaded record with one item modified, which is when the
+compact Record backs up that item's original value.
+
+Run with: python benchmarks/record_memory.py [columns]
+"""
+
+import sys
+import copy
+import time
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+
+
+def deep_size(obj, seen=None):
+    """Return the size in bytes of obj and everything it references."""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(val, seen)
+                    for (key, val) in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def fetched(width):
+    """Return columns as they come back from get_slice."""
+    return [Column("column-%03d" % num, "value of column %03d" % num,
+                   int(time.time())) for num in range(width)]
+
+
+def legacy_record(columns, state):
+    """Return the structures the old Record kept for a loaded row."""
+    original = dict((col.name, col) for col in columns)
+    values = dict((col.name, col.value) for col in columns)
+    current = dict((col.name, copy.copy(col)) for col in columns)
+    modified = {}
+    if state == 'changed':
+        name = columns[0].name
+        values[name] = current[name].value = "changed"
+        modified[name] = True
+    elif state == 'saved':
+        original = copy.deepcopy(current)
+    return (values, current, original, modified, {})
+
+
+def record(columns, state):
+    """Return a loaded Record."""
+    rec = Record()._inject(Key("Bench", "Records", "row"), columns)
+    if state == 'changed':
+        rec[columns[0].name] = "changed"
+    elif state == 'saved':
+        rec._saved(rec._marshal())
+    return rec
+
+
+def record_size(rec):
+    """Return the size of a Record's data."""
+    return deep_size((dict(rec), rec._timestamps, rec._modified,
+                      rec._deleted, rec._backup))
+
+
+def main(width=50):
+    """Print the comparison."""
+    print "%d columns per record" % width
+    for state in ('loaded', 'changed', 'saved'):
+        old = deep_size(legacy_record(fetched(width), state))
+        new = record_size(record(fetched(width), state))
+        print "  %-10s legacy: %6d bytes  compact: %6d bytes  (%.0f%%)" % (
+            state, old, new, 100.0 * new / old)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
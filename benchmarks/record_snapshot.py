@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Time Record save/revert bookkeeping against the width of the row.
+
+Each loop changes one item of a loaded record, then either marks it
+saved or reverts it. The `legacy' figures repeat the copying the old
+Record did: a deepcopy of every Column on save, and a copy of every
+Column on revert.
+
+Run with: python benchmarks/record_snapshot.py [loops]
+"""
+
+import sys
+import copy
+import time
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+
+WIDTHS = (10, 100, 1000, 10000)
+
+
+def fetched(width):
+    """Return columns as they come back from get_slice."""
+    return [Column("column-%05d" % num, "value of column %05d" % num,
+                   int(time.time())) for num in range(width)]
+
+
+def timed(func, loops):
+    """Return microseconds per call of func."""
+    start = time.time()
+    for num in xrange(loops):
+        func(num)
+    return (time.time() - start) * 1e6 / loops
+
+
+def legacy(width, loops):
+    """Return (save, revert) microseconds for the old bookkeeping."""
+    columns = dict((col.name, col) for col in fetched(width))
+    first = min(columns)
+
+    def save(num):
+        columns[first].value = str(num)
+        copy.deepcopy(columns)
+
+    def revert(num):
+        columns[first].value = str(num)
+        for col in columns.itervalues():
+            copy.copy(col)
+
+    return (timed(save, loops), timed(revert, loops))
+
+
+def compact(width, loops):
+    """Return (save, revert) microseconds for the current Record."""
+    rec = Record()._inject(Key("Bench", "Records", "row"), fetched(width))
+    first = min(rec)
+
+    def save(num):
+        rec[first] = str(num)
+        rec._saved(rec._marshal())
+
+    def revert(num):
+        rec[first] = str(num)
+        rec.revert()
+
+    return (timed(save, loops), timed(revert, loops))
+
+
+def main(loops=200):
+    """Print the comparison."""
+    print "%8s %14s %14s %14s %14s" % ("columns", "legacy save",
+                                       "compact save", "legacy revert",
+                                       "compact revert")
+    for width in WIDTHS:
+        (old_save, old_revert) = legacy(width, loops)
+        (new_save, new_revert) = compact(width, loops)
+        print "%8d %12.1fus %12.1fus %12.1fus %12.1fus" % (
+            width, old_save, new_save, old_revert, new_revert)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
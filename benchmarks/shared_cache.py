@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Time cache hits against a round trip to Cassandra.
+
+Compares a hit in the process-local LRUCache and in the shared-memory
+cache for a 20-column row, with a get_slice of the same row. If no
+server is given, a loopback TCP round trip plus decoding the Thrift
+response stands in for the request, which is a lower bound on it.
+
+Run with: python benchmarks/shared_cache.py [-s host:port -k keyspace
+          -c column_family -r row] [-n loops]
+"""
+
+import os
+import socket
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+from thrift.transport.TTransport import TMemoryBuffer
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+
+from cassandra.Cassandra import get_slice_result
+from cassandra.ttypes import Column
+
+from lazyboy.cache import LRUCache
+from lazyboy.shmcache import SharedCache
+from lazyboy.key import Key
+import lazyboy.connection as connection
+import lazyboy.iterators as iterators
+
+KEY = ("Bench", "Users", "row", None)
+COLUMNS = tuple(Column("column-%02d" % num, "value %d" % num,
+                       int(time.time())) for num in range(20))
+
+
+def timed(func, loops):
+    """Return microseconds per call of func."""
+    start = time.time()
+    for num in xrange(loops):
+        func()
+    return (time.time() - start) * 1e6 / loops
+
+
+def loopback():
+    """Return a function making a loopback TCP round trip."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def echo():
+        conn = server.accept()[0]
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                return
+            conn.sendall(data)
+
+    thread = threading.Thread(target=echo)
+    thread.setDaemon(True)
+    thread.start()
+    client = socket.create_connection(server.getsockname())
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def round_trip():
+        client.sendall("x" * 64)
+        client.recv(4096)
+
+    return round_trip
+
+
+def thrift_decode():
+    """Return a function decoding a get_slice response for COLUMNS."""
+    buf = TMemoryBuffer()
+    get_slice_result(success=list(iterators.pack(COLUMNS))).write(
+        TBinaryProtocol(buf))
+    data = buf.getvalue()
+
+    def decode():
+        get_slice_result().read(TBinaryProtocol(TMemoryBuffer(data)))
+
+    return decode
+
+
+def main():
+    """Print the comparison."""
+    parser = OptionParser()
+    parser.add_option("-s", "--server")
+    parser.add_option("-k", "--keyspace", default="Keyspace1")
+    parser.add_option("-c", "--column-family", default="Standard1")
+    parser.add_option("-r", "--row", default="row")
+    parser.add_option("-n", "--loops", type="int", default=10000)
+    (opts, args) = parser.parse_args()
+
+    lru = LRUCache()
+    lru.set(KEY, COLUMNS)
+    path = tempfile.mktemp(prefix="lazyboy-bench-")
+    shared = SharedCache(path, slots=1024)
+    shared.set(KEY, COLUMNS)
+
+    try:
+        print "%-24s %10.1fus" % ("LRUCache hit", timed(
+                lambda: lru.get(KEY), opts.loops))
+        print "%-24s %10.1fus" % ("SharedCache hit", timed(
+                lambda: shared.get(KEY), opts.loops))
+
+        if opts.server:
+            connection.add_pool(opts.keyspace, [opts.server])
+            key = Key(opts.keyspace, opts.column_family, opts.row)
+            print "%-24s %10.1fus" % ("get_slice", timed(
+                    lambda: list(iterators.slice_iterator(key, None)),
+                    opts.loops / 10))
+        else:
+            print "%-24s %10.1fus" % ("loopback round trip", timed(
+                    loopback(), opts.loops))
+            print "%-24s %10.1fus" % ("Thrift decode", timed(
+                    thrift_decode(), opts.loops))
+    finally:
+        shared.close()
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,14 @@ from lazyboy.connection import add_pool, get_pool
 from lazyboy.key import Key
 from lazyboy.record import Record, MirroredRecord
 from lazyboy.recordset import RecordSet, KeyRecordSet
+from lazyboy.query import Query
+from lazyboy.scan import ParallelScanner
+from lazyboy.session import Session
 from lazyboy.view import (View, PartitionedView, BatchLoadingView,
                           FaultTolerantView)
 from lazyboy.iterators import slice_iterator, sparse_get, sparse_multiget, \
-    key_range, key_range_iterator, pack, unpack, multigetterator
+    key_range, key_range_iterator, range_iterator, pack, unpack, \
+    multigetterator, multiget_stream, list_multigetterator
 from . import column_crud
 from . import exceptions
+from . import workers
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Large values, split across columns.
+
+A blob is stored in a row as a manifest column, holding its size and
+checksum, plus one column per chunk of the value:
+
+    write_blob(Key("Assets", "Images", "logo"), "png", open("logo.png"))
+    data = open_blob(Key("Assets", "Images", "logo"), "png").read()
+
+Chunk names include a version, so a blob which is being replaced
+remains readable until the new manifest is written, which happens
+after every chunk is. The old version's chunks are removed afterwards.
+"""
+
+from __future__ import with_statement
+import uuid
+import threading
+from hashlib import md5
+from cStringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from cassandra.ttypes import Column, ConsistencyLevel, Deletion, \
+    Mutation, SlicePredicate
+
+import lazyboy.connection as connection
+from lazyboy.iterators import unpack
+from lazyboy.record import Record, mutation_map
+from lazyboy.workers import WorkerPool, spawn
+import lazyboy.cache as cache
+import lazyboy.exceptions as exc
+
+# Bytes per chunk column
+CHUNK_SIZE = 256 * 1024
+
+# Chunks written or read per request
+BATCH_CHUNKS = 4
+
+# Timestamps of blobs removed by this process in the current second
+_REMOVED = {}
+_REMOVED_LOCK = threading.Lock()
+
+
+def _removed(key, name, timestamp=None):
+    """Return when this process last removed a blob, recording timestamp.
+
+    Removals are only remembered until the clock passes them, since a
+    later write is newer anyway."""
+    now = Record.timestamp()
+    blob_key = cache.cache_key(key) + (name,)
+    with _REMOVED_LOCK:
+        for (old, stamp) in _REMOVED.items():
+            if stamp < now:
+                del _REMOVED[old]
+        if timestamp is not None:
+            _REMOVED[blob_key] = timestamp
+        return _REMOVED.get(blob_key)
+
+
+def _timestamp(key, name, old_timestamp):
+    """Return the timestamp for a new version of a blob.
+
+    Blobs use the same one-second timestamps as Record, but a version
+    must be newer than the one it replaces, or the removal before it,
+    even within a second."""
+    newest = max(old_timestamp, _removed(key, name))
+    if newest is None:
+        return Record.timestamp()
+    return max(Record.timestamp(), newest + 1)
+
+
+def chunk_name(name, version, index):
+    """Return the column name of a chunk of a blob."""
+    return "%s:%s:%08d" % (name, version, index)
+
+
+def _get_columns(key, names, consistency):
+    """Return a dict of Columns from key."""
+    return dict((col.name, col) for col in unpack(
+            connection.get_pool(key.keyspace).get_slice(
+                key.key, key, SlicePredicate(column_names=list(names)),
+                consistency) or ()))
+
+
+def _get(key, names, consistency):
+    """Return a dict of column values from key."""
+    return dict((name, col.value) for (name, col)
+                in _get_columns(key, names, consistency).iteritems())
+
+
+def _send(key, columns, consistency):
+    """Write columns to key."""
+    connection.get_pool(key.keyspace).batch_mutate(
+        mutation_map(key, columns), consistency)
+    cache.invalidate(key)
+
+
+def _delete(key, names, timestamp, consistency):
+    """Remove columns from key."""
+    if not names:
+        return
+    deletion = Deletion(timestamp=timestamp, super_column=key.super_column,
+                        predicate=SlicePredicate(column_names=list(names)))
+    connection.get_pool(key.keyspace).batch_mutate(
+        {key.key: {key.column_family: [Mutation(deletion=deletion)]}},
+        consistency)
+    cache.invalidate(key)
+
+
+def _chunk_names(name, manifest):
+    """Return the column names of every chunk in a manifest."""
+    return [chunk_name(name, manifest['version'], index)
+            for index in range(manifest['chunks'])]
+
+
+def _get_manifest(key, name, consistency):
+    """Return (manifest, timestamp) of a blob, or (None, None)."""
+    col = _get_columns(key, [name], consistency).get(name)
+    if col is None or not col.value:
+        return (None, None)
+    return (json.loads(col.value), col.timestamp)
+
+
+def get_manifest(key, name, consistency=None):
+    """Return the manifest of a blob, or None if it doesn't exist."""
+    return _get_manifest(key, name, consistency or ConsistencyLevel.ONE)[0]
+
+
+def write_blob(key, name, data, chunk_size=CHUNK_SIZE,
+               batch_chunks=BATCH_CHUNKS, concurrency=4, consistency=None):
+    """Store data, a string or file-like object, as a blob.
+
+    The data is read chunk_size bytes at a time, and batches of
+    batch_chunks chunks are written from `concurrency' threads; the
+    number of chunks held in memory is bounded. Returns the manifest.
+    """
+    consistency = consistency or ConsistencyLevel.ONE
+    if isinstance(data, basestring):
+        data = StringIO(data)
+
+    (old, old_timestamp) = _get_manifest(key, name, consistency)
+    timestamp = _timestamp(key, name, old_timestamp)
+    manifest = {'version': uuid.uuid4().hex[:12], 'chunk_size': chunk_size,
+                'size': 0, 'chunks': 0}
+    checksum = md5()
+    pool = WorkerPool(workers=concurrency, queue_size=concurrency,
+                      name="lazyboy-blob")
+    futures, batch = [], []
+    try:
+        while True:
+            chunk = data.read(chunk_size)
+            if chunk:
+                checksum.update(chunk)
+                batch.append(Column(chunk_name(name, manifest['version'],
+                                               manifest['chunks']),
+                                    chunk, timestamp))
+                manifest['chunks'] += 1
+                manifest['size'] += len(chunk)
+
+            if batch and (len(batch) >= batch_chunks or not chunk):
+                futures.append(pool.submit(_send, key, batch, consistency))
+                batch = []
+            if not chunk:
+                break
+    finally:
+        pool.drain()
+
+    manifest['md5'] = checksum.hexdigest()
+    try:
+        for future in futures:
+            future.result()
+    except Exception:
+        # Don't leave the chunks of a blob which was never committed
+        _delete(key, _chunk_names(name, manifest), timestamp, consistency)
+        raise
+
+    _send(key, [Column(name, json.dumps(manifest), timestamp)], consistency)
+
+    if old:
+        _delete(key, _chunk_names(name, old), timestamp, consistency)
+    return manifest
+
+
+def open_blob(key, name, consistency=None, batch_chunks=BATCH_CHUNKS,
+              prefetch=True):
+    """Return a BlobReader for a blob, raising ErrorNoSuchRecord if missing."""
+    consistency = consistency or ConsistencyLevel.ONE
+    manifest = get_manifest(key, name, consistency)
+    if manifest is None:
+        raise exc.ErrorNoSuchRecord("No blob %s in %s" % (name, key))
+    return BlobReader(key, name, manifest, consistency, batch_chunks,
+                      prefetch)
+
+
+def remove_blob(key, name, consistency=None):
+    """Remove a blob and its chunks."""
+    consistency = consistency or ConsistencyLevel.ONE
+    (manifest, timestamp) = _get_manifest(key, name, consistency)
+    if manifest is None:
+        return
+    # Delete this version and anything older, but not a newer one
+    _delete(key, [name] + _chunk_names(name, manifest), timestamp,
+            consistency)
+    _removed(key, name, timestamp)
+
+
+class BlobReader(object):
+
+    """A read-only file-like object which streams a blob.
+
+    Chunks are fetched batch_chunks at a time; if prefetch is True,
+    the next batch is fetched in the background while the current one
+    is read. The size and checksum are verified once the whole blob
+    has been read, raising ErrorCorruptData on a mismatch.
+    """
+
+    def __init__(self, key, name, manifest, consistency=None,
+                 batch_chunks=BATCH_CHUNKS, prefetch=True):
+        self.key, self.name, self.manifest = key, name, manifest
+        self.size = manifest['size']
+        self.consistency = consistency or ConsistencyLevel.ONE
+        self.batch_chunks = batch_chunks
+        self.prefetch = prefetch
+        self.closed = False
+        self._chunks = self._iter_chunks()
+        self._buffer = ""
+        self._pos = 0
+        self._checksum = md5()
+
+    def _fetch(self, names):
+        """Return the values of chunk columns, in order."""
+        values = _get(self.key, names, self.consistency)
+        missing = [chunk for chunk in names if chunk not in values]
+        if missing:
+            raise exc.ErrorCorruptData("Blob %s is missing chunk %s" %
+                                       (self.name, missing[0]))
+        return [values[chunk] for chunk in names]
+
+    def _iter_chunks(self):
+        """Yield the chunks of the blob."""
+        names = _chunk_names(self.name, self.manifest)
+        batches = [names[start:start + self.batch_chunks]
+                   for start in range(0, len(names), self.batch_chunks)]
+        pending = None
+        for (index, batch) in enumerate(batches):
+            chunks = pending.result() if pending else self._fetch(batch)
+            pending = None
+            if self.prefetch and index + 1 < len(batches):
+                pending = spawn(self._fetch, batches[index + 1])
+            for chunk in chunks:
+                yield chunk
+
+    def _fill(self, size):
+        """Buffer at least size bytes, or everything that remains."""
+        while size < 0 or len(self._buffer) < size:
+            try:
+                chunk = self._chunks.next()
+            except StopIteration:
+                self._verify()
+                break
+            self._checksum.update(chunk)
+            self._buffer += chunk
+
+    def _verify(self):
+        """Check the data read against the manifest."""
+        if (self._pos + len(self._buffer) != self.size or
+            self._checksum.hexdigest() != self.manifest.get('md5')):
+            raise exc.ErrorCorruptData("Blob %s failed its checksum." %
+                                       self.name)
+
+    def read(self, size=-1):
+        """Return up to size bytes, or the rest of the blob."""
+        if self.closed:
+            raise ValueError("I/O operation on closed blob")
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        (data, self._buffer) = (self._buffer[:size], self._buffer[size:])
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        """Return the current position in the blob."""
+        return self._pos
+
+    def __iter__(self):
+        """Yield the blob's data, a chunk at a time."""
+        while True:
+            data = self.read(self.manifest['chunk_size'])
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        """Stop reading the blob."""
+        self.closed = True
+        self._buffer = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Stream large datasets into a column family.
+
+This can be used as a module:
+
+    loader = BulkLoader(Key("UserData", "Users"), key_field="username")
+    loader.load(read_jsonl(open("users.jsonl")))
+
+Or from the command line:
+
+    lazyboy-load -s localhost:9160 -k UserData -c Users -f username \\
+        users.jsonl
+"""
+
+from __future__ import with_statement
+import csv
+import sys
+import time
+import logging
+import threading
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from cassandra.ttypes import Column, ConsistencyLevel
+
+import lazyboy.connection as connection
+import lazyboy.cache as cache
+from lazyboy.commit import merge_mutations
+from lazyboy.key import Key
+from lazyboy.record import Record, mutation_map
+from lazyboy.workers import WorkerPool
+import lazyboy.exceptions as exc
+
+
+def read_jsonl(stream):
+    """Yield a dict for each line of JSON in stream."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream, **kwargs):
+    """Yield a dict for each row of CSV in stream.
+
+    The first row holds the column names."""
+    return csv.DictReader(stream, **kwargs)
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+class LoadStats(object):
+
+    """Throughput counters for a bulk load."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.rows = self.bytes = self.batches = self.failed_batches = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows, bytes_, failed=False):
+        """Count a finished batch."""
+        with self._lock:
+            if failed:
+                self.failed_batches += 1
+                return
+            self.rows += rows
+            self.bytes += bytes_
+            self.batches += 1
+
+    def elapsed(self):
+        """Return seconds since the load started."""
+        return max(time.time() - self.start, 1e-6)
+
+    def rows_per_sec(self):
+        """Return the average rows written per second."""
+        return self.rows / self.elapsed()
+
+    def bytes_per_sec(self):
+        """Return the average bytes written per second."""
+        return self.bytes / self.elapsed()
+
+    def __repr__(self):
+        return ("%d rows (%.0f rows/sec), %d bytes (%.0f bytes/sec), "
+                "%d batches, %d failed" % (
+                self.rows, self.rows_per_sec(), self.bytes,
+                self.bytes_per_sec(), self.batches, self.failed_batches))
+
+
+class BulkLoader(object):
+
+    """Load a stream of rows into a column family.
+
+    Each row is a dict. If record_class is given, rows are mapped to
+    instances of it (which must be valid, and have a key once
+    updated); otherwise every item except key_field is written as a
+    column in the row named by key_field.
+
+    Rows are grouped into batch_size-row batch_mutate calls, which are
+    sent from `concurrency' threads. Each thread has its own
+    connection, so the work is spread across the pool's servers. The
+    queue of pending batches is bounded, so reading the input stalls
+    when the cluster can't keep up. Failed batches are retried with
+    a linear backoff; batches which still fail are logged, counted and
+    passed to on_error.
+    """
+
+    def __init__(self, key=None, record_class=None, key_field='key',
+                 batch_size=500, concurrency=4, retries=3, backoff=1.0,
+                 consistency=None, on_error=None, progress_interval=10):
+        assert isinstance(key, Key) or (key is None and record_class)
+        self.key = key
+        self.record_class = record_class
+        self.key_field = key_field
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.consistency = consistency or ConsistencyLevel.ONE
+        self.on_error = on_error
+        self.progress_interval = progress_interval
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.stats = None
+
+    def row_mutations(self, row):
+        """Return (mutation map, size in bytes) for a row."""
+        return self._row_mutations(row)[1:]
+
+    def _row_mutations(self, row):
+        """Return (Key, mutation map, size in bytes) for a row."""
+        if self.record_class:
+            return self._record_mutations(row)
+
+        row = dict(row)
+        key = self.key.clone(key=str(row.pop(self.key_field)))
+        timestamp = Record.timestamp()
+        columns = [Column(_sanitize(name), _sanitize(value), timestamp)
+                   for (name, value) in row.iteritems() if value is not None]
+        return (key, mutation_map(key, columns), _size(columns))
+
+    def _record_mutations(self, row):
+        """Return (Key, mutation map, size in bytes) for a row, as a Record."""
+        record = self.record_class()
+        record.update(row)
+        if not record.valid():
+            raise exc.ErrorMissingField("Missing required field(s):",
+                                        record.missing())
+        if self.key_field in row:
+            record.set_key(str(row[self.key_field]))
+        elif not record.key:
+            record.key = record.default_key()
+
+        columns = record._marshal()['changed']
+        return (record.key, mutation_map(record.key, columns),
+                _size(columns))
+
+    def _send(self, keyspace, batch, keys, rows, bytes_):
+        """Send a batch, retrying failures.
+
+        The cached rows of keys are invalidated once the batch has been
+        written, or given up on, so reads while it's in flight can't
+        cache the old rows."""
+        attempt = 1
+        try:
+            while True:
+                try:
+                    connection.get_pool(keyspace).batch_mutate(
+                        batch, self.consistency)
+                    self.stats.add(rows, bytes_)
+                    return
+                except Exception, ex:
+                    if attempt > self.retries:
+                        self.stats.add(rows, bytes_, failed=True)
+                        self.log.error("Giving up on a batch of %d rows: %s",
+                                       rows, ex)
+                        if self.on_error:
+                            self.on_error(batch, ex)
+                        return
+                    time.sleep(self.backoff * attempt)
+                    attempt += 1
+        finally:
+            for key in keys:
+                cache.invalidate(key)
+
+    def load(self, rows):
+        """Load an iterable of rows, returns LoadStats."""
+        self.stats = LoadStats()
+        pool = WorkerPool(workers=self.concurrency,
+                          queue_size=self.concurrency * 2,
+                          name="lazyboy-load")
+        keyspace = (self.key.keyspace if self.key
+                    else self.record_class._keyspace)
+        last_report = time.time()
+        batch, keys, num_rows, num_bytes = [], [], 0, 0
+        try:
+            for row in rows:
+                (key, mutations, size) = self._row_mutations(row)
+                batch.append(mutations)
+                keys.append(key)
+                num_rows += 1
+                num_bytes += size
+
+                if num_rows >= self.batch_size:
+                    pool.submit(self._send, keyspace, merge_mutations(batch),
+                                keys, num_rows, num_bytes)
+                    batch, keys, num_rows, num_bytes = [], [], 0, 0
+
+                if time.time() - last_report >= self.progress_interval:
+                    self.log.info("%r", self.stats)
+                    last_report = time.time()
+
+            if batch:
+                pool.submit(self._send, keyspace, merge_mutations(batch),
+                            keys, num_rows, num_bytes)
+        finally:
+            pool.drain()
+
+        self.log.info("Finished: %r", self.stats)
+        return self.stats
+
+
+def _sanitize(value):
+    """Return a value appropriate for sending to Cassandra."""
+    if value.__class__ is unicode:
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _size(columns):
+    """Return the number of bytes in a sequence of columns."""
+    return sum(len(col.name) + len(col.value) for col in columns)
+
+
+def _import(path):
+    """Return the object named by a dotted path, e.g. `pkg.mod.Class'."""
+    (module, _, name) = path.replace(':', '.').rpartition('.')
+    return getattr(__import__(module, {}, {}, [name]), name)
+
+
+def main(argv=None):
+    """Run the bulk loader from the command line."""
+    parser = OptionParser(
+        usage="%prog [options] -k KEYSPACE -c COLUMN_FAMILY [FILE...]")
+    parser.add_option("-s", "--server", action="append", dest="servers",
+                      default=[], help="host:port of a server (repeatable)")
+    parser.add_option("-k", "--keyspace", help="Keyspace to load into")
+    parser.add_option("-c", "--column-family", help="Column family")
+    parser.add_option("-f", "--key-field", default="key",
+                      help="Input field holding the row key")
+    parser.add_option("-F", "--format", choices=READERS.keys(),
+                      default="jsonl", help="Input format (jsonl, csv)")
+    parser.add_option("-r", "--record-class",
+                      help="Dotted path to a Record subclass to map rows to")
+    parser.add_option("-b", "--batch-size", type="int", default=500)
+    parser.add_option("-j", "--concurrency", type="int", default=4)
+    parser.add_option("--retries", type="int", default=3)
+    parser.add_option("--consistency", default="ONE")
+    parser.add_option("-q", "--quiet", action="store_true", default=False)
+    (opts, args) = parser.parse_args(argv)
+
+    if not opts.keyspace or not opts.column_family:
+        parser.error("A keyspace and column family are required.")
+
+    logging.basicConfig(level=logging.WARN if opts.quiet else logging.INFO,
+                        format="%(asctime)s %(message)s")
+    connection.add_pool(opts.keyspace, opts.servers or ['localhost:9160'])
+
+    loader = BulkLoader(
+        Key(opts.keyspace, opts.column_family),
+        record_class=(_import(opts.record_class)
+                      if opts.record_class else None),
+        key_field=opts.key_field, batch_size=opts.batch_size,
+        concurrency=opts.concurrency, retries=opts.retries,
+        consistency=getattr(ConsistencyLevel, opts.consistency.upper()))
+
+    reader = READERS[opts.format]
+    failed = 0
+    for path in args or ['-']:
+        stream = sys.stdin if path == '-' else open(path)
+        try:
+            failed += loader.load(reader(stream)).failed_batches
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Process-local row cache.
+
+Caches are registered per keyspace, or per column family:
+
+    add_cache("UserData", "Users", max_size=50000, ttl=60)
+
+Record.load and multigetterator then serve whole rows of that column
+family from the cache, and only fetch the rows which miss. Writes
+made through lazyboy (Record.save and remove, remove_key, column_crud
+and View) invalidate the rows they touch. Writes made by other
+processes are only picked up when entries expire, so set a ttl if
+there are any.
+
+A negative cache remembers rows which don't exist, so repeated loads
+of them raise ErrorNoSuchRecord without a request:
+
+    add_negative_cache("UserData", "Users", ttl=5)
+
+Only full-row reads which come back empty are remembered; lazyboy's
+own writes to a row forget it.
+"""
+
+from __future__ import with_statement
+import time
+import threading
+
+from cassandra.ttypes import Column, SuperColumn
+
+# Returned by LRUCache.get for keys which aren't cached
+MISS = object()
+
+_CACHES = {}
+_NEGATIVE = {}
+
+# Indexes into the linked list nodes: [prev, next, key, value, expires]
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = range(5)
+
+
+def cache_key(key):
+    """Return the cache key for a Key."""
+    return (key.keyspace, key.column_family, key.key, key.super_column)
+
+
+def serialize_columns(columns):
+    """Return columns as a marshallable (is_super, items) tuple."""
+    columns = tuple(columns)
+    if columns and isinstance(columns[0], SuperColumn):
+        return (True, tuple((col.name, serialize_columns(col.columns)[1])
+                            for col in columns))
+    return (False, tuple((col.name, col.value, col.timestamp, col.ttl)
+                         for col in columns))
+
+
+def deserialize_columns(packed):
+    """Return Columns from serialize_columns output."""
+    (is_super, items) = packed
+    if is_super:
+        return tuple(SuperColumn(name, [Column(*col) for col in cols])
+                     for (name, cols) in items)
+    return tuple([Column(*col) for col in items])
+
+
+class LRUCache(object):
+
+    """A thread-safe, size-bounded LRU cache with an optional TTL.
+
+    Entries are keyed by (keyspace, column family, row, super column).
+    An index of the entries for each row lets a row be invalidated
+    along with all its super columns.
+    """
+
+    def __init__(self, max_size=10000, ttl=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._map = {}
+        self._rows = {}
+        # Sentinel of a circular list, most recently used first
+        self._head = [None, None, None, None, None]
+        self._head[_PREV] = self._head[_NEXT] = self._head
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        # Bumped by every invalidation; see set()
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._map)
+
+    def _unlink(self, node):
+        """Remove a node from the list."""
+        node[_PREV][_NEXT] = node[_NEXT]
+        node[_NEXT][_PREV] = node[_PREV]
+
+    def _link(self, node):
+        """Add a node at the front of the list."""
+        head = self._head
+        node[_PREV], node[_NEXT] = head, head[_NEXT]
+        head[_NEXT][_PREV] = node
+        head[_NEXT] = node
+
+    def _drop(self, node):
+        """Remove a node from the cache."""
+        self._unlink(node)
+        key = node[_KEY]
+        del self._map[key]
+        row = key[:3]
+        supers = self._rows[row]
+        supers.discard(key[3])
+        if not supers:
+            del self._rows[row]
+
+    def get(self, key):
+        """Return the value cached for key, or MISS."""
+        with self._lock:
+            node = self._map.get(key)
+            if node is None:
+                self.misses += 1
+                return MISS
+            if node[_EXPIRES] is not None and node[_EXPIRES] <= time.time():
+                self._drop(node)
+                self.expirations += 1
+                self.misses += 1
+                return MISS
+            self._unlink(node)
+            self._link(node)
+            self.hits += 1
+            return node[_VALUE]
+
+    def set(self, key, value, generation=None):
+        """Cache value for key, evicting the least recently used entry.
+
+        If generation is given, the value is only cached if nothing
+        was invalidated since self.generation had that value. Reading
+        the generation before fetching a row keeps a slow read from
+        caching data which a concurrent write has replaced."""
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            node = self._map.get(key)
+            if node is not None:
+                self._unlink(node)
+                node[_VALUE], node[_EXPIRES] = value, expires
+            else:
+                node = [None, None, key, value, expires]
+                self._map[key] = node
+                self._rows.setdefault(key[:3], set()).add(key[3])
+            self._link(node)
+
+            while len(self._map) > self.max_size:
+                self._drop(self._head[_PREV])
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove a row, and any of its super columns, from the cache."""
+        with self._lock:
+            self.generation += 1
+            for super_column in list(self._rows.get(key[:3], ())):
+                self._drop(self._map[key[:3] + (super_column,)])
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock:
+            self.generation += 1
+            self._map.clear()
+            self._rows.clear()
+            self._head[_PREV] = self._head[_NEXT] = self._head
+
+    def stats(self):
+        """Return a dict of cache metrics."""
+        lookups = self.hits + self.misses
+        return {'size': len(self._map), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+
+class TieredCache(object):
+
+    """Caches consulted in order, e.g. a process-local LRUCache, then a
+    lazyboy.shmcache.SharedCache.
+
+    Hits in a lower tier are copied to the tiers above it; sets and
+    invalidations go to every tier. Entries in upper tiers remember
+    the generations of the tiers below them, and are ignored once any
+    of those has moved on, so invalidations made through a shared
+    tier by other processes reach every process.
+    """
+
+    def __init__(self, *tiers):
+        assert tiers, "A TieredCache needs at least one tier."
+        self.tiers = tiers
+
+    def __len__(self):
+        return len(self.tiers[0])
+
+    @property
+    def generation(self):
+        """The generations of every tier."""
+        return tuple(tier.generation for tier in self.tiers)
+
+    def get(self, key):
+        """Return the value cached for key, or MISS."""
+        generation = self.generation
+        last = len(self.tiers) - 1
+        for (index, tier) in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is MISS:
+                continue
+            if index < last:
+                (below, value) = value
+                if below != generation[index + 1:]:
+                    continue
+            for upper in range(index):
+                self.tiers[upper].set(key, (generation[upper + 1:], value),
+                                      generation[upper])
+            return value
+        return MISS
+
+    def set(self, key, value, generation=None):
+        """Cache value for key in every tier."""
+        current = generation if generation is not None else self.generation
+        last = len(self.tiers) - 1
+        for (index, tier) in enumerate(self.tiers):
+            tier.set(key, (current[index + 1:], value) if index < last
+                     else value,
+                     generation[index] if generation is not None else None)
+
+    def invalidate(self, key):
+        """Remove a row from every tier."""
+        for tier in reversed(self.tiers):
+            tier.invalidate(key)
+
+    def clear(self):
+        """Remove everything from every tier."""
+        for tier in reversed(self.tiers):
+            tier.clear()
+
+    def stats(self):
+        """Return a list of each tier's metrics."""
+        return [tier.stats() for tier in self.tiers]
+
+
+def add_cache(keyspace, column_family=None, max_size=10000, ttl=None,
+              cache=None):
+    """Cache rows from a keyspace, or one of its column families.
+
+    Returns the cache, which is a new LRUCache unless one is given."""
+    if cache is None:
+        cache = LRUCache(max_size, ttl)
+    _CACHES[(keyspace, column_family)] = cache
+    return cache
+
+
+def remove_cache(keyspace, column_family=None):
+    """Stop caching rows from a keyspace or column family."""
+    _CACHES.pop((keyspace, column_family), None)
+
+
+def add_negative_cache(keyspace, column_family=None, ttl=5,
+                       max_size=100000, cache=None):
+    """Remember missing rows in a keyspace or column family for ttl seconds.
+
+    Returns the cache, which is a new LRUCache unless one is given."""
+    if cache is None:
+        cache = LRUCache(max_size, ttl)
+    _NEGATIVE[(keyspace, column_family)] = cache
+    return cache
+
+
+def remove_negative_cache(keyspace, column_family=None):
+    """Stop remembering missing rows in a keyspace or column family."""
+    _NEGATIVE.pop((keyspace, column_family), None)
+
+
+def _find(registry, key):
+    """Return the cache in registry for a Key's column family, or None."""
+    if not registry:
+        return None
+    cache = registry.get((key.keyspace, key.column_family))
+    if cache is None:
+        cache = registry.get((key.keyspace, None))
+    return cache
+
+
+def get_cache(key):
+    """Return the cache for a Key's column family, or None."""
+    return _find(_CACHES, key)
+
+
+def get_negative_cache(key):
+    """Return the negative cache for a Key's column family, or None."""
+    return _find(_NEGATIVE, key)
+
+def get_columns(key):
+    """Return the cached columns of a Key's row, or MISS."""
+    cache = get_cache(key)
+    return cache.get(cache_key(key)) if cache is not None else MISS
+
+
+def generation(key):
+    """Return the generation of a Key's cache, or None if it has none."""
+    cache = get_cache(key)
+    return cache.generation if cache is not None else None
+
+
+def set_columns(key, columns, generation=None):
+    """Cache the columns of a Key's row, returns them as a tuple."""
+    columns = tuple(columns)
+    cache = get_cache(key)
+    if cache is not None:
+        cache.set(cache_key(key), columns, generation)
+    return columns
+
+
+def is_missing(key):
+    """Return True if a Key's row is known not to exist."""
+    cache = get_negative_cache(key)
+    return cache is not None and cache.get(cache_key(key)) is not MISS
+
+
+def missing_generation(key):
+    """Return the generation of a Key's negative cache, or None."""
+    cache = get_negative_cache(key)
+    return cache.generation if cache is not None else None
+
+
+def set_missing(key, generation=None):
+    """Remember that a Key's row doesn't exist."""
+    cache = get_negative_cache(key)
+    if cache is not None:
+        cache.set(cache_key(key), True, generation)
+
+
+def invalidate(key):
+    """Remove a Key's row from its caches."""
+    cache = get_cache(key)
+    if cache is not None:
+        cache.invalidate(cache_key(key))
+    cache = get_negative_cache(key)
+    if cache is not None:
+        cache.invalidate(cache_key(key))
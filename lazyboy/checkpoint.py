@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Resumable scans.
+
+Scans which support checkpoints have checkpoint(), which returns their
+position as a dict (or None if they haven't started), and restore(),
+which makes them start after a position. ResumableScan and View both
+do. Checkpointer saves checkpoints to a file while a scan runs, and
+restores them when it's run again:
+
+    scan = ResumableScan(Key("UserData", "Users"))
+    for (key, columns) in Checkpointer("users.ckpt").run(scan):
+        ...
+
+If the job dies, running it again carries on after the last row which
+was saved; rows after that may be seen twice. The file is removed
+when the scan finishes.
+"""
+
+from __future__ import with_statement
+import os
+import time
+import logging
+import tempfile
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lazyboy.connection import get_pool
+from lazyboy.iterators import range_iterator, key_token
+
+
+def _to_json(value):
+    """Return value with byte strings converted for JSON."""
+    if isinstance(value, str):
+        # Latin-1 maps every byte to a code point, so this is lossless
+        return value.decode('latin-1')
+    if isinstance(value, dict):
+        return dict((_to_json(key), _to_json(val))
+                    for (key, val) in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_to_json(val) for val in value]
+    return value
+
+
+def _from_json(value):
+    """Return value with strings converted back to bytes."""
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, dict):
+        return dict((_from_json(key), _from_json(val))
+                    for (key, val) in value.iteritems())
+    if isinstance(value, list):
+        return [_from_json(val) for val in value]
+    return value
+
+
+def save_checkpoint(path, state):
+    """Atomically write a checkpoint to path."""
+    (fd, tmp) = tempfile.mkstemp(prefix=".%s." % os.path.basename(path),
+                                 dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, 'w') as out:
+            json.dump(_to_json(state), out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+def load_checkpoint(path):
+    """Return the checkpoint saved in path, or None if there isn't one."""
+    try:
+        with open(path) as checkpoint:
+            return _from_json(json.load(checkpoint))
+    except IOError:
+        return None
+
+
+class ResumableScan(object):
+
+    """A range scan which can be checkpointed.
+
+    Arguments are passed to range_iterator. The checkpoint holds the
+    last row key returned; a restored scan starts after it, by key or
+    by token, depending on how the range is bounded."""
+
+    def __init__(self, key=None, partitioner=None, **range_args):
+        self.key = key or range_args['record_class']().make_key()
+        self.range_args = range_args
+        self.partitioner = partitioner
+        self.last_key = None
+        self.rows = 0
+
+    def checkpoint(self):
+        """Return the position of the scan."""
+        if self.last_key is None:
+            return None
+        return {'last_key': self.last_key, 'rows': self.rows}
+
+    def restore(self, state):
+        """Start the scan after a checkpoint."""
+        self.last_key = state and state['last_key']
+        self.rows = state['rows'] if state else 0
+
+    def _resume_args(self):
+        """Return range_iterator arguments to carry on after last_key."""
+        args = dict(self.range_args)
+        if self.last_key is None:
+            return args
+
+        if args.get('finish_token') is not None:
+            if self.partitioner is None:
+                self.partitioner = get_pool(
+                    self.key.keyspace).describe_partitioner()
+            args['start_token'] = key_token(self.last_key, self.partitioner)
+        else:
+            args['start'] = self.last_key
+        return args
+
+    def __iter__(self):
+        for row in range_iterator(self.key, **self._resume_args()):
+            row_key = (row[0] if isinstance(row, tuple) else row.key).key
+            if row_key == self.last_key:
+                # Key ranges start with the last row returned
+                continue
+            self.last_key = row_key
+            self.rows += 1
+            yield row
+
+
+class Checkpointer(object):
+
+    """Run a scan, saving checkpoints to a file every interval seconds.
+
+    A checkpoint is taken once a row has been consumed, i.e. when the
+    next one is asked for, and is also saved if the consumer stops or
+    raises an error."""
+
+    def __init__(self, path, interval=60):
+        self.path = path
+        self.interval = interval
+        self.log = logging.getLogger(self.__class__.__name__)
+
+    def load(self):
+        """Return the saved checkpoint, or None."""
+        return load_checkpoint(self.path)
+
+    def save(self, state):
+        """Save a checkpoint."""
+        if state is not None:
+            save_checkpoint(self.path, state)
+
+    def clear(self):
+        """Remove the saved checkpoint."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def run(self, scan):
+        """Yield items from scan, resuming from and saving checkpoints."""
+        state = self.load()
+        if state is not None:
+            self.log.info("Resuming from %r", state)
+            scan.restore(state)
+
+        last_save = time.time()
+        (done, finished) = (state, False)
+        try:
+            for item in scan:
+                yield item
+                done = scan.checkpoint()
+                if time.time() - last_save >= self.interval:
+                    self.save(done)
+                    last_save = time.time()
+            finished = True
+        finally:
+            if finished:
+                self.clear()
+            else:
+                self.save(done)
@@ -10,6 +10,7 @@ from cassandra import ttypes as cas_types
 
 from lazyboy.connection import get_pool
 from lazyboy.iterators import unpack
+import lazyboy.cache as cache
 
 
 def get_column(key, column_name, consistency=None):
@@ -39,6 +40,7 @@ def set(key, name, value, timestamp=None, consistency=None):
     get_pool(key.keyspace).insert(
         key.key, key.get_path(column=name), value, timestamp,
         consistency)
+    cache.invalidate(key)
 
 
 def remove(key, column, timestamp=None, consistency=None):
@@ -47,3 +49,4 @@ def remove(key, column, timestamp=None, consistency=None):
     get_pool(key.keyspace).remove(key.key,
                                   key.get_path(column=column), timestamp,
                                   consistency)
+    cache.invalidate(key)
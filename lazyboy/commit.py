@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Group commit of mutations from many threads."""
+
+from __future__ import with_statement
+import sys
+import threading
+import time
+
+from cassandra.ttypes import InvalidRequestException
+
+# How long the first writer waits for others to join its batch, in seconds
+DEFAULT_WINDOW = 0.002
+
+# Errors caused by the content of a batch, rather than by the connection.
+# Only these are worth retrying one write at a time.
+REQUEST_ERRORS = (InvalidRequestException,)
+
+
+def merge_mutations(mutation_maps):
+    """Return a single mutation map containing all the given mutations.
+
+    The input maps are not modified."""
+    out = {}
+    for mutation_map in mutation_maps:
+        for (row_key, col_fams) in mutation_map.iteritems():
+            row = out.setdefault(row_key, {})
+            for (col_fam, mutations) in col_fams.iteritems():
+                row.setdefault(col_fam, []).extend(mutations)
+    return out
+
+
+class _PendingWrite(object):
+
+    """A mutation waiting to be written as part of a group."""
+
+    def __init__(self, mutation_map, consistency_level):
+        self.mutation_map = mutation_map
+        self.consistency_level = consistency_level
+        self._done = threading.Event()
+        self._result, self._exc_info = None, None
+
+    def set_result(self, result):
+        """Mark the write as acknowledged."""
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exc_info):
+        """Mark the write as failed."""
+        self._exc_info = exc_info
+        self._done.set()
+
+    def result(self):
+        """Wait for the write, returning its result or raising its error."""
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class GroupCommitter(object):
+
+    """Merge concurrent batch_mutate calls into a single request.
+
+    The first thread to submit a mutation becomes the leader for the
+    group. It waits up to `window' seconds for other threads to submit
+    theirs, then sends everything in one batch_mutate per consistency
+    level, using its own connection. Every submitter blocks until its
+    own mutations are acknowledged.
+
+    If the server rejects a combined batch, each mutation in it is
+    retried on its own, so every caller sees the outcome of its own
+    write. Any other failure is passed to every caller in the group.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, max_batch=None):
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = []
+        self._collecting = False
+
+    def submit(self, send, mutation_map, consistency_level):
+        """Submit a mutation and block until it is written.
+
+        `send' is called as send(mutation_map, consistency_level) if
+        this thread ends up leading the group."""
+        write = _PendingWrite(mutation_map, consistency_level)
+        with self._cond:
+            self._pending.append(write)
+            lead = not self._collecting
+            self._collecting = True
+            if self._full():
+                self._cond.notify()
+
+        if lead:
+            self._lead(send)
+
+        return write.result()
+
+    def _full(self):
+        """Return True if the pending group has reached max_batch."""
+        return bool(self.max_batch) and len(self._pending) >= self.max_batch
+
+    def _lead(self, send):
+        """Collect writes for the window, then commit them."""
+        deadline = time.time() + self.window
+        with self._cond:
+            remaining = self.window
+            while remaining > 0 and not self._full():
+                self._cond.wait(remaining)
+                remaining = deadline - time.time()
+            group, self._pending = self._pending, []
+            self._collecting = False
+
+        self._commit(send, group)
+
+    def _commit(self, send, group):
+        """Send a group of writes, one batch per consistency level."""
+        levels = {}
+        for write in group:
+            levels.setdefault(write.consistency_level, []).append(write)
+
+        for (level, writes) in levels.iteritems():
+            try:
+                result = send(merge_mutations(w.mutation_map for w in writes),
+                              level)
+            except REQUEST_ERRORS:
+                if len(writes) == 1:
+                    writes[0].set_exception(sys.exc_info())
+                    continue
+                for write in writes:
+                    self._commit_one(send, write)
+                continue
+            except Exception:
+                exc_info = sys.exc_info()
+                for write in writes:
+                    write.set_exception(exc_info)
+                continue
+
+            for write in writes:
+                write.set_result(result)
+
+    def _commit_one(self, send, write):
+        """Send a single write by itself."""
+        try:
+            write.set_result(send(write.mutation_map,
+                                  write.consistency_level))
+        except Exception:
+            write.set_exception(sys.exc_info())
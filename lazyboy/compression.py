@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Value compression.
+
+Compressed values start with a header byte naming the codec, which
+decompress() uses to reverse it. Values which don't get smaller are
+stored raw, behind a header of their own, so compression never costs
+more than one byte. Compression is enabled on a Record class with
+_compression, or on a typed field with Field(compression=...):
+
+    class Document(Record):
+        _compression = 'zlib'
+
+Values written before compression was enabled have no header, so
+reading them raises ErrorCorruptData. Set _compression_legacy on the
+Record to read values which aren't in this format as they are. A
+legacy value which happens to start with a codec's header byte
+(\\x00 to \\x03) is still misread, so this is only safe for text,
+not for binary typed fields; rewrite old values to be sure.
+"""
+
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import lazyboy.exceptions as exc
+
+# Values shorter than this aren't worth compressing
+MIN_SIZE = 64
+
+# The codec used when compression is simply enabled
+DEFAULT_CODEC = 'zlib'
+
+RAW = '\x00'
+
+CODECS = {}
+_HEADERS = {RAW: lambda data: data}
+
+
+def register_codec(name, header, compress_func, decompress_func):
+    """Add a codec, identified by a one-byte header in stored values."""
+    assert len(header) == 1 and header not in _HEADERS, \
+        "Header %r is in use" % header
+    CODECS[name] = (header, compress_func)
+    _HEADERS[header] = decompress_func
+
+
+register_codec('zlib', '\x01', lambda data: zlib.compress(data, 6),
+               zlib.decompress)
+register_codec('bz2', '\x02', lambda data: bz2.compress(data, 9),
+               bz2.decompress)
+if lzma:
+    register_codec('lzma', '\x03', lzma.compress, lzma.decompress)
+
+
+def compress(data, codec=DEFAULT_CODEC):
+    """Return data compressed with codec, behind a header byte."""
+    if codec is True:
+        codec = DEFAULT_CODEC
+    try:
+        (header, func) = CODECS[codec]
+    except KeyError:
+        raise exc.ErrorNotSupported("No compression codec %r" % codec)
+
+    if len(data) >= MIN_SIZE:
+        packed = func(data)
+        if len(packed) < len(data):
+            return header + packed
+    return RAW + data
+
+
+def decompress(data, legacy=False):
+    """Return the original value of data produced by compress().
+
+    If legacy is True, data which compress() can't have produced is
+    assumed to have been stored uncompressed, and returned as is."""
+    if not data:
+        if legacy:
+            return data
+        raise exc.ErrorCorruptData("Compressed values can't be empty.")
+    try:
+        func = _HEADERS[data[0]]
+    except KeyError:
+        if legacy:
+            return data
+        raise exc.ErrorCorruptData("Unknown compression header %r" % data[0])
+    try:
+        return func(data[1:])
+    except Exception, ex:
+        if legacy:
+            return data
+        raise exc.ErrorCorruptData("Can't decompress value: %s" % ex)
@@ -24,10 +24,12 @@ from thrift.protocol import TBinaryProtocol
 import thrift
 
 import lazyboy.exceptions as exc
+from lazyboy.commit import GroupCommitter
 from contextlib import contextmanager
 
 _SERVERS = {}
 _CLIENTS = {}
+_LATENCY_OBSERVERS = []
 RETRY_ATTEMPTS = 5
 
 def _retry_default_callback(attempt, exc_):
@@ -56,15 +58,59 @@ def retry(callback=None):
     return __closure__
 
 
-def add_pool(keyspace, servers, timeout=None, recycle=None, **kwargs):
-    """Add a connection."""
+def add_pool(keyspace, servers, timeout=None, recycle=None, group_commit=None,
+             **kwargs):
+    """Add a connection.
+
+    If group_commit is set, it is the window (in seconds) during which
+    batch_mutate calls from different threads are merged into one
+    request. True uses the default window."""
+    if group_commit is True:
+        group_commit = GroupCommitter()
+    elif group_commit is not None and group_commit is not False and \
+            not isinstance(group_commit, GroupCommitter):
+        if not isinstance(group_commit, (int, long, float)) or \
+                group_commit <= 0:
+            raise exc.ErrorInvalidValue(
+                "group_commit must be a positive window: %r" % (group_commit,))
+        group_commit = GroupCommitter(group_commit)
+    if group_commit:
+        kwargs['group_commit'] = group_commit
     _SERVERS[keyspace] = dict(keyspace=keyspace, servers=servers, timeout=timeout, recycle=recycle,
                               **kwargs)
 
 
+def add_latency_observer(func):
+    """Call func(keyspace, seconds) with the duration of every request."""
+    _LATENCY_OBSERVERS.append(func)
+
+
+def remove_latency_observer(func):
+    """Stop calling func with request durations."""
+    if func in _LATENCY_OBSERVERS:
+        _LATENCY_OBSERVERS.remove(func)
+
+
+def _observe_latency(keyspace, seconds):
+    """Pass a request duration to the latency observers."""
+    for func in list(_LATENCY_OBSERVERS):
+        try:
+            func(keyspace, seconds)
+        except Exception:
+            logging.exception("Error in latency observer")
+
+
+def _client_key(name):
+    """Return the _CLIENTS key for a pool in this process and thread.
+
+    Clients aren't thread-safe, so they're keyed by thread ident,
+    rather than by name, which threads may share."""
+    return (os.getpid(), threading.currentThread().ident, name)
+
+
 def get_pool(name):
     """Return a client for the given pool name."""
-    key = str(os.getpid()) + threading.currentThread().getName() + name
+    key = _client_key(name)
     if key in _CLIENTS:
         return _CLIENTS[key]
 
@@ -76,6 +122,26 @@ def get_pool(name):
             "Pool `%s' is not defined." % name)
 
 
+def get_host_pool(name, host):
+    """Return a client for the given pool name which only talks to host.
+
+    The client uses the pool's settings, and the port of its first
+    server."""
+    key = _client_key("%s@%s" % (name, host))
+    if key in _CLIENTS:
+        return _CLIENTS[key]
+
+    try:
+        args = dict(_SERVERS[name])
+    except KeyError:
+        raise exc.ErrorCassandraClientNotFound(
+            "Pool `%s' is not defined." % name)
+    port = args['servers'][0].split(":")[1]
+    args['servers'] = ["%s:%s" % (host, port)]
+    _CLIENTS[key] = Client(**args)
+    return _CLIENTS[key]
+
+
 class _DebugTraceFactory(type):
 
     """A factory for making debug-tracing clients."""
@@ -152,11 +218,12 @@ class Client(object):
     """A wrapper around the Cassandra client which load-balances."""
 
     def __init__(self, keyspace, servers, timeout=None, recycle=None, debug=False,
-                 **conn_args):
+                 group_commit=None, **conn_args):
         """Initialize the client."""
         self._servers = servers
         self._recycle = recycle
         self._timeout = timeout
+        self._group_commit = group_commit
         self.keyspace = keyspace
         
         class_ = DebugTraceClient if debug else Cassandra.Client
@@ -225,6 +292,7 @@ class Client(object):
     def get_client(self):
         """Yield a Cassandra client connection."""
         client = None
+        start = time.time()
         try:
             client = self._connect()
             yield client
@@ -246,6 +314,9 @@ class Client(object):
             ex.args += (self._servers[self._current_server],
                         "on %s" % self._servers[self._current_server])
             raise ex
+        finally:
+            if _LATENCY_OBSERVERS:
+                _observe_latency(self.keyspace, time.time() - start)
 
     @retry()
     def set_keyspace(self, *args, **kwargs):
@@ -403,7 +474,6 @@ class Client(object):
         with self.get_client() as client:
             return client.batch_insert(*args, **kwargs)
 
-    @retry()
     def batch_mutate(self, *args, **kwargs):
         """
         Parameters:
@@ -411,6 +481,14 @@ class Client(object):
         - mutation_map
         - consistency_level
         """
+        if self._group_commit:
+            return self._group_commit.submit(self._batch_mutate,
+                                             *args, **kwargs)
+        return self._batch_mutate(*args, **kwargs)
+
+    @retry()
+    def _batch_mutate(self, *args, **kwargs):
+        """Send a batch_mutate to the server."""
         with self.get_client() as client:
             return client.batch_mutate(*args, **kwargs)
 
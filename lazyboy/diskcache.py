@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: On-disk row cache.
+
+DiskCache keeps rows in an SQLite database, so they survive restarts
+and a restarted worker doesn't have to fetch its whole working set
+again. It's meant as the last tier of a TieredCache, for column
+families whose rows rarely change:
+
+    add_cache("Archive", "Documents", cache=cache.TieredCache(
+            LRUCache(10000), DiskCache("/var/cache/lazyboy/docs.db",
+                                       max_bytes=2 ** 30)))
+
+When the cached data grows past max_bytes, the least recently used
+rows are evicted. Access times are only updated once every
+atime_resolution seconds, so hits don't cost a write each.
+"""
+
+from __future__ import with_statement
+import time
+import marshal
+import sqlite3
+import threading
+
+from lazyboy.cache import MISS, serialize_columns, deserialize_columns
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation INTEGER NOT NULL,
+    bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta VALUES (0, 0, 0);
+CREATE TABLE IF NOT EXISTS rows (
+    keyspace TEXT NOT NULL,
+    column_family TEXT NOT NULL,
+    row BLOB NOT NULL,
+    super_column BLOB NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (keyspace, column_family, row, super_column));
+CREATE INDEX IF NOT EXISTS rows_atime ON rows (atime);
+"""
+
+# super_column value for rows cached without one
+_NO_SUPER = ""
+
+
+def _params(key):
+    """Return the primary key columns for a cache key."""
+    return (key[0], key[1], buffer(key[2]),
+            buffer(key[3]) if key[3] is not None else _NO_SUPER)
+
+
+class DiskCache(object):
+
+    """A row cache in an SQLite database."""
+
+    def __init__(self, path, max_bytes=256 * 2 ** 20, ttl=None,
+                 atime_resolution=60, timeout=10):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.atime_resolution = atime_resolution
+        self.timeout = timeout
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._local = threading.local()
+        with self._db() as db:
+            db.executescript(_SCHEMA)
+
+    def _db(self):
+        """Return this thread's connection to the database."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, self.timeout)
+            db.text_factory = str
+        return db
+
+    def close(self):
+        """Close this thread's connection."""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    @property
+    def generation(self):
+        """The number of invalidations by any process."""
+        return self._db().execute(
+            "SELECT generation FROM meta").fetchone()[0]
+
+    def get(self, key):
+        """Return the columns cached for a cache key, or MISS."""
+        db = self._db()
+        params = _params(key)
+        row = db.execute("SELECT data, expires, atime FROM rows WHERE "
+                         "keyspace = ? AND column_family = ? AND row = ? "
+                         "AND super_column = ?", params).fetchone()
+        if row is None:
+            self.misses += 1
+            return MISS
+
+        (data, expires, atime) = row
+        now = time.time()
+        if expires and expires <= now:
+            self.expirations += 1
+            self.misses += 1
+            with db:
+                self._delete(db, "keyspace = ? AND column_family = ? AND "
+                             "row = ? AND super_column = ?", params)
+            return MISS
+
+        if now - atime >= self.atime_resolution:
+            with db:
+                db.execute("UPDATE rows SET atime = ? WHERE keyspace = ? "
+                           "AND column_family = ? AND row = ? AND "
+                           "super_column = ?", (now,) + params)
+        self.hits += 1
+        return deserialize_columns(marshal.loads(str(data)))
+
+    def set(self, key, columns, generation=None):
+        """Cache columns for a cache key.
+
+        If generation is given, nothing is cached if an invalidation
+        happened since the generation had that value."""
+        data = marshal.dumps(serialize_columns(columns))
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        params = _params(key)
+        db = self._db()
+        with db:
+            # Take the write lock before checking the generation
+            db.execute("UPDATE meta SET bytes = bytes")
+            if (generation is not None and
+                generation != db.execute(
+                    "SELECT generation FROM meta").fetchone()[0]):
+                return
+
+            self._delete(db, "keyspace = ? AND column_family = ? AND "
+                         "row = ? AND super_column = ?", params)
+            db.execute("INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       params + (buffer(data), len(data), expires, now))
+            db.execute("UPDATE meta SET bytes = bytes + ?", (len(data),))
+            self._evict(db)
+
+    def _delete(self, db, where, params):
+        """Delete matching rows, keeping the size total up to date."""
+        size = db.execute("SELECT SUM(size) FROM rows WHERE " + where,
+                          params).fetchone()[0]
+        if size:
+            db.execute("DELETE FROM rows WHERE " + where, params)
+            db.execute("UPDATE meta SET bytes = bytes - ?", (size,))
+
+    def _evict(self, db):
+        """Remove the least recently used rows until under max_bytes."""
+        total = db.execute("SELECT bytes FROM meta").fetchone()[0]
+        while total > self.max_bytes:
+            victims = db.execute("SELECT rowid, size FROM rows ORDER BY "
+                                 "atime LIMIT 100").fetchall()
+            if not victims:
+                break
+            for (rowid, size) in victims:
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM rows WHERE rowid = ?", (rowid,))
+                db.execute("UPDATE meta SET bytes = bytes - ?", (size,))
+                total -= size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove a row, and any of its super columns, from the cache."""
+        db = self._db()
+        with db:
+            db.execute("UPDATE meta SET generation = generation + 1")
+            self._delete(db, "keyspace = ? AND column_family = ? AND "
+                         "row = ?", _params(key)[:3])
+
+    def clear(self):
+        """Remove everything from the cache."""
+        db = self._db()
+        with db:
+            db.execute("UPDATE meta SET generation = generation + 1, "
+                       "bytes = 0")
+            db.execute("DELETE FROM rows")
+
+    def stats(self):
+        """Return a dict of this process's cache metrics."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'bytes': self._db().execute(
+                    "SELECT bytes FROM meta").fetchone()[0],
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
@@ -60,3 +60,18 @@ class ErrorCassandraNoServersConfigured(LazyboyException):
 class ErrorImmutable(LazyboyException):
     """Raised on an attempt to modify an immutable object."""
     pass
+
+
+class ErrorQueueFull(LazyboyException):
+    """Raised when a background queue stays full for too long."""
+    pass
+
+
+class ErrorTimeout(LazyboyException):
+    """Raised when waiting for a background operation times out."""
+    pass
+
+
+class ErrorCorruptData(LazyboyException):
+    """Raised when stored data is incomplete or fails a checksum."""
+    pass
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Typed Record fields.
+
+Declare fields on a Record subclass to store values in a binary form
+instead of as str():
+
+    class User(Record):
+        _fields = {'age': Int64Field(),
+                   'id': UUIDField(),
+                   'prefs': JSONField()}
+
+The encodings match Cassandra's comparators, so encoded values sort
+correctly when used as column names: Int64Field is LongType, the UUID
+fields are UUIDType/TimeUUIDType, UTF8Field is UTF8Type and BytesField
+is BytesType.
+"""
+
+import struct
+import uuid
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lazyboy.exceptions import ErrorInvalidValue
+
+
+class Field(object):
+
+    """A typed field, which converts values to and from bytes.
+
+    If compression names a codec from lazyboy.compression, encoded
+    values are compressed with it."""
+
+    def __init__(self, compression=None):
+        self.compression = compression
+
+    def validate(self, value):
+        """Return value converted to this field's type."""
+        return value
+
+    def encode(self, value):
+        """Return a validated value as bytes."""
+        raise NotImplementedError()
+
+    def decode(self, data):
+        """Return the value for bytes produced by encode()."""
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "%s()" % self.__class__.__name__
+
+
+class BytesField(Field):
+
+    """A field holding a byte string."""
+
+    def validate(self, value):
+        if not isinstance(value, str):
+            raise ErrorInvalidValue("Expected a byte string, got %r" %
+                                    (value,))
+        return value
+
+    def encode(self, value):
+        return value
+
+    def decode(self, data):
+        return data
+
+
+class UTF8Field(Field):
+
+    """A field holding a unicode string, stored as UTF-8."""
+
+    def validate(self, value):
+        if isinstance(value, str):
+            return value.decode('utf-8')
+        return unicode(value)
+
+    def encode(self, value):
+        return value.encode('utf-8')
+
+    def decode(self, data):
+        return data.decode('utf-8')
+
+
+class _StructField(Field):
+
+    """A field stored in a fixed-size struct format."""
+
+    _struct = None
+    _type = None
+
+    def validate(self, value):
+        try:
+            return self._type(value)
+        except (TypeError, ValueError):
+            raise ErrorInvalidValue("Invalid %s value: %r" %
+                                    (self.__class__.__name__, value))
+
+    def encode(self, value):
+        try:
+            return self._struct.pack(value)
+        except struct.error, ex:
+            raise ErrorInvalidValue(str(ex))
+
+    def decode(self, data):
+        if len(data) != self._struct.size:
+            raise ErrorInvalidValue("Expected %d bytes, got %d" %
+                                    (self._struct.size, len(data)))
+        return self._struct.unpack(data)[0]
+
+
+class Int64Field(_StructField):
+
+    """A signed 64-bit integer, big-endian, as used by LongType."""
+
+    _struct = struct.Struct('>q')
+    _type = int
+
+
+class DoubleField(_StructField):
+
+    """An IEEE 754 double, big-endian."""
+
+    _struct = struct.Struct('>d')
+    _type = float
+
+
+class UUIDField(Field):
+
+    """A UUID, stored as 16 bytes as used by UUIDType."""
+
+    def validate(self, value):
+        if isinstance(value, uuid.UUID):
+            return value
+        try:
+            if isinstance(value, str) and len(value) == 16:
+                return uuid.UUID(bytes=value)
+            return uuid.UUID(value)
+        except (TypeError, ValueError):
+            raise ErrorInvalidValue("Invalid UUID: %r" % (value,))
+
+    def encode(self, value):
+        return value.bytes
+
+    def decode(self, data):
+        if len(data) != 16:
+            raise ErrorInvalidValue("Expected 16 bytes, got %d" % len(data))
+        return uuid.UUID(bytes=data)
+
+
+class TimeUUIDField(UUIDField):
+
+    """A version 1 (time-based) UUID, as used by TimeUUIDType."""
+
+    def validate(self, value):
+        value = UUIDField.validate(self, value)
+        if value.version != 1:
+            raise ErrorInvalidValue("Not a time-based UUID: %s" % value)
+        return value
+
+
+class JSONField(Field):
+
+    """Any JSON-serializable value."""
+
+    def encode(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def decode(self, data):
+        return json.loads(data)
@@ -6,15 +6,25 @@
 
 """Iterator-based Cassandra tools."""
 
+from __future__ import with_statement
+import time
+import Queue
+import logging
+import threading
 import itertools as it
+from bisect import bisect_left
 from operator import attrgetter, itemgetter
-from collections import defaultdict
+from collections import defaultdict, deque
+from hashlib import md5
 
-from lazyboy.connection import get_pool
+from lazyboy.connection import get_pool, get_host_pool
+from lazyboy.key import Key
+import lazyboy.workers as workers
+import lazyboy.cache as cache
 import lazyboy.exceptions as exc
 
 from cassandra.ttypes import SlicePredicate, SliceRange, ConsistencyLevel, \
-    ColumnOrSuperColumn, Column, ColumnParent
+    ColumnOrSuperColumn, Column, ColumnParent, KeyRange
 
 
 GET_KEYSPACE = attrgetter("keyspace")
@@ -22,6 +32,29 @@ GET_COLFAM = attrgetter("column_family")
 GET_KEY = attrgetter("key")
 GET_SUPERCOL = attrgetter("super_column")
 
+# Columns fetched per get_slice when paging through a row
+PAGE_SIZE = 1000
+
+# Columns in the first get_slice of a whole row read by Record.load,
+# so that most rows take a single request
+ROW_PAGE_SIZE = 10000
+
+# Rows fetched per get_range_slices when scanning a column family
+RANGE_PAGE_SIZE = 100
+
+# Keys sent per multiget_slice, and batches in flight per multiget
+MULTIGET_BATCH_SIZE = 250
+MULTIGET_PARALLELISM = 4
+
+# Threads sending multiget batches, shared by all callers
+MULTIGET_THREADS = 16
+_MULTIGET_POOL = None
+_MULTIGET_LOCK = threading.Lock()
+
+# Seconds to use a keyspace's token ring before fetching it again
+RING_TTL = 60
+_RINGS = {}
+
 
 def groupsort(iterable, keyfunc):
     """Return a generator which sort and groups a list."""
@@ -29,14 +62,23 @@ def groupsort(iterable, keyfunc):
 
 
 def slice_iterator(key, consistency, **predicate_args):
-    """Return an iterator over a row."""
+    """Return an iterator over a row.
+
+    Unless columns or a count are given, the row is fetched in pages
+    of PAGE_SIZE columns; see paged_slice_iterator."""
+    if 'columns' not in predicate_args and 'count' not in predicate_args:
+        return paged_slice_iterator(key, consistency, **predicate_args)
+
+    throttle = predicate_args.pop('throttle', None)
+
+    if cache.is_missing(key):
+        raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
 
     predicate = SlicePredicate()
     if 'columns' in predicate_args:
         predicate.column_names = predicate_args['columns']
     else:
-        args = {'start': "", 'finish': "",
-                  'count': 100000, 'reversed': False}
+        args = {'start': "", 'finish': "", 'reversed': False}
         args.update(predicate_args)
         predicate.slice_range=SliceRange(**args)
 
@@ -49,10 +91,92 @@ def slice_iterator(key, consistency, **predicate_args):
     if not res:
         raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
 
+    if throttle:
+        throttle.consume_columns(unpack(res), rows=1)
     return unpack(res)
 
 
-def multigetterator(keys, consistency, **range_args):
+def paged_slice_iterator(key, consistency, page_size=PAGE_SIZE,
+                         prefetch=False, start="", finish="",
+                         reversed=False, throttle=None, first_page=None):
+    """Return an iterator over a row, fetched page_size columns at a time.
+
+    Only one page is held at once, or two if prefetch is True, in which
+    case the next page is fetched in the background while the current
+    one is consumed. The first page is fetched right away, so a
+    missing row raises ErrorNoSuchRecord here. It holds first_page
+    columns, if given, so rows which usually fit in one larger
+    request still get one.
+
+    If the row's column family has a negative cache, rows known to be
+    missing raise without a request, and missing rows are remembered.
+
+    If a throttle is given, each page is counted against it."""
+    if cache.is_missing(key):
+        raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
+
+    consistency = consistency or ConsistencyLevel.ONE
+    generation = (cache.missing_generation(key)
+                  if not start and not finish else None)
+    first_page = first_page or page_size
+    page = _get_page(key, consistency, start, finish, first_page, reversed,
+                     throttle)
+    if not page:
+        if generation is not None:
+            cache.set_missing(key, generation)
+        raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
+
+    return _iter_pages(key, consistency, page, len(page) == first_page,
+                       finish, page_size, reversed, prefetch, throttle)
+
+
+def _get_page(key, consistency, start, finish, count, reversed=False,
+              throttle=None):
+    """Return a list of up to count columns from a row."""
+    predicate = SlicePredicate(slice_range=SliceRange(
+            start=start, finish=finish, count=count, reversed=reversed))
+    page = list(unpack(get_pool(key.keyspace).get_slice(
+                key.key, key, predicate, consistency) or ()))
+    if throttle:
+        throttle.consume_columns(page)
+    return page
+
+
+def _next_page(key, consistency, start, finish, page_size, reversed=False,
+               throttle=None):
+    """Return (columns, more) for the page after column start."""
+    # Slices include their start column, so fetch one extra
+    page = _get_page(key, consistency, start, finish, page_size + 1,
+                     reversed, throttle)
+    more = len(page) == page_size + 1
+    if page and page[0].name == start:
+        page = page[1:]
+    return (page[:page_size], more)
+
+
+def _iter_pages(key, consistency, page, more, finish, page_size,
+                reversed=False, prefetch=False, throttle=None):
+    """Yield columns from page and the pages which follow it."""
+    while True:
+        if more:
+            args = (key, consistency, page[-1].name, finish, page_size,
+                    reversed, throttle)
+            pending = workers.spawn(_next_page, *args) if prefetch else None
+
+        for col in page:
+            yield col
+
+        if not more:
+            return
+        (page, more) = (pending.result() if pending
+                        else _next_page(*args))
+        if not page:
+            return
+
+
+def multigetterator(keys, consistency, batch_size=MULTIGET_BATCH_SIZE,
+                    parallelism=MULTIGET_PARALLELISM, token_aware=False,
+                    columns=None, **range_args):
     """Return a dictionary of data from Cassandra.
 
     This fetches data with the minumum number of network requests. It
@@ -60,35 +184,302 @@ def multigetterator(keys, consistency, **range_args):
 
     If you depend on ordering, use list_multigetterator. This may
     require more requests.
+
+    Duplicate keys are only fetched once. Keys are sent batch_size at
+    a time, with up to `parallelism' batches in flight at once. If
+    token_aware is True, each batch only holds keys owned by one node,
+    and is sent straight to it.
+
+    Unless columns or range_args are given, rows in a cached column
+    family are served from the cache, and only the misses are fetched.
     """
+    keys = list(keys)
+    out = {}
+    for key in keys:
+        out.setdefault(key.keyspace, {}).setdefault(key.column_family,
+                                                    defaultdict(dict))
+
+    for (key, cols) in multiget_stream(
+        keys, consistency, batch_size, parallelism, token_aware, columns,
+        **range_args):
+        rows = out[key.keyspace][key.column_family]
+        if key.super_column is None:
+            rows[key.key] = cols
+        else:
+            rows[key.key][key.super_column] = cols
+
+    return out
+
+
+def multiget_stream(keys, consistency, batch_size=MULTIGET_BATCH_SIZE,
+                    parallelism=MULTIGET_PARALLELISM, token_aware=False,
+                    columns=None, **range_args):
+    """Yield (Key, columns) for keys, as each batch is fetched.
+
+    Rows come back in no particular order: cached rows first, then
+    each batch as it arrives. Only the named columns are fetched, if
+    given; see multigetterator for the other arguments."""
+    predicate = _multiget_predicate(columns, range_args)
+    consistency = consistency or ConsistencyLevel.ONE
+    (found, batches) = _plan_batches(keys, batch_size, token_aware,
+                                     not (columns or range_args))
+    for row in found:
+        yield row
+
+    for (batch, records) in _run_batches(batches, predicate, consistency,
+                                         parallelism):
+        for row in batch.unpack(records):
+            yield row
+
+
+def list_multigetterator(keys, consistency, batch_size=MULTIGET_BATCH_SIZE,
+                         parallelism=MULTIGET_PARALLELISM, columns=None,
+                         **range_args):
+    """Yield (Key, columns) for each of keys, in order.
+
+    Batches of batch_size consecutive keys are fetched in the
+    background, up to `parallelism' ahead of the one being consumed,
+    so no more than parallelism * batch_size rows are held at once.
+    Missing rows have no columns. See multiget_stream for the other
+    arguments."""
+    predicate = _multiget_predicate(columns, range_args)
+    consistency = consistency or ConsistencyLevel.ONE
+    use_cache = not (columns or range_args)
+    chunks = chunk_seq(keys, batch_size)
+
+    if parallelism <= 1:
+        fetched = ((chunk, _fetch_keys(chunk, predicate, consistency,
+                                       use_cache))
+                   for chunk in chunks)
+    else:
+        fetched = _read_ahead(chunks, parallelism, _fetch_keys, predicate,
+                              consistency, use_cache)
+
+    for (chunk, rows) in fetched:
+        for key in chunk:
+            yield (key, rows.get(_key_id(key), []))
+
+
+def _read_ahead(chunks, depth, func, *args):
+    """Yield (chunk, func(chunk, *args)) in order, depth chunks ahead."""
+    pool = get_multiget_pool()
+    pending = deque()
+    for chunk in it.islice(chunks, depth):
+        pending.append((chunk, pool.submit(func, chunk, *args)))
+
+    while pending:
+        (chunk, future) = pending.popleft()
+        result = future.result()
+        for next_chunk in it.islice(chunks, 1):
+            pending.append((next_chunk, pool.submit(func, next_chunk,
+                                                    *args)))
+        yield (chunk, result)
+
+
+def _fetch_keys(keys, predicate, consistency, use_cache=True):
+    """Return a dict of rows for keys, indexed by _key_id."""
+    (found, batches) = _plan_batches(keys, max(len(keys), 1), False,
+                                     use_cache)
+    for batch in batches:
+        found.extend(batch.unpack(batch.fetch(predicate, consistency)))
+    return dict((_key_id(key), cols) for (key, cols) in found)
+
+
+def _key_id(key):
+    """Return a hashable identifier for a Key."""
+    return (key.keyspace, key.column_family, key.super_column, key.key)
+
+
+def _multiget_predicate(columns, range_args):
+    """Return the SlicePredicate for a multiget."""
+    if columns:
+        return SlicePredicate(column_names=list(columns))
     kwargs = {'start': "", 'finish': "",
               'count': 100000, 'reversed': False}
     kwargs.update(range_args)
-    predicate = SlicePredicate(slice_range=SliceRange(**kwargs))
-    consistency = consistency or ConsistencyLevel.ONE
+    return SlicePredicate(slice_range=SliceRange(**kwargs))
 
-    out = {}
+
+def _plan_batches(keys, batch_size, token_aware=False, use_cache=True):
+    """Return (cached rows, batches) for fetching keys.
+
+    Cached rows are (Key, columns) tuples; the batches hold the rest,
+    without duplicates."""
+    (found, batches) = ([], [])
     for (keyspace, ks_keys) in groupsort(keys, GET_KEYSPACE):
-        client = get_pool(keyspace)
-        out[keyspace] = {}
         for (colfam, cf_keys) in groupsort(ks_keys, GET_COLFAM):
+            for (supercol, sc_keys) in groupsort(cf_keys, GET_SUPERCOL):
+                sc_keys = dict((key.key, key) for key in sc_keys)
+                generation = None
+                if use_cache:
+                    (sc_keys, generation) = _cached_rows(sc_keys, found)
+                    if not sc_keys:
+                        continue
+
+                batches.extend(_Batch(keyspace, colfam, supercol, batch,
+                                      generation, host)
+                               for (host, batch) in _split_keys(
+                        keyspace, sc_keys, batch_size, token_aware))
+    return (found, batches)
+
+
+class _Batch(object):
+
+    """A multiget_slice request for keys in one column family."""
+
+    def __init__(self, keyspace, column_family, super_column, keys,
+                 generation=None, host=None):
+        self.keyspace = keyspace
+        self.column_family = column_family
+        self.super_column = super_column
+        self.keys = keys
+        self.generation = generation
+        self.host = host
+
+    def fetch(self, predicate, consistency):
+        """Return the multiget_slice results for this batch."""
+        parent = ColumnParent(self.column_family, self.super_column)
+        if self.host is not None:
+            try:
+                return get_host_pool(self.keyspace, self.host).multiget_slice(
+                    self.keys.keys(), parent, predicate, consistency)
+            except exc.ErrorThriftMessage, ex:
+                logging.warning("Multiget from %s failed (%s), using the "
+                                "pool", self.host, ex)
+        return get_pool(self.keyspace).multiget_slice(
+            self.keys.keys(), parent, predicate, consistency)
+
+    def unpack(self, records):
+        """Yield (Key, columns) from multiget_slice results.
+
+        Rows are cached, if this batch's column family is."""
+        for (row_key, cols) in records.iteritems():
+            key = self.keys.get(row_key)
+            if key is None:
+                key = self.keys.itervalues().next().clone(key=row_key)
+            cols = list(unpack(cols))
+            if cols and self.generation is not None:
+                cols = cache.set_columns(key, cols, self.generation)
+            yield (key, cols)
+
+
+def _split_keys(keyspace, keys, batch_size, token_aware=False):
+    """Yield (host, keys) batches of at most batch_size keys.
+
+    keys is a dict of row key to Key. The host is the node which owns
+    every key in the batch if token_aware is True, otherwise None."""
+    groups = {None: keys.items()}
+    if token_aware:
+        ring = _get_ring(keyspace)
+        groups = defaultdict(list)
+        for item in keys.iteritems():
+            groups[ring.owner(item[0])].append(item)
+
+    for (host, items) in groups.iteritems():
+        for batch in chunk_seq(items, batch_size):
+            yield (host, dict(batch))
+
+
+def _run_batches(batches, predicate, consistency, parallelism):
+    """Yield (batch, results) as each batch is fetched.
+
+    Up to `parallelism' batches are fetched at once on the shared
+    multiget pool; with one batch, or parallelism of 1, they're
+    fetched in this thread."""
+    if len(batches) <= 1 or parallelism <= 1:
+        for batch in batches:
+            yield (batch, batch.fetch(predicate, consistency))
+        return
+
+    pool = get_multiget_pool()
+    finished = Queue.Queue()
+    batches = iter(batches)
+
+    def submit(batch):
+        future = pool.submit(batch.fetch, predicate, consistency)
+        future.add_done_callback(
+            lambda future: finished.put((batch, future)))
+
+    pending = 0
+    for batch in it.islice(batches, parallelism):
+        submit(batch)
+        pending += 1
+
+    while pending:
+        (batch, future) = finished.get()
+        pending -= 1
+        for next_batch in it.islice(batches, 1):
+            submit(next_batch)
+            pending += 1
+        yield (batch, future.result())
+
+
+def get_multiget_pool():
+    """Return the WorkerPool which multiget batches are sent from."""
+    global _MULTIGET_POOL
+    with _MULTIGET_LOCK:
+        if _MULTIGET_POOL is None:
+            _MULTIGET_POOL = workers.WorkerPool(
+                workers=MULTIGET_THREADS, queue_size=0,
+                name="lazyboy-multiget")
+        return _MULTIGET_POOL
+
+
+class _Ring(object):
+
+    """The token ring of a keyspace."""
+
+    def __init__(self, token_ranges, partitioner):
+        self.partitioner = partitioner
+        ranges = sorted((self._value(token_range.end_token),
+                         token_range.endpoints)
+                        for token_range in token_ranges)
+        self.ends = [end for (end, _) in ranges]
+        self.endpoints = [endpoints for (_, endpoints) in ranges]
+        self.expires = time.time() + RING_TTL
+
+    def _value(self, token):
+        """Return a token in a form which sorts in ring order."""
+        if self.partitioner.endswith("RandomPartitioner"):
+            return long(token)
+        return token
+
+    def owner(self, row_key):
+        """Return the first replica for row_key."""
+        token = self._value(key_token(row_key, self.partitioner))
+        # Ranges are (start, end]; the first range wraps around
+        index = bisect_left(self.ends, token) % len(self.ends)
+        return self.endpoints[index][0]
+
+
+def _get_ring(keyspace):
+    """Return the _Ring for keyspace, refreshing it every RING_TTL."""
+    ring = _RINGS.get(keyspace)
+    if ring is None or ring.expires < time.time():
+        client = get_pool(keyspace)
+        ring = _RINGS[keyspace] = _Ring(client.describe_ring(keyspace),
+                                        client.describe_partitioner())
+    return ring
 
-            if colfam not in keyspace:
-                out[keyspace][colfam] = defaultdict(dict)
 
-            for (supercol, sc_keys) in groupsort(cf_keys, GET_SUPERCOL):
-                records = client.multiget_slice(
-                    map(GET_KEY, sc_keys),
-                    ColumnParent(colfam, supercol), predicate, consistency)
+def _cached_rows(keys, found):
+    """Add cached (Key, columns) to found, returns (uncached keys, generation).
 
-                for (row_key, cols) in records.iteritems():
-                    cols = unpack(cols)
-                    if supercol is None:
-                        out[keyspace][colfam][row_key] = cols
-                    else:
-                        out[keyspace][colfam][row_key][supercol] = cols
+    keys is a dict of row key to Key, for one column family and super
+    column. The generation is None if the rows aren't cached."""
+    first = keys.itervalues().next()
+    generation = cache.generation(first)
+    if generation is None:
+        return (keys, None)
 
-    return out
+    misses = {}
+    for (row_key, key) in keys.iteritems():
+        cols = cache.get_columns(key)
+        if cols is cache.MISS:
+            misses[row_key] = key
+        else:
+            found.append((key, cols))
+    return (misses, generation)
 
 
 def sparse_get(key, columns):
@@ -103,31 +494,187 @@ def sparse_get(key, columns):
 
 
 def sparse_multiget(keys, columns):
-    """Return an iterator over a specific set of columns."""
-
-    first_key = iter(keys).next()
-    client = get_pool(first_key.keyspace)
-    row_keys = [key.key for key in keys]
-    res = client.multiget_slice(
-        row_keys, first_key,
-        SlicePredicate(column_names=columns), ConsistencyLevel.ONE)
-
-    out = {}
-    for (row_key, cols) in res.iteritems():
-        out[row_key] = [corsc.column or corsc.super_column for corsc in cols]
-    return out
+    """Return a dict of row key to a specific set of columns.
+
+    Use multiget_stream with columns to handle rows as they arrive."""
+    return dict((key.key, cols) for (key, cols) in multiget_stream(
+                keys, ConsistencyLevel.ONE, columns=columns))
+
+
+def key_token(row_key, partitioner="RandomPartitioner"):
+    """Return the token for row_key, as a string for KeyRange.
+
+    RandomPartitioner tokens are the absolute value of the key's MD5,
+    read as a signed big-endian integer; ByteOrderedPartitioner tokens
+    are the key in hex, and the other order preserving partitioners
+    use the key itself."""
+    if partitioner.endswith("ByteOrderedPartitioner"):
+        return row_key.encode('hex')
+    if not partitioner.endswith("RandomPartitioner"):
+        return row_key
+    token = long(md5(row_key).hexdigest(), 16)
+    if token >= 2 ** 127:
+        token -= 2 ** 128
+    return str(abs(token))
+
+
+def range_iterator(key=None, consistency=None, start="", finish="",
+                   start_token=None, finish_token=None,
+                   page_size=RANGE_PAGE_SIZE, columns=None,
+                   column_count=PAGE_SIZE, record_class=None,
+                   skip_empty=True, prefetch=False, client=None,
+                   throttle=None):
+    """Return an iterator over the rows in a column family.
+
+    Rows are fetched page_size at a time with get_range_slices, so
+    only one page is held at once (two with prefetch, which fetches
+    the next page in the background). Each row is yielded as a (Key,
+    columns) tuple, or as an instance of record_class if given. Only
+    the named columns, or the first column_count columns, of each row
+    are fetched.
+
+    The range is bounded by keys (start is inclusive) or by a pair of
+    tokens (start_token is exclusive), not both. Rows with no columns, which
+    are usually deleted, are skipped unless skip_empty is False.
+
+    Requests go to the keyspace's pool, or to client if given. If a
+    throttle is given, each page is counted against it.
+    """
+    assert isinstance(key, Key) or (key is None and record_class)
+    if start_token is not None or finish_token is not None:
+        assert start_token is not None and finish_token is not None
+        assert not start and not finish, "Use keys or tokens, not both"
+    if key is None:
+        key = record_class().make_key()
+
+    if columns:
+        predicate = SlicePredicate(column_names=list(columns))
+    else:
+        predicate = SlicePredicate(slice_range=SliceRange(
+                start="", finish="", count=column_count))
+
+    scan = _RangeScan(key, predicate, consistency or ConsistencyLevel.ONE,
+                      page_size, client, throttle)
+    rows = scan.pages(start, finish, start_token, finish_token, prefetch)
+    if skip_empty:
+        rows = ((row_key, cols) for (row_key, cols) in rows if cols)
+    if record_class is None:
+        return ((key.clone(key=row_key), cols) for (row_key, cols) in rows)
+    return (_record(record_class, key.clone(key=row_key), cols, columns)
+            for (row_key, cols) in rows)
+
+
+def _record(record_class, key, cols, columns=None):
+    """Return an instance of record_class holding cols."""
+    record = record_class()._inject(key, cols)
+    if columns:
+        record._loaded = frozenset(columns)
+    return record
+
+
+class _RangeScan(object):
+
+    """Pages through a range of rows with get_range_slices."""
+
+    def __init__(self, key, predicate, consistency, page_size, client=None,
+                 throttle=None):
+        self.key = key
+        self.client = client
+        self.throttle = throttle
+        self.parent = ColumnParent(key.column_family, key.super_column)
+        self.predicate = predicate
+        self.consistency = consistency
+        self.page_size = page_size
+        self._partitioner = None
+
+    def get_client(self):
+        """Return the client to send requests to."""
+        return self.client or get_pool(self.key.keyspace)
+
+    def partitioner(self):
+        """Return the name of the cluster's partitioner."""
+        if self._partitioner is None:
+            self._partitioner = self.get_client().describe_partitioner()
+        return self._partitioner
+
+    def fetch(self, key_range):
+        """Return a list of (row key, columns) for a KeyRange."""
+        page = [(row.key, list(unpack(row.columns)))
+                for row in self.get_client().get_range_slices(
+                self.parent, self.predicate, key_range, self.consistency)]
+        if self.throttle:
+            self.throttle.consume_columns(
+                chain_iterable(cols for (_, cols) in page), rows=len(page))
+        return page
+
+    def next_range(self, last_key, finish, finish_token):
+        """Return the KeyRange for the page after last_key."""
+        if finish_token is not None:
+            # Tokens are start-exclusive, so last_key isn't repeated
+            return KeyRange(start_token=key_token(last_key,
+                                                  self.partitioner()),
+                            end_token=finish_token, count=self.page_size)
+        return KeyRange(start_key=last_key, end_key=finish,
+                        count=self.page_size + 1)
+
+    def next_page(self, last_key, finish, finish_token):
+        """Return (rows, more) for the page after last_key."""
+        key_range = self.next_range(last_key, finish, finish_token)
+        page = self.fetch(key_range)
+        more = len(page) == key_range.count
+        if page and finish_token is None and page[0][0] == last_key:
+            page = page[1:]
+        return (page[:self.page_size], more)
+
+    def pages(self, start, finish, start_token, finish_token, prefetch):
+        """Yield (row key, columns) for every row in the range."""
+        if start_token is not None or finish_token is not None:
+            first = KeyRange(start_token=start_token, end_token=finish_token,
+                             count=self.page_size)
+        else:
+            first = KeyRange(start_key=start, end_key=finish,
+                             count=self.page_size)
+        page = self.fetch(first)
+        more = len(page) == self.page_size
+
+        while True:
+            if more and page:
+                args = (page[-1][0], finish, finish_token)
+                pending = (workers.spawn(self.next_page, *args)
+                           if prefetch else None)
+
+            for row in page:
+                yield row
+
+            if not more or not page:
+                return
+            (page, more) = (pending.result() if pending
+                            else self.next_page(*args))
 
 
 def key_range(key, start="", finish="", count=100):
-    """Return an iterator over a range of keys."""
-    cas = get_pool(key.keyspace)
-    return cas.get_key_range(key.column_family, start,
-                             finish, count, ConsistencyLevel.ONE)
+    """Return a list of up to count row keys, starting at start."""
+    predicate = SlicePredicate(slice_range=SliceRange(
+            start="", finish="", count=1))
+    rows = get_pool(key.keyspace).get_range_slices(
+        ColumnParent(key.column_family), predicate,
+        KeyRange(start_key=start, end_key=finish, count=count),
+        ConsistencyLevel.ONE)
+    return [row.key for row in rows]
+
 
+def key_range_iterator(key, start="", finish="", count=100,
+                       page_size=RANGE_PAGE_SIZE):
+    """Return an iterator which produces Key instances for a key range.
 
-def key_range_iterator(key, start="", finish="", count=100):
-    """Return an iterator which produces Key instances for a key range."""
-    return (key.clone(key=k) for k in key_range(key, start, finish, count))
+    Up to count keys are returned, or the whole range if count is None.
+    They're fetched page_size keys at a time; see range_iterator."""
+    if count is not None:
+        page_size = min(page_size, count)
+    keys = (row_key for (row_key, _) in range_iterator(
+            key, start=start, finish=finish, page_size=page_size,
+            column_count=1, skip_empty=False))
+    return it.islice(keys, count) if count is not None else keys
 
 
 def pack(objects):
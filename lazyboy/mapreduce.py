@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Map/reduce over a column family with a process pool.
+
+Each token range of the column family is scanned in a worker process,
+so CPU-bound work isn't limited by the GIL:
+
+    def count_columns(row):
+        (key, columns) = row
+        return len(columns)
+
+    total = map_reduce(Key("UserData", "Users"), count_columns,
+                       operator.add, 0)
+
+The mapper and reducer are sent to the workers, so they must be
+picklable, i.e. defined at the top level of a module.
+"""
+
+import logging
+import multiprocessing
+
+from cassandra.ttypes import ConsistencyLevel
+
+import lazyboy.connection as connection
+from lazyboy.iterators import range_iterator, RANGE_PAGE_SIZE, PAGE_SIZE
+from lazyboy.key import Key
+from lazyboy.scan import ring_splits, SPLIT_SIZE
+
+_EMPTY = object()
+
+
+def _init_worker(servers):
+    """Set up the connection pools in a worker process."""
+    connection._SERVERS.update(servers)
+    connection._CLIENTS.clear()
+
+
+def _map_split(args):
+    """Return (split, partial result, rows) for one split."""
+    (split, mapper, reducer, options) = args
+    result, rows = None, 0
+    for row in range_iterator(start_token=split.start_token,
+                              finish_token=split.end_token, **options):
+        value = mapper(row)
+        result = reducer(result, value) if rows else value
+        rows += 1
+    return (split, result, rows)
+
+
+def map_reduce(key, mapper, reducer, initial=_EMPTY, record_class=None,
+               processes=None, splits=None, keys_per_split=SPLIT_SIZE,
+               page_size=RANGE_PAGE_SIZE, columns=None,
+               column_count=PAGE_SIZE, consistency=None, on_split=None):
+    """Return reducer applied to mapper(row) for every row of a column family.
+
+    Rows are (Key, columns) tuples, or record_class instances if it's
+    given. Each of `processes' workers (one per CPU by default) scans
+    a split with its own connections, reduces the mapped values to a
+    partial result, and sends only that back. The partial results are
+    reduced in this process as they arrive, starting with initial if
+    it's given; on_split(split, partial, rows) is called for each.
+
+    Returns initial (or None) if the column family is empty.
+    """
+    assert isinstance(key, Key) or (key is None and record_class)
+    key = key or record_class().make_key()
+    if splits is None:
+        splits = ring_splits(key.keyspace, key.column_family,
+                             keys_per_split)
+
+    options = dict(key=key, record_class=record_class, page_size=page_size,
+                   columns=columns, column_count=column_count,
+                   consistency=consistency or ConsistencyLevel.ONE)
+    tasks = [(split, mapper, reducer, options) for split in splits]
+
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (dict(connection._SERVERS),))
+    result = initial
+    try:
+        for (split, partial, rows) in pool.imap_unordered(_map_split, tasks):
+            logging.debug("Finished %r: %d rows", split, rows)
+            if on_split:
+                on_split(split, partial, rows)
+            if not rows:
+                continue
+            result = (partial if result is _EMPTY
+                      else reducer(result, partial))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return None if result is _EMPTY else result
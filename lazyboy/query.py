@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Secondary index queries.
+
+Query a Record subclass's column family through its secondary
+indexes:
+
+    for user in User.query(eq('state', 'CA'), gte('age', 21),
+                           columns=['name', 'age']):
+        ...
+
+At least one expression must be an equality on an indexed column.
+Values are encoded the way the record class stores them.
+"""
+
+import logging
+from itertools import islice
+
+from cassandra.ttypes import IndexExpression, IndexClause, IndexOperator, \
+    ColumnParent, SlicePredicate, SliceRange
+
+from lazyboy.connection import get_pool
+from lazyboy.iterators import unpack, _record, PAGE_SIZE
+from lazyboy.scan import ParallelScanner
+
+# Rows fetched per get_indexed_slices
+QUERY_PAGE_SIZE = 100
+
+# Partitioners whose tokens are row keys, in key order
+_ORDERED = ("OrderPreservingPartitioner", "ByteOrderedPartitioner")
+
+
+class Expression(object):
+
+    """A comparison of an item with a value."""
+
+    def __init__(self, name, op, value):
+        self.name = name
+        self.op = op
+        self.value = value
+
+    def index_expression(self, record_class):
+        """Return an IndexExpression, encoding value for record_class."""
+        record = record_class()
+        value = record._encode(self.name,
+                               record._prepare(self.name, self.value))
+        return IndexExpression(self.name, self.op, value)
+
+    def __repr__(self):
+        return "%s %s %r" % (self.name,
+                             IndexOperator._VALUES_TO_NAMES[self.op],
+                             self.value)
+
+
+def eq(name, value):
+    """Return an expression matching items equal to value."""
+    return Expression(name, IndexOperator.EQ, value)
+
+
+def gt(name, value):
+    """Return an expression matching items greater than value."""
+    return Expression(name, IndexOperator.GT, value)
+
+
+def gte(name, value):
+    """Return an expression matching items greater than or equal to value."""
+    return Expression(name, IndexOperator.GTE, value)
+
+
+def lt(name, value):
+    """Return an expression matching items less than value."""
+    return Expression(name, IndexOperator.LT, value)
+
+
+def lte(name, value):
+    """Return an expression matching items less than or equal to value."""
+    return Expression(name, IndexOperator.LTE, value)
+
+
+class Query(object):
+
+    """A secondary index query for instances of a Record subclass.
+
+    Iterating the query pages through get_indexed_slices page_size rows
+    at a time, and constructs records as they're reached. Only the
+    named columns are fetched, if columns are given; otherwise up to
+    column_count columns of each row. Iteration stops after limit
+    records, if given.
+
+    With a parallelism above one, the ring is split into token ranges
+    which are queried concurrently, and records come back in no
+    particular order. Index scans can only start at a key, not a
+    token, so this needs an order preserving partitioner; otherwise
+    the query runs sequentially.
+    """
+
+    def __init__(self, record_class, expressions, columns=None,
+                 column_count=PAGE_SIZE, page_size=QUERY_PAGE_SIZE,
+                 consistency=None, start_key="", limit=None, parallelism=1):
+        self.record_class = record_class
+        self.expressions = [
+            expr if isinstance(expr, IndexExpression)
+            else expr.index_expression(record_class)
+            for expr in expressions]
+        assert any(expr.op == IndexOperator.EQ
+                   for expr in self.expressions), \
+            "Index queries need at least one equality expression"
+        self.key = record_class().make_key()
+        self.columns = columns
+        if columns:
+            self.predicate = SlicePredicate(column_names=list(columns))
+        else:
+            self.predicate = SlicePredicate(slice_range=SliceRange(
+                    start="", finish="", count=column_count))
+        self.page_size = page_size
+        self.consistency = consistency or record_class.consistency
+        self.start_key = start_key
+        self.limit = limit
+        self.parallelism = parallelism
+        self.log = logging.getLogger(self.__class__.__name__)
+
+    def _fetch(self, start_key, count):
+        """Return a page of (row key, columns) starting at start_key."""
+        clause = IndexClause(self.expressions, start_key, count)
+        return [(row.key, list(unpack(row.columns)))
+                for row in get_pool(self.key.keyspace).get_indexed_slices(
+                ColumnParent(self.key.column_family), clause,
+                self.predicate, self.consistency)]
+
+    def rows(self, start_key="", end_key=None, exclusive=False):
+        """Yield (row key, columns) for matching rows.
+
+        Rows start at start_key, or after it if exclusive is True, and
+        stop after end_key, which only makes sense for order
+        preserving partitioners."""
+        (skip, count) = (start_key if exclusive else None, self.page_size)
+        while True:
+            page = self._fetch(start_key, count + (skip is not None))
+            more = len(page) == count + (skip is not None)
+            for (row_key, cols) in page:
+                if row_key == skip:
+                    continue
+                if end_key is not None and row_key > end_key:
+                    return
+                yield (row_key, cols)
+
+            if not more:
+                return
+            # Index slices include their start key
+            skip = start_key = page[-1][0]
+
+    def _records(self, rows):
+        """Return records for (row key, columns) tuples."""
+        return (_record(self.record_class, self.key.clone(key=row_key),
+                        cols, self.columns)
+                for (row_key, cols) in rows)
+
+    def ordered(self):
+        """Return True if the cluster's partitioner keeps keys in order."""
+        partitioner = get_pool(self.key.keyspace).describe_partitioner()
+        return partitioner.endswith(_ORDERED)
+
+    def __iter__(self):
+        if self.parallelism > 1:
+            if self.ordered():
+                records = _IndexScanner(self).scan()
+                return islice(records, self.limit) if self.limit else records
+            self.log.info("The partitioner doesn't preserve order, "
+                          "querying sequentially")
+
+        records = self._records(self.rows(self.start_key))
+        return islice(records, self.limit) if self.limit else records
+
+
+class _IndexScanner(ParallelScanner):
+
+    """Runs a Query across the ring's token ranges."""
+
+    def __init__(self, query):
+        ParallelScanner.__init__(self, query.key,
+                                 parallelism=query.parallelism,
+                                 page_size=query.page_size)
+        self.query = query
+        self.byte_ordered = get_pool(query.key.keyspace) \
+            .describe_partitioner().endswith("ByteOrderedPartitioner")
+
+    def _token_key(self, token):
+        """Return the row key for a token."""
+        return token.decode('hex') if self.byte_ordered else token
+
+    def rows(self, split):
+        """Return an iterator over the matching records in a split."""
+        (start, end) = (self._token_key(split.start_token),
+                        self._token_key(split.end_token))
+        if end and end <= start:
+            # The range wraps around the end of the ring
+            pieces = ((start, None, True), ("", end, False))
+        else:
+            pieces = ((start, end or None, bool(start)),)
+
+        for (start_key, end_key, exclusive) in pieces:
+            for record in self.query._records(
+                self.query.rows(start_key, end_key, exclusive)):
+                yield record
@@ -6,8 +6,6 @@
 """Lazyboy: Record."""
 
 import time
-import copy
-from itertools import ifilterfalse as filternot
 
 from cassandra.ttypes import Column, SuperColumn, Mutation, ColumnOrSuperColumn
 
@@ -15,9 +13,28 @@ from lazyboy.connection import get_pool
 from lazyboy.base import CassandraBase
 from lazyboy.key import Key
 import lazyboy.iterators as iterators
+import lazyboy.compression as compression
+import lazyboy.cache as cache
+import lazyboy.session as session
+from lazyboy.query import Query
+import lazyboy.workers as workers
 import lazyboy.exceptions as exc
 
 
+def mutation_map(key, columns):
+    """Return a batch_mutate mutation map writing columns to key."""
+    if key.is_super():
+        columns = [SuperColumn(name=key.super_column, columns=columns)]
+        col_type = "super_column"
+    else:
+        col_type = "column"
+
+    mutations = [Mutation(column_or_supercolumn=ColumnOrSuperColumn(
+                **{col_type: col})) for col in columns]
+
+    return {key.key: {key.column_family: mutations}}
+
+
 class Record(CassandraBase, dict):
 
     """An object backed by a record in Cassandra."""
@@ -37,6 +54,33 @@ class Record(CassandraBase, dict):
     # Denormalized copies of this record
     _mirrors = []
 
+    # Typed fields, keyed by item name; see lazyboy.fields. Items
+    # without a field are stored as str().
+    _fields = {}
+
+    # A compression codec (see lazyboy.compression) for every item, or
+    # a dict of codecs keyed by item name. Typed fields can also set
+    # their own.
+    _compression = None
+
+    # If True, compressed items whose stored values aren't compressed,
+    # because they were written before _compression was set, are read
+    # as they are; see lazyboy.compression.
+    _compression_legacy = False
+
+    # If True, fetched Columns are kept as they are, and each item's
+    # value is only extracted (and decoded) when it's first accessed.
+    _lazy = False
+
+    # Names of the columns load() fetches by default, or None to fetch
+    # the whole row
+    _projection = None
+
+    # Columns in the first request when load() fetches a whole row;
+    # longer rows are fetched the rest of the way in pages of
+    # iterators.PAGE_SIZE
+    _page_size = iterators.ROW_PAGE_SIZE
+
     def __init__(self, *args, **kwargs):
         dict.__init__(self)
         CassandraBase.__init__(self)
@@ -79,8 +123,27 @@ class Record(CassandraBase, dict):
         return len(self.missing()) == 0
 
     def missing(self):
-        """Return a tuple of required items which are missing."""
-        return tuple(filternot(self.get, self._required))
+        """Return a tuple of required items which are missing.
+
+        Required items which weren't loaded aren't considered missing.
+        Typed items only need to be set, since 0 or [] are valid values
+        for them; other items must be non-empty."""
+        return tuple(item for item in self._required
+                     if not self._present(item) and self.is_loaded(item))
+
+    def _present(self, item):
+        """Return True if a required item has a value."""
+        if item in self._fields:
+            return dict.__contains__(self, item)
+        return bool(self.get(item))
+
+    def is_loaded(self, item):
+        """Return True if item was loaded, or is set in the record.
+
+        This is False only for items outside the columns a partial
+        record was loaded with."""
+        return (self._loaded is None or item in self._loaded
+                or dict.__contains__(self, item))
 
     def is_modified(self):
         """Return True if the record has been modified since it was loaded."""
@@ -88,11 +151,111 @@ class Record(CassandraBase, dict):
 
     def _clean(self):
         """Remove every item from the object"""
-        map(self.__delitem__, self.keys())
-        self._original, self._columns = {}, {}
-        self._modified, self._deleted = {}, {}
+        dict.clear(self)
+        # Column timestamps, keyed by item name. The values themselves
+        # are only stored in the dict.
+        self._timestamps = {}
+        # Names of modified and deleted items
+        self._modified, self._deleted = set(), set()
+        # (value, timestamp) of items changed since the last load or
+        # save, as they were before the change; None for new items.
+        self._backup = {}
+        # Names of the columns which were loaded, or None for all of them
+        self._loaded = None
         self.key = None
 
+    def _back_up(self, item):
+        """Remember the state of an item before it's first changed."""
+        if item in self._backup:
+            return
+
+        self._backup[item] = ((dict.__getitem__(self, item),
+                               self._timestamp(item))
+                              if dict.__contains__(self, item) else None)
+
+    def _restore(self, item, orig):
+        """Restore an item to its state before it was changed."""
+        if orig is None:
+            dict.pop(self, item, None)
+            self._timestamps.pop(item, None)
+        else:
+            dict.__setitem__(self, item, orig[0])
+            self._timestamps[item] = orig[1]
+
+    def _timestamp(self, item):
+        """Return the timestamp of an item."""
+        timestamp = self._timestamps.get(item)
+        if timestamp is None:
+            value = dict.get(self, item)
+            if value.__class__ is Column:
+                return value.timestamp
+        return timestamp
+
+    def _unpack(self, item, col):
+        """Replace a fetched Column with its value, and return it."""
+        value = self._decode(item, col)
+        dict.__setitem__(self, item, value)
+        self._timestamps[item] = col.timestamp
+        return value
+
+    def _prepare(self, item, value):
+        """Return value validated for storing in item."""
+        field = self._fields.get(item)
+        if field is None:
+            return self.sanitize(value)
+        return field.validate(value)
+
+    def _codec(self, item):
+        """Return the compression codec for an item, or None."""
+        field = self._fields.get(item)
+        if field is not None and field.compression:
+            return field.compression
+        if self._compression.__class__ is dict:
+            return self._compression.get(item)
+        return self._compression
+
+    def _encode(self, item, value):
+        """Return the bytes to store in Cassandra for an item's value."""
+        if value.__class__ is Column:
+            return value.value
+        field = self._fields.get(item)
+        if field is not None:
+            value = field.encode(value)
+        codec = self._codec(item)
+        return compression.compress(value, codec) if codec else value
+
+    def _decode(self, item, value):
+        """Return the value of an item, decoding it if it's a Column."""
+        if value.__class__ is not Column:
+            return value
+        data = value.value
+        if self._codec(item):
+            data = compression.decompress(data, self._compression_legacy)
+        field = self._fields.get(item)
+        return data if field is None else field.decode(data)
+
+    def _column(self, name):
+        """Return a Column for an item in the record."""
+        return Column(name, self._encode(name, dict.__getitem__(self, name)),
+                      self._timestamp(name))
+
+    @property
+    def _columns(self):
+        """Return a dict of Columns for the items in the record."""
+        return dict((name, self._column(name)) for name in self.iterkeys())
+
+    @property
+    def _original(self):
+        """Return a dict of Columns as of the last load or save."""
+        original = dict((name, self._column(name))
+                        for name in self.iterkeys()
+                        if name not in self._backup)
+        for (name, orig) in self._backup.iteritems():
+            if orig is not None:
+                original[name] = Column(name, self._encode(name, orig[0]),
+                                        orig[1])
+        return original
+
     def update(self, arg=None, **kwargs):
         """Update the object as with dict.update. Returns None."""
         if arg:
@@ -114,9 +277,81 @@ class Record(CassandraBase, dict):
             value = value.encode('utf-8')
         return str(value)
 
+    def materialize(self):
+        """Decode every item which hasn't been accessed yet.
+
+        Fetched values of typed fields, or of every item in lazy
+        records, are kept as Columns until they are read. dict methods
+        are overridden to decode them, but C-level access such as
+        dict(record) sees the Columns, so call this first."""
+        for (item, value) in dict.items(self):
+            if value.__class__ is Column:
+                self._unpack(item, value)
+        return self
+
+    def __getitem__(self, item):
+        value = dict.__getitem__(self, item)
+        if value.__class__ is Column:
+            return self._unpack(item, value)
+        return value
+
+    def get(self, item, default=None):
+        """Return the value of item if present, otherwise default."""
+        if not dict.__contains__(self, item):
+            return default
+        return self[item]
+
+    def setdefault(self, item, default=None):
+        """Return item, setting it to default if it isn't present."""
+        if not dict.__contains__(self, item):
+            self[item] = default
+        return self[item]
+
+    def pop(self, item, *default):
+        """Remove item and return its value, recording the deletion."""
+        if not dict.__contains__(self, item):
+            if default:
+                return default[0]
+            raise KeyError(item)
+        value = self[item]
+        del self[item]
+        return value
+
+    def popitem(self):
+        """Remove and return an arbitrary (item, value) pair."""
+        if not self:
+            raise KeyError("popitem(): record is empty")
+        item = iter(self).next()
+        return (item, self.pop(item))
+
+    def values(self):
+        return dict.values(self.materialize())
+
+    def itervalues(self):
+        return dict.itervalues(self.materialize())
+
+    def items(self):
+        return dict.items(self.materialize())
+
+    def iteritems(self):
+        return dict.iteritems(self.materialize())
+
+    def copy(self):
+        """Return a dict with the items in the record."""
+        return dict.copy(self.materialize())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other.materialize()
+        return dict.__eq__(self.materialize(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
     def __repr__(self):
         """Return a printable representation of this record."""
-        return "%s: %s" % (self.__class__.__name__, dict.__repr__(self))
+        return "%s: %s" % (self.__class__.__name__,
+                           dict.__repr__(self.materialize()))
 
     @staticmethod
     def timestamp():
@@ -124,70 +359,139 @@ class Record(CassandraBase, dict):
         return int(time.time())
 
     def __setitem__(self, item, value):
-        """Set an item, storing it into the _columns backing store."""
+        """Set an item, recording it as modified."""
         if value is None:
             raise exc.ErrorInvalidValue("You may not set an item to None.")
 
-        value = self.sanitize(value)
-
-        # If this doesn't change anything, don't record it
-        _orig = self._original.get(item)
-        if _orig and _orig.value == value:
+        value = self._prepare(item, value)
+
+        if item not in self._backup:
+            # If this doesn't change anything, don't record it
+            if self.get(item) == value:
+                return
+            self._back_up(item)
+
+        # If this restores the original value, it's no longer modified
+        orig = self._backup[item]
+        if orig is not None and self._decode(item, orig[0]) == value:
+            self._restore(item, orig)
+            del self._backup[item]
+            self._modified.discard(item)
+            self._deleted.discard(item)
             return
 
         dict.__setitem__(self, item, value)
-
-        if item not in self._columns:
-            self._columns[item] = Column(name=item)
-
-        col = self._columns[item]
-
-        if item in self._deleted:
-            del self._deleted[item]
-
-        self._modified[item] = True
-        col.value, col.timestamp = value, self.timestamp()
+        self._timestamps[item] = self.timestamp()
+        self._deleted.discard(item)
+        self._modified.add(item)
 
     def __delitem__(self, item):
+        if not dict.__contains__(self, item):
+            raise KeyError(item)
+
+        self._back_up(item)
         dict.__delitem__(self, item)
-        # Don't record this as a deletion if it wouldn't require a remove()
-        self._deleted[item] = item in self._original
-        if item in self._modified:
-            del self._modified[item]
-        del self._columns[item]
+        self._timestamps.pop(item, None)
+        self._modified.discard(item)
+        self._deleted.add(item)
 
     def _inject(self, key, columns):
         """Inject columns into the record after they have been fetched.."""
         self.key = key
-        if not isinstance(columns, dict):
-            columns = dict((col.name, col) for col in iter(columns))
-
-        self._original = columns
-        self.revert()
+        if isinstance(columns, dict):
+            columns = columns.itervalues()
+
+        dict.clear(self)
+        self._timestamps = {}
+        if self._lazy or (self._compression and
+                          self._compression.__class__ is not dict):
+            dict.update(self, [(col.name, col) for col in columns])
+        else:
+            # Typed and compressed values are decoded when they're
+            # first accessed
+            encoded = self._fields
+            if self._compression:
+                encoded = set(encoded).union(self._compression)
+            for col in columns:
+                dict.__setitem__(self, col.name,
+                                 col if col.name in encoded else col.value)
+                self._timestamps[col.name] = col.timestamp
+
+        self._modified, self._deleted = set(), set()
+        self._backup = {}
+        self._loaded = None
         return self
 
     def _marshal(self):
         """Marshal deleted and changed columns."""
         return {'deleted': tuple(self.key.get_path(column=col)
-                                 for col in self._deleted.keys()),
-                'changed': tuple(self._columns[key]
-                                 for key in self._modified.keys())}
+                                 for col in self._deleted),
+                'changed': tuple(self._column(key)
+                                 for key in self._modified)}
+
+    def _saved(self, changes):
+        """Make the current state the original one, after a save."""
+        self._modified.clear()
+        self._backup = {}
+
+    def load(self, key, consistency=None, columns=None):
+        """Load this record from primary key.
 
-    def load(self, key, consistency=None):
-        """Load this record from primary key"""
+        If columns (or the class's _projection) is given, only those
+        columns are fetched. Saving the partial record only writes the
+        items which are changed, so the rest of the row is untouched.
+
+        Within a Session, the record it already holds for key is
+        returned instead, if there is one."""
         if not isinstance(key, Key):
             key = self.make_key(key)
 
-        self._clean()
-        consistency = consistency or self.consistency
+        columns = columns or self._projection
+        if columns:
+            columns = list(columns)
 
-        columns = iterators.slice_iterator(key, consistency)
+        current = session.current()
+        if current is not None:
+            mapped = current.get(key)
+            if mapped is not None and session.covers(mapped, columns):
+                return mapped
 
-        self._inject(key, dict([(column.name, column) for column in columns]))
+        self._clean()
+        consistency = consistency or self.consistency
+        self._inject(key, self._fetch(key, consistency, columns))
+        if columns:
+            self._loaded = frozenset(columns)
+        if current is not None:
+            current.add(self)
         return self
 
-    def save(self, consistency=None):
-        """Save the record, returns self."""
+    def _fetch(self, key, consistency, columns=None):
+        """Return the columns of a row, from its cache if there is one."""
+        cached = cache.get_columns(key)
+        if cached is not cache.MISS:
+            if not columns:
+                return cached
+            wanted = frozenset(columns)
+            cached = [col for col in cached if col.name in wanted]
+            if not cached:
+                raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
+            return cached
+
+        if columns:
+            return iterators.slice_iterator(key, consistency, columns=columns)
+
+        generation = cache.generation(key)
+        data = iterators.slice_iterator(key, consistency,
+                                        first_page=self._page_size)
+        if generation is not None:
+            data = cache.set_columns(key, data, generation)
+        return data
+
+    def save(self, consistency=None, async_=False):
+        """Save the record, returns self.
+
+        If async_ is True, the writes are handed to the background
+        writer and a Future is returned instead of waiting for them."""
         if not self.valid():
             raise exc.ErrorMissingField("Missing required field(s):",
                                         self.missing())
@@ -199,7 +503,11 @@ class Record(CassandraBase, dict):
 
         # Marshal and save changes
         changes = self._marshal()
+        if async_:
+            return self._save_async(changes, consistency)
+
         self._save_internal(self.key, changes, consistency)
+        self._deleted.clear()
 
         try:
             try:
@@ -213,47 +521,64 @@ class Record(CassandraBase, dict):
                     index.append(self)
         finally:
             # Clean up internal state
-            if changes['changed']:
-                self._modified.clear()
-            self._original = copy.deepcopy(self._columns)
+            self._saved(changes)
 
         return self
 
-    def _save_internal(self, key, changes, consistency=None):
+    def _save_async(self, changes, consistency=None):
+        """Queue a save on the background writer, returns a Future.
+
+        The record's state is updated right away, as if the save had
+        succeeded; failures are reported through the Future and the
+        writer's error callbacks."""
+        keys = [self.key] + [mirror.mirror_key(self)
+                             for mirror in self.get_mirrors()]
+
+        self._deleted.clear()
+        self._saved(changes)
+        for key in keys:
+            cache.invalidate(key)
+
+        for index in self.get_indexes():
+            index.append(self, async_=True)
+
+        def write():
+            """Write the changes to the record and its mirrors."""
+            for key in keys:
+                self._save_internal(key, changes, consistency,
+                                    get_pool(key.keyspace))
+            return self
+
+        return workers.get_writer().submit(write)
+
+    def _save_internal(self, key, changes, consistency=None, client=None):
         """Internal save method."""
 
         consistency = consistency or self.consistency
-        client = self._get_cas(key.keyspace)
+        client = client or self._get_cas(key.keyspace)
         # Delete items
         for path in changes['deleted']:
             client.remove(key.key, path,
                           self.timestamp(), consistency)
-        self._deleted.clear()
 
         # Update items
         if changes['changed']:
             client.batch_mutate(*self._get_batch_args(
                     key, changes['changed'], consistency))
 
+        cache.invalidate(key)
+
     def _get_batch_args(self, key, columns, consistency=None):
         """Return a BatchMutation for the given key and columns."""
         consistency = consistency or self.consistency
+        return (mutation_map(key, columns), consistency)
 
-        mutations = []
-        
-        if key.is_super():
-            columns = [SuperColumn(name=key.super_column, columns=columns)]
-            col_type = "super_column"
-        else:
-            col_type = "column"
-            
-        mutations = [Mutation(column_or_supercolumn=ColumnOrSuperColumn(**{col_type:col}))
-                     for col in columns]
-
-        mutation_map = {key.key:
-                        {key.column_family: mutations}}
+    @classmethod
+    def query(cls, *expressions, **kwargs):
+        """Return a Query for records matching index expressions.
 
-        return (mutation_map, consistency)
+        See lazyboy.query for the expressions and arguments."""
+        return Query(cls, expressions, **kwargs)
 
     @classmethod
     def remove_key(cls, key, consistency=None):
@@ -262,6 +587,7 @@ class Record(CassandraBase, dict):
         get_pool(key.keyspace).remove(key.key,
                                       key.get_path(), cls.timestamp(),
                                consistency)
+        cache.invalidate(key)
 
     def remove(self, consistency=None):
         """Remove this record from Cassandra."""
@@ -269,16 +595,17 @@ class Record(CassandraBase, dict):
         self._get_cas().remove(self.key.key,
                                self.key.get_path(), self.timestamp(),
                                consistency)
+        cache.invalidate(self.key)
         self._clean()
         return self
 
     def revert(self):
         """Revert changes, restoring to the state we were in when loaded."""
-        for col in self._original.values():
-            dict.__setitem__(self, col.name, col.value)
-            self._columns[col.name] = copy.copy(col)
+        for (item, orig) in self._backup.iteritems():
+            self._restore(item, orig)
 
-        self._modified, self._deleted = {}, {}
+        self._modified, self._deleted = set(), set()
+        self._backup = {}
 
 
 class MirroredRecord(Record):
@@ -290,6 +617,6 @@ class MirroredRecord(Record):
         assert isinstance(parent_record, Record)
         raise exc.ErrorMissingKey("Please implement a mirror_key method.")
 
-    def save(self, consistency=None):
+    def save(self, consistency=None, async_=False):
         """Refuse to save this record."""
         raise exc.ErrorImmutable("Mirrored records are immutable.")
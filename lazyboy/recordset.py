@@ -10,6 +10,7 @@ from itertools import ifilter
 from lazyboy.key import Key
 import lazyboy.iterators as itr
 from lazyboy.record import Record
+import lazyboy.session as session
 from lazyboy.base import CassandraBase
 from lazyboy.exceptions import ErrorMissingField
 
@@ -84,6 +85,12 @@ class KeyRecordSet(RecordSet):
     def _batch_load(self, record_class, keys, consistency=None):
         """Return an iterator of records for the given keys."""
         consistency = consistency or self.consistency
+        current = session.current()
+        if current is not None:
+            for record in current.load_many(record_class, keys, consistency):
+                yield record
+            return
+
         data = itr.multigetterator(keys, consistency)
         for (keyspace, col_fams) in data.iteritems():
             for (col_fam, rows) in col_fams.iteritems():
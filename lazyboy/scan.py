@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Parallel column family scans.
+
+The ring is divided into token ranges with describe_ring and
+describe_splits, which are scanned concurrently:
+
+    scanner = ParallelScanner(Key("UserData", "Users"), parallelism=16)
+    for (key, columns) in scanner:
+        ...
+
+Rows from different splits are interleaved, so they come back in no
+particular order.
+"""
+
+from __future__ import with_statement
+import sys
+import time
+import Queue
+import random
+import logging
+import threading
+
+from cassandra.ttypes import ConsistencyLevel
+
+import lazyboy.connection as connection
+import lazyboy.exceptions as exc
+from lazyboy.iterators import range_iterator, key_token, RANGE_PAGE_SIZE, \
+    PAGE_SIZE
+from lazyboy.key import Key
+from lazyboy.workers import WorkerPool
+
+
+# Rows per split requested from describe_splits
+SPLIT_SIZE = 65536
+
+_DONE = object()
+
+
+class Split(object):
+
+    """A token range of a column family, and the nodes holding it.
+
+    start_token is exclusive, end_token is inclusive."""
+
+    def __init__(self, start_token, end_token, endpoints=()):
+        self.start_token = start_token
+        self.end_token = end_token
+        self.endpoints = list(endpoints)
+
+    def __eq__(self, other):
+        return (isinstance(other, Split) and
+                (self.start_token, self.end_token) ==
+                (other.start_token, other.end_token))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "Split(%r, %r, %r)" % (self.start_token, self.end_token,
+                                      self.endpoints)
+
+
+def ring_splits(keyspace, column_family, keys_per_split=SPLIT_SIZE):
+    """Return a list of Splits covering a column family."""
+    client = connection.get_pool(keyspace)
+    splits = []
+    for token_range in client.describe_ring(keyspace):
+        tokens = client.describe_splits(
+            column_family, token_range.start_token, token_range.end_token,
+            keys_per_split)
+        splits.extend(Split(start, end, token_range.endpoints)
+                      for (start, end) in zip(tokens, tokens[1:]))
+    return splits
+
+
+class ScanStats(object):
+
+    """Progress counters for a parallel scan."""
+
+    def __init__(self, splits=0):
+        self.start = time.time()
+        self.splits = splits
+        self.finished_splits = self.rows = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows, finished=False):
+        """Count rows read from a split, and whether it's finished."""
+        with self._lock:
+            self.rows += rows
+            if finished:
+                self.finished_splits += 1
+
+    def elapsed(self):
+        """Return seconds since the scan started."""
+        return max(time.time() - self.start, 1e-6)
+
+    def rows_per_sec(self):
+        """Return the average rows read per second."""
+        return self.rows / self.elapsed()
+
+    def __repr__(self):
+        return "%d/%d splits, %d rows (%.0f rows/sec)" % (
+            self.finished_splits, self.splits, self.rows,
+            self.rows_per_sec())
+
+
+class ParallelScanner(object):
+
+    """Scan a column family with several threads.
+
+    Each of `parallelism' threads scans one split at a time with
+    range_iterator, so memory use is bounded by the page size and the
+    merged queue, not by the size of the column family. Rows are
+    (Key, columns) tuples, or record_class instances if it's given.
+
+    If use_replicas is True, each split is read from one of the nodes
+    which hold it, through a connection on the port of the keyspace's
+    configured servers. If that node fails, the split carries on from
+    the last row read through the keyspace's pool.
+
+    Progress is logged every progress_interval seconds, and passed to
+    on_progress as a ScanStats, if given. A throttle is shared by all
+    the scanning threads.
+    """
+
+    def __init__(self, key=None, record_class=None, parallelism=8,
+                 keys_per_split=SPLIT_SIZE, page_size=RANGE_PAGE_SIZE,
+                 columns=None, column_count=PAGE_SIZE, consistency=None,
+                 use_replicas=True, queue_size=None, progress_interval=10,
+                 on_progress=None, throttle=None):
+        assert isinstance(key, Key) or (key is None and record_class)
+        self.key = key or record_class().make_key()
+        self.record_class = record_class
+        self.parallelism = parallelism
+        self.keys_per_split = keys_per_split
+        self.page_size = page_size
+        self.columns = columns
+        self.column_count = column_count
+        self.consistency = consistency or ConsistencyLevel.ONE
+        self.use_replicas = use_replicas
+        self.queue_size = queue_size or page_size * parallelism
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress
+        self.throttle = throttle
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.stats = None
+        self._partitioner = None
+        self._last_report = 0
+
+    def splits(self):
+        """Return the Splits to scan."""
+        return ring_splits(self.key.keyspace, self.key.column_family,
+                           self.keys_per_split)
+
+    def partitioner(self):
+        """Return the name of the cluster's partitioner."""
+        if self._partitioner is None:
+            self._partitioner = connection.get_pool(
+                self.key.keyspace).describe_partitioner()
+        return self._partitioner
+
+    def _replica(self, split):
+        """Return a client connected to a node holding split, or None."""
+        if not self.use_replicas or not split.endpoints:
+            return None
+
+        return connection.get_host_pool(self.key.keyspace,
+                                        random.choice(split.endpoints))
+
+    def rows(self, split):
+        """Return an iterator over the rows in a split."""
+        client, last = self._replica(split), None
+        while True:
+            start = (split.start_token if last is None
+                     else key_token(last, self.partitioner()))
+            try:
+                for row in range_iterator(
+                    self.key, self.consistency, start_token=start,
+                    finish_token=split.end_token, page_size=self.page_size,
+                    columns=self.columns, column_count=self.column_count,
+                    record_class=self.record_class, client=client,
+                    throttle=self.throttle):
+                    last = (row.key if self.record_class else row[0]).key
+                    yield row
+                return
+            except exc.ErrorThriftMessage, ex:
+                if client is None:
+                    raise
+                self.log.warning("Reading %r from a replica failed (%s), "
+                                 "using the pool", split, ex)
+                client = None
+
+    def _report(self, force=False):
+        """Log progress, if it's time to."""
+        if not force and (time.time() - self._last_report <
+                          self.progress_interval):
+            return
+        self._last_report = time.time()
+        self.log.info("%r", self.stats)
+        if self.on_progress:
+            self.on_progress(self.stats)
+
+    def _scan_split(self, split, func):
+        """Pass the rows in split to func, counting them."""
+        rows = 0
+        for row in self.rows(split):
+            func(row)
+            rows += 1
+            if rows == self.page_size:
+                self.stats.add(rows)
+                rows = 0
+        self.stats.add(rows, finished=True)
+
+    def _run(self, job, splits, stop):
+        """Run job(split) for each split in the pool, returns futures.
+
+        Once stop is set, splits which haven't started are skipped; it's
+        set when a job fails."""
+        self.stats = ScanStats(len(splits))
+        self._last_report = time.time()
+        pool = WorkerPool(workers=self.parallelism,
+                          queue_size=max(len(splits), 1),
+                          name="lazyboy-scan")
+
+        def run(split):
+            if stop.isSet():
+                return
+            try:
+                job(split)
+            except:
+                stop.set()
+                raise
+
+        return (pool, [pool.submit(run, split) for split in splits])
+
+    def run(self, callback, splits=None):
+        """Scan every split, calling callback(split, rows) for each.
+
+        rows is an iterator over the split's rows. Callbacks run in the
+        scanning threads, so they must be thread-safe. Returns the
+        ScanStats."""
+        splits = self.splits() if splits is None else splits
+
+        def scan(split):
+            counter = _Counter(self.rows(split), self.stats, self.page_size)
+            callback(split, counter)
+            counter.finish()
+
+        stop = threading.Event()
+        (pool, futures) = self._run(scan, splits, stop)
+        try:
+            for future in futures:
+                while True:
+                    try:
+                        future.result(self.progress_interval)
+                        break
+                    except exc.ErrorTimeout:
+                        self._report()
+        finally:
+            stop.set()
+            pool.drain()
+        self._report(True)
+        return self.stats
+
+    def scan(self, splits=None):
+        """Return an iterator over every row, from all splits at once.
+
+        Rows are passed through a queue of queue_size rows, so scanning
+        stalls when they aren't consumed. Errors in a split are raised
+        from the iterator. Closing the iterator stops the scan."""
+        splits = self.splits() if splits is None else splits
+        rows = Queue.Queue(self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.isSet():
+                try:
+                    rows.put(item, True, .1)
+                    return
+                except Queue.Full:
+                    pass
+            raise _Stopped()
+
+        def job(split):
+            try:
+                self._scan_split(split, put)
+            except _Stopped:
+                return
+            except Exception:
+                put((_DONE, sys.exc_info()))
+                return
+            put((_DONE, None))
+
+        pool = self._run(job, splits, stop)[0]
+        try:
+            remaining = len(splits)
+            while remaining:
+                try:
+                    item = rows.get(True, self.progress_interval)
+                except Queue.Empty:
+                    self._report()
+                    continue
+
+                if item.__class__ is tuple and item[0] is _DONE:
+                    if item[1]:
+                        raise item[1][0], item[1][1], item[1][2]
+                    remaining -= 1
+                    continue
+                yield item
+                self._report()
+        finally:
+            stop.set()
+            pool.drain()
+        self._report(True)
+
+    def __iter__(self):
+        return self.scan()
+
+
+class _Stopped(Exception):
+
+    """Raised in a scanning thread when the scan is closed."""
+
+
+class _Counter(object):
+
+    """An iterator which counts rows for a ScanStats."""
+
+    def __init__(self, rows, stats, every):
+        self.rows = rows
+        self.stats = stats
+        self.every = every
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        row = self.rows.next()
+        self.count += 1
+        if self.count == self.every:
+            self.stats.add(self.count)
+            self.count = 0
+        return row
+
+    def finish(self):
+        """Count the remaining rows, and the split as finished."""
+        self.stats.add(self.count, finished=True)
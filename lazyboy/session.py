@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Sessions, with an identity map and batched writes.
+
+Within a session, every load of a row returns the same Record, and
+changes to the records it loaded are written together when it ends:
+
+    with Session():
+        user = User().load("cleese")
+        assert User().load("cleese") is user
+        user['age'] = 71
+    # One batch_mutate per keyspace writes every changed record
+
+Note that Record.load() returns the mapped instance, which isn't
+necessarily the one it was called on, so always use its return value.
+"""
+
+import threading
+
+from cassandra.ttypes import ConsistencyLevel, Deletion, Mutation, \
+    SlicePredicate
+
+import lazyboy.cache as cache
+import lazyboy.connection as connection
+import lazyboy.iterators as iterators
+from lazyboy.commit import merge_mutations
+from lazyboy.key import Key
+import lazyboy.exceptions as exc
+
+_LOCAL = threading.local()
+
+
+def current():
+    """Return this thread's active Session, or None."""
+    return getattr(_LOCAL, 'session', None)
+
+
+def covers(record, columns=None):
+    """Return True if a record was loaded with at least columns."""
+    return (record._loaded is None or
+            bool(columns) and record._loaded.issuperset(columns))
+
+
+class Session(object):
+
+    """A unit of work, with an identity map of the records it loads.
+
+    Sessions are entered with `with', and apply to the current thread.
+    They can be nested; the innermost one is used. On a clean exit,
+    the session is committed.
+    """
+
+    def __init__(self, consistency=None):
+        self.consistency = consistency
+        self._records = {}
+        self._previous = []
+
+    def __enter__(self):
+        self._previous.append(current())
+        _LOCAL.session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            _LOCAL.session = self._previous.pop()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __contains__(self, record):
+        return self._records.get(cache.cache_key(record.key)) is record
+
+    def get(self, key):
+        """Return the record mapped to a Key, or None."""
+        return self._records.get(cache.cache_key(key))
+
+    def add(self, record):
+        """Add a record to the session, returns it.
+
+        The record replaces any other record with the same key."""
+        if not record.key:
+            record.key = record.default_key()
+        self._records[cache.cache_key(record.key)] = record
+        return record
+
+    def expunge(self, record):
+        """Remove a record from the session."""
+        if record in self:
+            del self._records[cache.cache_key(record.key)]
+
+    def load(self, record_class, key, consistency=None, columns=None):
+        """Return the record for key, loading it if it isn't mapped."""
+        if not isinstance(key, Key):
+            key = record_class().make_key(key)
+        record = self.get(key)
+        if record is not None and covers(record, columns):
+            return record
+        return self.add(record_class().load(key, consistency, columns))
+
+    def load_many(self, record_class, keys, consistency=None):
+        """Return a list of records for keys, in order.
+
+        Only keys without a mapped record are fetched, in a single
+        multiget. Rows which don't exist are left out."""
+        keys = list(keys)
+        wanted = dict((cache.cache_key(key), key) for key in keys
+                      if cache.cache_key(key) not in self._records)
+        if wanted:
+            data = iterators.multigetterator(
+                wanted.values(), consistency or self.consistency)
+            for key in wanted.itervalues():
+                try:
+                    cols = data[key.keyspace][key.column_family][key.key]
+                    if key.super_column is not None:
+                        cols = cols[key.super_column]
+                except KeyError:
+                    continue
+                if not cols:
+                    # multiget_slice returns missing rows with no columns
+                    continue
+                self.add(record_class()._inject(key, cols))
+
+        records = (self.get(key) for key in keys)
+        return [record for record in records if record is not None]
+
+    def dirty(self):
+        """Return a list of the modified records in the session."""
+        return [record for record in self._records.itervalues()
+                if record.is_modified()]
+
+    def commit(self, consistency=None):
+        """Write every modified record, with one batch_mutate per keyspace.
+
+        If the write fails, the records keep their changes."""
+        consistency = (consistency or self.consistency or
+                       ConsistencyLevel.ONE)
+        pending, maps = [], {}
+        for record in self.dirty():
+            if not record.valid():
+                raise exc.ErrorMissingField("Missing required field(s):",
+                                            record.missing())
+            changes = record._marshal()
+            keys = [record.key] + [mirror.mirror_key(record)
+                                   for mirror in record.get_mirrors()]
+            for key in keys:
+                maps.setdefault(key.keyspace, []).append(
+                    _mutations(record, key, changes))
+            pending.append((record, changes, keys))
+
+        for (keyspace, mutation_maps) in maps.iteritems():
+            connection.get_pool(keyspace).batch_mutate(
+                merge_mutations(mutation_maps), consistency)
+
+        for (record, changes, keys) in pending:
+            record._deleted.clear()
+            record._saved(changes)
+            for key in keys:
+                cache.invalidate(key)
+            for index in record.get_indexes():
+                index.append(record)
+
+        return len(pending)
+
+    def rollback(self):
+        """Revert every modified record in the session."""
+        for record in self.dirty():
+            record.revert()
+
+
+def _mutations(record, key, changes):
+    """Return a mutation map writing a record's changes to key."""
+    if changes['changed']:
+        mutation_map = record._get_batch_args(key, changes['changed'])[0]
+    else:
+        mutation_map = {key.key: {key.column_family: []}}
+
+    if changes['deleted']:
+        deletion = Deletion(
+            timestamp=record.timestamp(), super_column=key.super_column,
+            predicate=SlicePredicate(column_names=[
+                    path.column for path in changes['deleted']]))
+        mutation_map[key.key][key.column_family].append(
+            Mutation(deletion=deletion))
+    return mutation_map
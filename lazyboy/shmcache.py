@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Row cache shared between processes.
+
+SharedCache keeps rows in a fixed-size hash table in a memory-mapped
+file, so every process on a host which maps the same file shares it.
+It's meant to sit below the process-local cache:
+
+    add_cache("UserData", "Users", cache=cache.TieredCache(
+            LRUCache(10000), SharedCache("/dev/shm/lazyboy-users")))
+
+Each slot holds one row (with any of its super columns) and is chosen
+by a hash of the row. A new row replaces whatever was in its slot.
+Reads take no locks: each slot has a sequence number which writers
+make odd while they change it, and readers retry if it was odd or
+changed while they copied the slot. Writers in different processes
+serialize on striped fcntl locks. Invalidations bump a generation
+counter in the file, so every process sees them.
+"""
+
+from __future__ import with_statement
+import os
+import mmap
+import time
+import fcntl
+import struct
+import marshal
+import threading
+from hashlib import md5
+
+import lazyboy.exceptions as exc
+from lazyboy.cache import MISS, serialize_columns, deserialize_columns
+
+MAGIC = "LZBYSHM1"
+
+# magic, slots, slot size, generation
+_FILE_HEADER = struct.Struct("=8sIIQ")
+_HEADER_SIZE = 64
+
+# sequence, payload length, row hash
+_SLOT_HEADER = struct.Struct("=IIQ")
+
+# Attempts at a consistent read of a slot before treating it as a miss
+READ_RETRIES = 8
+
+
+def _row_hash(row):
+    """Return a 64-bit hash of a row, stable across processes."""
+    return struct.unpack("=Q", md5(marshal.dumps(row)).digest()[:8])[0]
+
+
+class SharedCache(object):
+
+    """A row cache in a memory-mapped file, shared between processes.
+
+    The file is created when the cache is first opened. Opening an
+    existing file with a different layout raises ErrorInvalidValue,
+    since other processes may still have it mapped; remove the file
+    or use another path to change the layout. Rows whose data doesn't
+    fit in slot_size bytes aren't cached.
+    """
+
+    def __init__(self, path, slots=65536, slot_size=4096, stripes=64,
+                 ttl=None):
+        self.path = path
+        self.slots, self.slot_size = slots, slot_size
+        self.stripes = stripes
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self.oversize = 0
+        # fcntl locks are per process, so threads also need these
+        self._locks = [threading.Lock() for num in range(stripes + 1)]
+        self._size = _HEADER_SIZE + slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            with self._locked(-1):
+                self._init_file()
+        except:
+            os.close(self._fd)
+            raise
+        self._map = mmap.mmap(self._fd, self._size)
+
+    def _init_file(self):
+        """Lay out a new file, or check an existing one's layout."""
+        size = os.fstat(self._fd).st_size
+        if size:
+            header = _FILE_HEADER.unpack(
+                os.read(self._fd, _FILE_HEADER.size))
+            if size != self._size or \
+                    header[:3] != (MAGIC, self.slots, self.slot_size):
+                raise exc.ErrorInvalidValue(
+                    "%s doesn't match a cache of %d slots of %d bytes." %
+                    (self.path, self.slots, self.slot_size))
+            return
+        os.ftruncate(self._fd, self._size)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, _FILE_HEADER.pack(MAGIC, self.slots,
+                                             self.slot_size, 0))
+
+    def _locked(self, stripe):
+        """Return a context manager locking a stripe, or -1 for the file."""
+        return _StripeLock(self._fd, self._locks[stripe], stripe + 1)
+
+    def close(self):
+        """Unmap the cache."""
+        self._map.close()
+        os.close(self._fd)
+
+    def __len__(self):
+        """Return the number of occupied slots."""
+        return sum(1 for slot in range(self.slots)
+                   if self._read_header(slot)[1])
+
+    @property
+    def generation(self):
+        """The number of invalidations by any process."""
+        return _FILE_HEADER.unpack_from(self._map, 0)[3]
+
+    def _bump_generation(self):
+        """Record an invalidation."""
+        with self._locked(-1):
+            (magic, slots, slot_size, generation) = \
+                _FILE_HEADER.unpack_from(self._map, 0)
+            _FILE_HEADER.pack_into(self._map, 0, magic, slots, slot_size,
+                                   generation + 1)
+
+    def _slot(self, row):
+        """Return (slot, hash) for a row."""
+        row_hash = _row_hash(row)
+        return (row_hash % self.slots, row_hash)
+
+    def _offset(self, slot):
+        """Return the file offset of a slot."""
+        return _HEADER_SIZE + slot * self.slot_size
+
+    def _read_header(self, slot):
+        """Return (sequence, length, hash) of a slot."""
+        return _SLOT_HEADER.unpack_from(self._map, self._offset(slot))
+
+    def _read(self, slot, row_hash):
+        """Return the entries dict in a slot, or None.
+
+        This doesn't lock; it retries until the slot's sequence number
+        shows it wasn't being written while it was read."""
+        offset = self._offset(slot) + _SLOT_HEADER.size
+        for attempt in range(READ_RETRIES):
+            (seq, length, slot_hash) = self._read_header(slot)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            if not length or slot_hash != row_hash:
+                return None
+            data = self._map[offset:offset + length]
+            if self._read_header(slot)[0] == seq:
+                try:
+                    return marshal.loads(data)
+                except (ValueError, EOFError, TypeError):
+                    return None
+        return None
+
+    def _write(self, slot, row_hash, data):
+        """Replace a slot's contents; the stripe must be locked."""
+        offset = self._offset(slot)
+        (seq, length, old_hash) = self._read_header(slot)
+        _SLOT_HEADER.pack_into(self._map, offset, seq + 1, length, old_hash)
+        start = offset + _SLOT_HEADER.size
+        self._map[start:start + len(data)] = data
+        _SLOT_HEADER.pack_into(self._map, offset, seq + 2, len(data),
+                               row_hash)
+
+    def get(self, key):
+        """Return the columns cached for a cache key, or MISS."""
+        row = key[:3]
+        (slot, row_hash) = self._slot(row)
+        entries = self._read(slot, row_hash)
+        entry = entries[1].get(key[3]) if entries and entries[0] == row \
+            else None
+        if entry is None:
+            self.misses += 1
+            return MISS
+        if entry[0] and entry[0] <= time.time():
+            self.expirations += 1
+            self.misses += 1
+            return MISS
+        self.hits += 1
+        return deserialize_columns(entry[1])
+
+    def set(self, key, columns, generation=None):
+        """Cache columns for a cache key.
+
+        If generation is given, nothing is cached if an invalidation
+        happened since the generation had that value."""
+        row = key[:3]
+        (slot, row_hash) = self._slot(row)
+        expires = time.time() + self.ttl if self.ttl else 0
+        entry = (expires, serialize_columns(columns))
+        with self._locked(slot % self.stripes):
+            if generation is not None and generation != self.generation:
+                return
+            entries = self._read(slot, row_hash)
+            if entries and entries[0] == row:
+                now = time.time()
+                supers = dict((name, old) for (name, old)
+                              in entries[1].iteritems()
+                              if not old[0] or old[0] > now)
+            else:
+                if self._read_header(slot)[1]:
+                    self.evictions += 1
+                supers = {}
+            supers[key[3]] = entry
+
+            data = marshal.dumps((row, supers))
+            if len(data) > self.slot_size - _SLOT_HEADER.size:
+                data = marshal.dumps((row, {key[3]: entry}))
+                if len(data) > self.slot_size - _SLOT_HEADER.size:
+                    self.oversize += 1
+                    return
+            self._write(slot, row_hash, data)
+
+    def invalidate(self, key):
+        """Remove a row, and any of its super columns, from the cache."""
+        self._bump_generation()
+        row = key[:3]
+        (slot, row_hash) = self._slot(row)
+        with self._locked(slot % self.stripes):
+            if self._read_header(slot)[2] == row_hash:
+                self._write(slot, 0, "")
+
+    def clear(self):
+        """Remove everything from the cache."""
+        self._bump_generation()
+        for slot in range(self.slots):
+            with self._locked(slot % self.stripes):
+                if self._read_header(slot)[1]:
+                    self._write(slot, 0, "")
+
+    def stats(self):
+        """Return a dict of this process's cache metrics."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'oversize': self.oversize,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+
+class _StripeLock(object):
+
+    """Lock a stripe against other threads, then other processes."""
+
+    def __init__(self, fd, lock, offset):
+        self.fd, self.lock, self.offset = fd, lock, offset
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+        except:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        finally:
+            self.lock.release()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.blob."""
+
+from __future__ import with_statement
+import unittest
+import threading
+from cStringIO import StringIO
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.iterators import pack
+import lazyboy.blob as blob
+import lazyboy.record as record
+import lazyboy.cache as cache
+import lazyboy.exceptions as exc
+from lazyboy.util import save
+
+
+class FakeClient(object):
+
+    """A client holding one row in memory.
+
+    Writes are resolved by timestamp, as Cassandra does: the newest
+    column wins, and deletions remove columns up to their timestamp."""
+
+    def __init__(self):
+        self.row = {}
+        self.deleted = {}
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def get_slice(self, row_key, parent, predicate, consistency):
+        with self._lock:
+            return list(pack(self.row[name]
+                             for name in predicate.column_names
+                             if name in self.row))
+
+    def batch_mutate(self, mutation_map, consistency):
+        with self._lock:
+            self.batches += 1
+            for mutations in mutation_map.values():
+                for mutation in mutations.values()[0]:
+                    if mutation.deletion:
+                        stamp = mutation.deletion.timestamp
+                        for name in mutation.deletion.predicate.column_names:
+                            self.deleted[name] = max(
+                                stamp, self.deleted.get(name, stamp))
+                            if (name in self.row and
+                                self.row[name].timestamp <= stamp):
+                                del self.row[name]
+                        continue
+
+                    col = mutation.column_or_supercolumn.column
+                    old = self.row.get(col.name)
+                    if col.timestamp <= self.deleted.get(col.name, -1):
+                        continue
+                    if old is None or ((col.timestamp, col.value) >
+                                       (old.timestamp, old.value)):
+                        self.row[col.name] = col
+
+
+class BlobTest(unittest.TestCase):
+
+    """Test writing and reading blobs."""
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.key = Key("eggs", "bacon", "tomato")
+        self._save = save(blob.connection, ('get_pool',))
+        self._save.__enter__()
+        blob.connection.get_pool = lambda keyspace: self.client
+        blob._REMOVED.clear()
+
+    def tearDown(self):
+        self._save.__exit__(None, None, None)
+
+    def test_roundtrip(self):
+        """Make sure blobs are chunked, and read back in pieces."""
+        data = "".join(chr(num % 256) for num in range(1000))
+        manifest = blob.write_blob(self.key, "img", StringIO(data),
+                                   chunk_size=64, batch_chunks=3)
+        self.assert_(manifest['chunks'] == 16)
+        self.assert_(manifest['size'] == 1000)
+        # 6 chunk batches and the manifest
+        self.assert_(self.client.batches == 7)
+        self.assert_(len(self.client.row) == 17)
+
+        for prefetch in (True, False):
+            reader = blob.open_blob(self.key, "img", batch_chunks=5,
+                                    prefetch=prefetch)
+            self.assert_(reader.read(10) == data[:10])
+            self.assert_(reader.tell() == 10)
+            self.assert_(reader.read(100) == data[10:110])
+            self.assert_(reader.read() == data[110:])
+            self.assert_(reader.read() == "")
+
+        with blob.open_blob(self.key, "img") as reader:
+            self.assert_("".join(reader) == data)
+
+    def test_cache_invalidation(self):
+        """Make sure blob writes and removals invalidate the row caches."""
+        cache.add_cache("eggs", "bacon")
+        cache.add_negative_cache("eggs", "bacon")
+        try:
+            writes = (lambda: blob.write_blob(self.key, "img", "data"),
+                      lambda: blob.remove_blob(self.key, "img"))
+            for write in writes:
+                blob.write_blob(self.key, "img", "old")
+                cache.set_columns(self.key, [Column("name", "Graham", 0)])
+                cache.set_missing(self.key)
+                write()
+                self.assert_(cache.get_columns(self.key) is cache.MISS)
+                self.assert_(not cache.is_missing(self.key))
+        finally:
+            cache.remove_cache("eggs", "bacon")
+            cache.remove_negative_cache("eggs", "bacon")
+
+    def test_same_second(self):
+        """Make sure rewrites and removals within a second aren't lost."""
+        with save(record.time, ('time',)):
+            record.time.time = lambda: 1281000000.0
+            for num in range(3):
+                blob.write_blob(self.key, "img", "data-%d" % num,
+                                chunk_size=4)
+                self.assert_(blob.open_blob(self.key, "img").read() ==
+                             "data-%d" % num)
+            self.assert_(len(self.client.row) == 3)
+
+            blob.remove_blob(self.key, "img")
+            self.assert_(blob.get_manifest(self.key, "img") is None)
+            blob.write_blob(self.key, "img", "again")
+            self.assert_(blob.open_blob(self.key, "img").read() == "again")
+
+            # Versions are in Record's units, one tick past the last
+            self.assert_(self.client.row["img"].timestamp ==
+                         record.Record.timestamp() + 3)
+
+    def test_replace(self):
+        """Make sure replacing a blob removes the old chunks."""
+        blob.write_blob(self.key, "doc", "x" * 100, chunk_size=10)
+        blob.write_blob(self.key, "doc", "y" * 25, chunk_size=10)
+        self.assert_(len(self.client.row) == 4)
+        self.assert_(blob.open_blob(self.key, "doc").read() == "y" * 25)
+
+        blob.remove_blob(self.key, "doc")
+        self.assert_(self.client.row == {})
+        self.assertRaises(exc.ErrorNoSuchRecord, blob.open_blob,
+                          self.key, "doc")
+
+    def test_empty(self):
+        """Make sure empty blobs can be stored."""
+        manifest = blob.write_blob(self.key, "nil", "")
+        self.assert_(manifest['chunks'] == 0)
+        self.assert_(blob.open_blob(self.key, "nil").read() == "")
+
+    def test_corrupt(self):
+        """Make sure missing or altered chunks are detected."""
+        manifest = blob.write_blob(self.key, "doc", "z" * 30, chunk_size=10)
+        names = blob._chunk_names("doc", manifest)
+
+        self.client.row[names[1]].value = "a" * 10
+        self.assertRaises(exc.ErrorCorruptData,
+                          blob.open_blob(self.key, "doc").read)
+
+        del self.client.row[names[2]]
+        self.assertRaises(exc.ErrorCorruptData,
+                          blob.open_blob(self.key, "doc").read)
+
+    def test_failed_write(self):
+        """Make sure a failed write leaves the old blob in place."""
+        blob.write_blob(self.key, "doc", "old", chunk_size=10)
+        real = self.client.batch_mutate
+        calls = []
+
+        def batch_mutate(mutation_map, consistency):
+            calls.append(1)
+            if len(calls) == 2:
+                raise Exception("Timed out")
+            return real(mutation_map, consistency)
+
+        self.client.batch_mutate = batch_mutate
+        self.assertRaises(Exception, blob.write_blob, self.key, "doc",
+                          "n" * 50, chunk_size=10, batch_chunks=1,
+                          concurrency=1)
+        self.client.batch_mutate = real
+        self.assert_(blob.open_blob(self.key, "doc").read() == "old")
+        self.assert_(len(self.client.row) == 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.bulkload."""
+
+from __future__ import with_statement
+import unittest
+import tempfile
+import threading
+from StringIO import StringIO
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+import lazyboy.bulkload as bulkload
+import lazyboy.cache as cache
+from lazyboy.util import save
+
+
+class FakeClient(object):
+
+    """A client which records batch_mutate calls."""
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def batch_mutate(self, mutation_map, consistency_level):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise Exception("Overloaded")
+            self.batches.append(mutation_map)
+
+
+class ReaderTest(unittest.TestCase):
+
+    """Test the input readers."""
+
+    def test_read_jsonl(self):
+        """Make sure JSON lines are parsed, skipping blank lines."""
+        rows = list(bulkload.read_jsonl(StringIO(
+                    '{"key": "cleese", "name": "John"}\n\n'
+                    '{"key": "palin", "name": "Michael"}\n')))
+        self.assert_(rows == [{'key': 'cleese', 'name': 'John'},
+                              {'key': 'palin', 'name': 'Michael'}])
+
+    def test_read_csv(self):
+        """Make sure CSV rows are returned as dicts."""
+        rows = list(bulkload.read_csv(StringIO(
+                    "key,name\ncleese,John\npalin,Michael\n")))
+        self.assert_(rows == [{'key': 'cleese', 'name': 'John'},
+                              {'key': 'palin', 'name': 'Michael'}])
+
+
+class BulkLoaderTest(unittest.TestCase):
+
+    """Test lazyboy.bulkload.BulkLoader."""
+
+    def _load(self, loader, rows, client):
+        """Run a load against client."""
+        with save(bulkload.connection, ('get_pool',)):
+            bulkload.connection.get_pool = lambda keyspace: client
+            return loader.load(rows)
+
+    def test_raw_columns(self):
+        """Make sure raw rows are batched into mutation maps."""
+        client = FakeClient()
+        loader = bulkload.BulkLoader(Key("eggs", "bacon"), batch_size=4,
+                                     concurrency=2)
+        rows = [{'key': 'row-%d' % num, 'number': num, u'näme': u'Ünicode'}
+                for num in range(10)]
+        stats = self._load(loader, rows, client)
+
+        self.assert_(stats.rows == 10)
+        self.assert_(stats.batches == 3)
+        self.assert_(stats.failed_batches == 0)
+        self.assert_(stats.bytes > 0)
+        self.assert_(sorted(len(batch) for batch in client.batches) ==
+                     [2, 4, 4])
+
+        written = {}
+        for batch in client.batches:
+            written.update(batch)
+        mutations = written['row-3']['bacon']
+        columns = dict((mut.column_or_supercolumn.column.name,
+                        mut.column_or_supercolumn.column.value)
+                       for mut in mutations)
+        self.assert_(columns == {'number': '3',
+                                 u'näme'.encode('utf-8'):
+                                     u'Ünicode'.encode('utf-8')})
+
+    def test_cache_invalidation(self):
+        """Make sure cached rows are invalidated once they're written."""
+        key = Key("eggs", "bacon", "cleese")
+        cache.add_cache("eggs", "bacon")
+        try:
+            cache.set_columns(key, [Column("name", "Graham", 0)])
+            client = FakeClient()
+            (cached, send) = ([], client.batch_mutate)
+
+            def batch_mutate(*args):
+                cached.append(cache.get_columns(key) is not cache.MISS)
+                send(*args)
+
+            client.batch_mutate = batch_mutate
+            self._load(bulkload.BulkLoader(Key("eggs", "bacon")),
+                       [{'key': 'cleese', 'name': 'John'}], client)
+            self.assert_(cached == [True])
+            self.assert_(cache.get_columns(key) is cache.MISS)
+        finally:
+            cache.remove_cache("eggs", "bacon")
+
+    def test_records(self):
+        """Make sure rows can be mapped to Record subclasses."""
+
+        class User(Record):
+            _keyspace = "eggs"
+            _column_family = "users"
+            _required = ('username',)
+
+        client = FakeClient()
+        loader = bulkload.BulkLoader(record_class=User,
+                                     key_field='username')
+        stats = self._load(loader, [{'username': 'cleese', 'age': 70}],
+                           client)
+        self.assert_(stats.rows == 1)
+        mutations = client.batches[0]['cleese']['users']
+        self.assert_(len(mutations) == 2)
+
+    def test_retries(self):
+        """Make sure failed batches are retried, then reported."""
+        client = FakeClient(failures=1)
+        errors = []
+        loader = bulkload.BulkLoader(Key("eggs", "bacon"), retries=1,
+                                     backoff=0, concurrency=1,
+                                     on_error=lambda *args: errors.append(args))
+        stats = self._load(loader, [{'key': 'cleese', 'name': 'John'}],
+                           client)
+        self.assert_(stats.rows == 1)
+        self.assert_(stats.failed_batches == 0)
+        self.assert_(not errors)
+
+        client = FakeClient(failures=2)
+        stats = self._load(loader, [{'key': 'cleese', 'name': 'John'}],
+                           client)
+        self.assert_(stats.rows == 0)
+        self.assert_(stats.failed_batches == 1)
+        self.assert_(len(errors) == 1)
+
+
+class MainTest(unittest.TestCase):
+
+    """Test the command line interface."""
+
+    def test_main(self):
+        """Make sure main() loads files and reports failures."""
+        client = FakeClient()
+        data = tempfile.NamedTemporaryFile(suffix=".csv")
+        data.write("id,name\ncleese,John\npalin,Michael\n")
+        data.flush()
+
+        with save(bulkload.connection, ('get_pool', 'add_pool')):
+            pools = []
+            bulkload.connection.add_pool = lambda *args: pools.append(args)
+            bulkload.connection.get_pool = lambda keyspace: client
+            res = bulkload.main(['-q', '-k', 'eggs', '-c', 'bacon',
+                                 '-s', 'localhost:1234', '-f', 'id',
+                                 '-F', 'csv', data.name])
+
+        self.assert_(res == 0)
+        self.assert_(pools == [('eggs', ['localhost:1234'])])
+        self.assert_(sorted(client.batches[0].keys()) == ['cleese', 'palin'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.cache."""
+
+from __future__ import with_statement
+import time
+import unittest
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+import lazyboy.cache as cache
+import lazyboy.iterators as iterators
+import lazyboy.column_crud as column_crud
+import lazyboy.exceptions as exc
+import lazyboy.record
+from lazyboy.util import save
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    """Test lazyboy.cache.LRUCache."""
+
+    def test_lru(self):
+        """Make sure the least recently used entries are evicted."""
+        lru = cache.LRUCache(max_size=2)
+        lru.set(('ks', 'cf', 'a', None), 1)
+        lru.set(('ks', 'cf', 'b', None), 2)
+        self.assert_(lru.get(('ks', 'cf', 'a', None)) == 1)
+        lru.set(('ks', 'cf', 'c', None), 3)
+
+        self.assert_(lru.get(('ks', 'cf', 'b', None)) is cache.MISS)
+        self.assert_(lru.get(('ks', 'cf', 'c', None)) == 3)
+        self.assert_(len(lru) == 2)
+        stats = lru.stats()
+        self.assert_((stats['hits'], stats['misses'], stats['evictions']) ==
+                     (2, 1, 1))
+
+    def test_ttl(self):
+        """Make sure entries expire."""
+        lru = cache.LRUCache(ttl=.01)
+        lru.set(('ks', 'cf', 'a', None), 1)
+        self.assert_(lru.get(('ks', 'cf', 'a', None)) == 1)
+        time.sleep(.02)
+        self.assert_(lru.get(('ks', 'cf', 'a', None)) is cache.MISS)
+        self.assert_(lru.stats()['expirations'] == 1)
+        self.assert_(len(lru) == 0)
+
+    def test_invalidate(self):
+        """Make sure invalidation removes every super column of a row."""
+        lru = cache.LRUCache()
+        for super_column in (None, 'x', 'y'):
+            lru.set(('ks', 'cf', 'a', super_column), 1)
+        lru.set(('ks', 'cf', 'b', 'x'), 2)
+
+        lru.invalidate(('ks', 'cf', 'a', 'x'))
+        self.assert_(len(lru) == 1)
+        self.assert_(lru.get(('ks', 'cf', 'b', 'x')) == 2)
+
+    def test_generation(self):
+        """Make sure stale reads aren't cached after an invalidation."""
+        lru = cache.LRUCache()
+        generation = lru.generation
+        lru.invalidate(('ks', 'cf', 'a', None))
+        lru.set(('ks', 'cf', 'a', None), "stale", generation)
+        self.assert_(lru.get(('ks', 'cf', 'a', None)) is cache.MISS)
+        lru.set(('ks', 'cf', 'a', None), "fresh", lru.generation)
+        self.assert_(lru.get(('ks', 'cf', 'a', None)) == "fresh")
+
+
+class TieredCacheTest(unittest.TestCase):
+
+    """Test lazyboy.cache.TieredCache."""
+
+    def test_tiers(self):
+        """Make sure lower tiers fill upper ones, and all are invalidated."""
+        (upper, lower) = (cache.LRUCache(), cache.LRUCache())
+        tiered = cache.TieredCache(upper, lower)
+        lower.set(('ks', 'cf', 'a', None), 1)
+
+        self.assert_(tiered.get(('ks', 'cf', 'a', None)) == 1)
+        self.assert_(upper.get(('ks', 'cf', 'a', None)) ==
+                     ((lower.generation,), 1))
+        self.assert_(tiered.get(('ks', 'cf', 'b', None)) is cache.MISS)
+
+        generation = tiered.generation
+        tiered.invalidate(('ks', 'cf', 'a', None))
+        self.assert_(len(upper) == len(lower) == 0)
+        tiered.set(('ks', 'cf', 'a', None), 2, generation)
+        self.assert_(tiered.get(('ks', 'cf', 'a', None)) is cache.MISS)
+        tiered.set(('ks', 'cf', 'a', None), 2, tiered.generation)
+        self.assert_(lower.get(('ks', 'cf', 'a', None)) == 2)
+
+
+class RegistryTest(unittest.TestCase):
+
+    """Test cache registration and use by Record and multigetterator."""
+
+    def setUp(self):
+        self.users = cache.add_cache("eggs", "users")
+        self.other = cache.add_cache("eggs")
+
+    def tearDown(self):
+        cache.remove_cache("eggs", "users")
+        cache.remove_cache("eggs")
+
+    def test_get_cache(self):
+        """Make sure caches are found by column family, then keyspace."""
+        self.assert_(cache.get_cache(Key("eggs", "users", "a")) is
+                     self.users)
+        self.assert_(cache.get_cache(Key("eggs", "bacon", "a")) is
+                     self.other)
+        self.assert_(cache.get_cache(Key("spam", "users", "a")) is None)
+        self.assert_(cache.get_columns(Key("spam", "users", "a")) is
+                     cache.MISS)
+
+    def test_record(self):
+        """Make sure loads are cached, and saves invalidate them."""
+        fetches = []
+
+        def slice_iterator(key, consistency, **kwargs):
+            fetches.append(key.key)
+            return iter([Column("name", "John", 0), Column("age", "70", 0)])
+
+        class Client(object):
+
+            def batch_mutate(self, *args):
+                pass
+
+        class User(Record):
+            _keyspace = "eggs"
+            _column_family = "users"
+
+        key = Key("eggs", "users", "cleese")
+        with save(lazyboy.record.iterators, ('slice_iterator',)):
+            lazyboy.record.iterators.slice_iterator = slice_iterator
+            user = User().load(key)
+            self.assert_(User().load(key) == user)
+            self.assert_(fetches == ["cleese"])
+            self.assert_(User().load(key, columns=['age']) == {'age': "70"})
+            self.assert_(fetches == ["cleese"])
+
+            user['age'] = 71
+            user._get_cas = lambda keyspace=None: Client()
+            user.save()
+            self.assert_(User().load(key)['age'] == "70")
+            self.assert_(fetches == ["cleese", "cleese"])
+
+    def test_multigetterator(self):
+        """Make sure only rows which miss are fetched."""
+        requested = []
+
+        class Client(object):
+
+            def multiget_slice(self, keys, parent, predicate, consistency):
+                requested.append(sorted(keys))
+                return dict((key, list(iterators.pack(
+                                    [Column("name", key.upper(), 0)])))
+                            for key in keys)
+
+        keys = [Key("eggs", "users", name) for name in ("a", "b")]
+        with save(iterators, ('get_pool',)):
+            iterators.get_pool = lambda keyspace: Client()
+            res = iterators.multigetterator(keys, None)
+            self.assert_(requested == [["a", "b"]])
+
+            res = iterators.multigetterator(
+                keys + [Key("eggs", "users", "c")], None)
+            self.assert_(requested == [["a", "b"], ["c"]])
+            rows = res["eggs"]["users"]
+            self.assert_(sorted(rows.keys()) == ["a", "b", "c"])
+            self.assert_(rows["b"][0].value == "B")
+            self.assert_(self.users.stats()['hits'] == 2)
+
+            # Range arguments bypass the cache
+            iterators.multigetterator(keys, None, count=1)
+            self.assert_(requested[-1] == ["a", "b"])
+
+
+class NegativeCacheTest(unittest.TestCase):
+
+    """Test remembering missing rows."""
+
+    def setUp(self):
+        cache.add_negative_cache("eggs", "users", ttl=60)
+
+    def tearDown(self):
+        cache.remove_negative_cache("eggs", "users")
+
+    def test_missing(self):
+        """Make sure missing rows are only fetched once."""
+        requests = []
+
+        class Client(object):
+
+            def get_slice(self, *args):
+                requests.append(args)
+                return []
+
+            def insert(self, *args):
+                pass
+
+        key = Key("eggs", "users", "deleted")
+        with save(iterators, ('get_pool',)):
+            with save(column_crud, ('get_pool',)):
+                iterators.get_pool = column_crud.get_pool = \
+                    lambda keyspace: Client()
+
+                for num in range(3):
+                    self.assertRaises(exc.ErrorNoSuchRecord,
+                                      iterators.slice_iterator, key, None)
+                self.assertRaises(exc.ErrorNoSuchRecord,
+                                  iterators.slice_iterator, key, None,
+                                  columns=["name"])
+                self.assert_(len(requests) == 1)
+                self.assert_(cache.is_missing(key))
+
+                # Partial slices aren't remembered
+                other = Key("eggs", "users", "other")
+                self.assertRaises(exc.ErrorNoSuchRecord,
+                                  iterators.slice_iterator, other, None,
+                                  start="m")
+                self.assert_(not cache.is_missing(other))
+
+                # Writing the row forgets that it was missing
+                column_crud.set(key, "name", "John")
+                self.assert_(not cache.is_missing(key))
+                self.assertRaises(exc.ErrorNoSuchRecord,
+                                  iterators.slice_iterator, key, None)
+                self.assert_(len(requests) == 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.checkpoint."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lazyboy.key import Key
+import lazyboy.checkpoint as checkpoint
+import lazyboy.iterators as iterators
+from test_iterators import RangeClient
+
+
+class CheckpointFileTest(unittest.TestCase):
+
+    """Test saving and loading checkpoints."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "scan.ckpt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_load(self):
+        """Make sure checkpoints round-trip, including binary strings."""
+        self.assert_(checkpoint.load_checkpoint(self.path) is None)
+        state = {'last_key': '\x00\xff\x80binary', 'rows': 10,
+                 'splits': [['0', '10']]}
+        checkpoint.save_checkpoint(self.path, state)
+        self.assert_(checkpoint.load_checkpoint(self.path) == state)
+        self.assert_(os.listdir(self.dir) == ["scan.ckpt"])
+
+        checkpoint.save_checkpoint(self.path, {'rows': 11})
+        self.assert_(checkpoint.load_checkpoint(self.path) == {'rows': 11})
+
+    def test_failed_save(self):
+        """Make sure failed saves leave the old checkpoint alone."""
+        checkpoint.save_checkpoint(self.path, {'rows': 1})
+        self.assertRaises(TypeError, checkpoint.save_checkpoint, self.path,
+                          {'rows': object()})
+        self.assert_(checkpoint.load_checkpoint(self.path) == {'rows': 1})
+        self.assert_(os.listdir(self.dir) == ["scan.ckpt"])
+
+
+class ResumableScanTest(unittest.TestCase):
+
+    """Test lazyboy.checkpoint.ResumableScan and Checkpointer."""
+
+    def setUp(self):
+        self.keys = ['row-%03d' % num for num in range(30)]
+        self.client = RangeClient(self.keys)
+        self.__get_pool = (iterators.get_pool, checkpoint.get_pool)
+        iterators.get_pool = checkpoint.get_pool = \
+            lambda keyspace: self.client
+        self.key = Key("eggs", "bacon")
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "scan.ckpt")
+
+    def tearDown(self):
+        (iterators.get_pool, checkpoint.get_pool) = self.__get_pool
+        shutil.rmtree(self.dir)
+
+    def _keys(self, rows):
+        """Return the row keys of rows."""
+        return [key.key for (key, cols) in rows]
+
+    def test_restore(self):
+        """Make sure restored scans start after the last row."""
+        scan = checkpoint.ResumableScan(self.key, page_size=4)
+        self.assert_(scan.checkpoint() is None)
+        rows = iter(scan)
+        self.assert_(self._keys(rows.next() for num in range(10)) ==
+                     self.keys[:10])
+        state = scan.checkpoint()
+        self.assert_(state == {'last_key': 'row-009', 'rows': 10})
+
+        scan = checkpoint.ResumableScan(self.key, page_size=4)
+        scan.restore(state)
+        self.assert_(self._keys(scan) == self.keys[10:])
+        self.assert_(scan.checkpoint()['rows'] == 30)
+
+    def test_restore_tokens(self):
+        """Make sure token-bounded scans resume by token."""
+        args = dict(start_token="0", finish_token=str(2 ** 127),
+                    page_size=4)
+        scan = checkpoint.ResumableScan(self.key, **args)
+        rows = iter(scan)
+        first = self._keys(rows.next() for num in range(10))
+
+        resumed = checkpoint.ResumableScan(self.key, **args)
+        resumed.restore(scan.checkpoint())
+        rest = self._keys(resumed)
+        self.assert_(sorted(first + rest) == self.keys)
+
+    def test_checkpointer(self):
+        """Make sure interrupted scans carry on where they stopped."""
+        seen = []
+
+        def consume(stop):
+            runner = checkpoint.Checkpointer(self.path, interval=0)
+            for (key, cols) in runner.run(
+                checkpoint.ResumableScan(self.key, page_size=7)):
+                if key.key == stop:
+                    raise RuntimeError("Deployed")
+                seen.append(key.key)
+
+        self.assertRaises(RuntimeError, consume, 'row-012')
+        self.assert_(checkpoint.load_checkpoint(self.path)['last_key'] ==
+                     'row-011')
+        self.assertRaises(RuntimeError, consume, 'row-020')
+        consume(None)
+        self.assert_(seen == self.keys)
+        self.assert_(not os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.commit."""
+
+from __future__ import with_statement
+import unittest
+import threading
+
+from cassandra.ttypes import ConsistencyLevel, InvalidRequestException, \
+    TimedOutException
+
+import lazyboy.commit as commit
+import lazyboy.connection as conn
+from lazyboy.exceptions import ErrorInvalidValue
+
+
+class MergeMutationsTest(unittest.TestCase):
+
+    """Test lazyboy.commit.merge_mutations."""
+
+    def test_merge_mutations(self):
+        """Make sure mutation maps are merged by row and column family."""
+        first = {'cleese': {'Users': [1, 2]}}
+        second = {'cleese': {'Users': [3], 'Links': [4]},
+                  'palin': {'Users': [5]}}
+        merged = commit.merge_mutations((first, second))
+        self.assert_(merged == {'cleese': {'Users': [1, 2, 3],
+                                           'Links': [4]},
+                                'palin': {'Users': [5]}})
+        self.assert_(first == {'cleese': {'Users': [1, 2]}})
+
+
+class GroupCommitterTest(unittest.TestCase):
+
+    """Test lazyboy.commit.GroupCommitter."""
+
+    def _submit_all(self, committer, send, maps, level=ConsistencyLevel.ONE):
+        """Submit mutation maps from one thread each; return outcomes."""
+        outcomes = [None] * len(maps)
+
+        def submit(idx):
+            try:
+                outcomes[idx] = committer.submit(send, maps[idx], level)
+            except Exception, ex:
+                outcomes[idx] = ex
+
+        threads = [threading.Thread(target=submit, args=(idx,))
+                   for idx in range(len(maps))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_group(self):
+        """Make sure concurrent writes are merged into one batch."""
+        calls = []
+
+        def send(mutation_map, level):
+            calls.append(mutation_map)
+            return True
+
+        committer = commit.GroupCommitter(window=1, max_batch=10)
+        maps = [{'row-%d' % idx: {'Users': [idx]}} for idx in range(10)]
+        outcomes = self._submit_all(committer, send, maps)
+
+        self.assert_(outcomes == [True] * 10)
+        self.assert_(len(calls) == 1)
+        self.assert_(len(calls[0]) == 10)
+
+    def test_failure(self):
+        """Make sure each caller gets its own error from a failed group."""
+
+        def send(mutation_map, level):
+            if len(mutation_map) > 1 or 'bad' in mutation_map:
+                raise InvalidRequestException("Rejected")
+            return True
+
+        committer = commit.GroupCommitter(window=1, max_batch=3)
+        maps = [{'good-1': {'Users': []}}, {'bad': {'Users': []}},
+                {'good-2': {'Users': []}}]
+        outcomes = self._submit_all(committer, send, maps)
+
+        self.assert_(outcomes[0] is True)
+        self.assert_(isinstance(outcomes[1], InvalidRequestException))
+        self.assert_(outcomes[2] is True)
+
+    def test_transport_failure(self):
+        """Make sure a failed send is not retried once per write."""
+        calls = []
+
+        def send(mutation_map, level):
+            calls.append(mutation_map)
+            raise TimedOutException()
+
+        committer = commit.GroupCommitter(window=1, max_batch=3)
+        maps = [{'row-%d' % idx: {'Users': []}} for idx in range(3)]
+        outcomes = self._submit_all(committer, send, maps)
+
+        self.assert_(len(calls) == 1)
+        self.assert_(all(isinstance(outcome, TimedOutException)
+                         for outcome in outcomes))
+
+    def test_consistency_levels(self):
+        """Make sure writes are only merged with the same consistency."""
+        levels = []
+
+        def send(mutation_map, level):
+            levels.append(level)
+            return level
+
+        committer = commit.GroupCommitter(window=0)
+        self.assert_(committer.submit(send, {}, ConsistencyLevel.QUORUM) ==
+                     ConsistencyLevel.QUORUM)
+        self.assert_(levels == [ConsistencyLevel.QUORUM])
+
+
+class ClientGroupCommitTest(unittest.TestCase):
+
+    """Test group commit through connection.Client."""
+
+    def test_add_pool(self):
+        """Make sure add_pool shares one committer between clients."""
+        with_commit = 'group_commit_test'
+        try:
+            conn.add_pool(with_commit, ['localhost:1234'], group_commit=.001)
+            committer = conn._SERVERS[with_commit]['group_commit']
+            self.assert_(isinstance(committer, commit.GroupCommitter))
+            self.assert_(committer.window == .001)
+        finally:
+            del conn._SERVERS[with_commit]
+
+    def test_add_pool_window(self):
+        """Make sure True uses the default window and bad windows fail."""
+        with_commit = 'group_commit_test'
+        try:
+            conn.add_pool(with_commit, ['localhost:1234'], group_commit=True)
+            committer = conn._SERVERS[with_commit]['group_commit']
+            self.assert_(committer.window == commit.DEFAULT_WINDOW)
+        finally:
+            del conn._SERVERS[with_commit]
+
+        for window in (0, -1, "1", [1]):
+            self.assertRaises(ErrorInvalidValue, conn.add_pool, with_commit,
+                              ['localhost:1234'], group_commit=window)
+        self.assert_(with_commit not in conn._SERVERS)
+
+    def test_batch_mutate(self):
+        """Make sure Client.batch_mutate goes through the committer."""
+        submitted = []
+
+        class Committer(object):
+
+            def submit(self, send, *args):
+                submitted.append(args)
+                return send(*args)
+
+        client = conn.Client('Keyspace1', [], group_commit=Committer())
+        client._batch_mutate = lambda *args: "written"
+        self.assert_(client.batch_mutate({}, ConsistencyLevel.ONE) ==
+                     "written")
+        self.assert_(submitted == [({}, ConsistencyLevel.ONE)])
+
+
+if __name__ == '__main__':
+    unittest.main()
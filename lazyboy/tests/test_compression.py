@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.compression."""
+
+import os
+import unittest
+
+import lazyboy.compression as compression
+import lazyboy.exceptions as exc
+
+
+class CompressionTest(unittest.TestCase):
+
+    """Test compress and decompress."""
+
+    data = '{"username": "jcleese", "bio": "%s"}' % ("Silly walks. " * 20)
+
+    def test_codecs(self):
+        """Make sure every codec round-trips and shrinks the data."""
+        for codec in compression.CODECS:
+            packed = compression.compress(self.data, codec)
+            self.assert_(len(packed) < len(self.data))
+            self.assert_(packed[0] == compression.CODECS[codec][0])
+            self.assert_(compression.decompress(packed) == self.data)
+
+        self.assert_(compression.compress(self.data, True) ==
+                     compression.compress(self.data))
+
+    def test_raw(self):
+        """Make sure small or incompressible values are stored raw."""
+        for data in ("", "short", os.urandom(1024)):
+            packed = compression.compress(data)
+            self.assert_(packed == compression.RAW + data)
+            self.assert_(compression.decompress(packed) == data)
+
+    def test_errors(self):
+        """Make sure bad codecs and corrupt values raise errors."""
+        self.assertRaises(exc.ErrorNotSupported, compression.compress,
+                          self.data, "snappy")
+        for data in ("", "\x7fnope", "\x01nope"):
+            self.assertRaises(exc.ErrorCorruptData,
+                              compression.decompress, data)
+
+    def test_legacy(self):
+        """Make sure uncompressed values can be read back as they are."""
+        for data in ("", "plain text", "\x01nope", self.data):
+            self.assert_(compression.decompress(data, legacy=True) == data)
+        packed = compression.compress(self.data)
+        self.assert_(compression.decompress(packed, legacy=True) ==
+                     self.data)
+
+    def test_register_codec(self):
+        """Make sure codecs can be added."""
+        compression.register_codec('rev', '\x70', lambda data: data[:10],
+                                   lambda data: data * 2)
+        try:
+            self.assert_(compression.compress(self.data, 'rev') ==
+                         '\x70' + self.data[:10])
+            self.assert_(compression.decompress('\x70ab') == 'abab')
+            self.assertRaises(AssertionError, compression.register_codec,
+                              'again', '\x70', None, None)
+        finally:
+            del compression.CODECS['rev']
+            del compression._HEADERS['\x70']
+
+
+if __name__ == '__main__':
+    unittest.main()
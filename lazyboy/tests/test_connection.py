@@ -12,6 +12,7 @@ import time
 import types
 import logging
 import socket
+import threading
 from contextlib import contextmanager
 
 from cassandra import Cassandra
@@ -75,6 +76,38 @@ class TestPools(ConnectionTest):
         self.assertRaises(ErrorCassandraClientNotFound,
                           conn.get_pool, (__name__))
 
+    def test_get_host_pool(self):
+        client = conn.get_host_pool(self.pool, "10.0.0.1")
+        self.assert_(type(client) is conn.Client)
+        self.assert_(client._servers == ["10.0.0.1:1234"])
+        self.assert_(conn.get_host_pool(self.pool, "10.0.0.1") is client)
+        self.assert_(conn.get_host_pool(self.pool, "10.0.0.2") is not client)
+        self.assert_(conn.get_pool(self.pool)._servers == ['localhost:1234'])
+
+        self.assertRaises(ErrorCassandraClientNotFound,
+                          conn.get_host_pool, __name__, "10.0.0.1")
+
+    def test_get_pool_threads(self):
+        """Make sure threads with the same name get their own clients."""
+        clients = []
+        release = threading.Event()
+
+        def get():
+            clients.append(conn.get_pool(self.pool))
+            release.wait(1)
+
+        threads = [threading.Thread(target=get, name="worker")
+                   for num in range(3)]
+        for thread in threads:
+            thread.start()
+        while len(clients) < 3:
+            time.sleep(.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assert_(len(set(id(client) for client in clients)) == 3)
+        self.assert_(conn.get_pool(self.pool) not in clients)
+
 
 class TestClient(ConnectionTest):
 
@@ -266,6 +299,38 @@ class TestClient(ConnectionTest):
                 self.assert_(repr(server) in ex.args[-1])
 
 
+    def test_latency_observers(self):
+        """Make sure request durations are passed to observers."""
+        raw_server = Generic()
+        raw_server.transport = _MockTransport()
+        self.client._connect = lambda: raw_server
+        self.client._servers = [raw_server]
+        self.client._current_server = 0
+
+        observed = []
+        observer = lambda *args: observed.append(args)
+        conn.add_latency_observer(observer)
+        try:
+            with self.client.get_client() as clt:
+                pass
+            try:
+                with self.client.get_client() as clt:
+                    raise socket.error(7, "Test error")
+            except ErrorThriftMessage:
+                pass
+        finally:
+            conn.remove_latency_observer(observer)
+
+        self.assert_(len(observed) == 2)
+        for (keyspace, seconds) in observed:
+            self.assert_(keyspace == 'Keyspace1')
+            self.assert_(seconds >= 0)
+
+        with self.client.get_client() as clt:
+            pass
+        self.assert_(len(observed) == 2)
+
+
 class TestRetry(unittest.TestCase):
 
     """Test retry logic."""
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.diskcache."""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cassandra.ttypes import Column, SuperColumn
+
+import lazyboy.cache as cache
+from lazyboy.diskcache import DiskCache
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    """Test lazyboy.diskcache.DiskCache."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "cache.db")
+        self.cache = DiskCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_get_set(self):
+        """Make sure rows survive reopening, and invalidate works."""
+        cols = (Column("name", "John", 1), Column("age", "70", 2, 30))
+        scols = (SuperColumn("x", [Column("a", "b", 3)]),)
+        self.cache.set(("ks", "cf", "row", None), cols)
+        self.cache.set(("ks", "cf", "row", "sup"), scols)
+        self.cache.set(("ks", "cf", "other", None), cols)
+        self.cache.close()
+
+        reopened = DiskCache(self.path)
+        self.assert_(reopened.get(("ks", "cf", "row", None)) == cols)
+        self.assert_(reopened.get(("ks", "cf", "row", "sup")) == scols)
+        self.assert_(reopened.get(("ks", "cf", "nope", None)) is cache.MISS)
+
+        reopened.invalidate(("ks", "cf", "row", None))
+        self.assert_(len(reopened) == 1)
+        self.assert_(reopened.generation == 1)
+        reopened.close()
+
+    def test_eviction(self):
+        """Make sure the least recently used rows go first."""
+        self.cache.max_bytes = 600
+        self.cache.atime_resolution = 0
+        for name in ("a", "b", "c"):
+            self.cache.set(("ks", "cf", name, None),
+                           (Column("data", "x" * 200, 0),))
+            time.sleep(.01)
+        self.assert_(len(self.cache) == 2)
+        self.assert_(self.cache.get(("ks", "cf", "a", None)) is cache.MISS)
+
+        # Reading b makes c the oldest
+        self.cache.get(("ks", "cf", "b", None))
+        time.sleep(.01)
+        self.cache.set(("ks", "cf", "d", None), ())
+        self.cache.max_bytes = 300
+        self.cache.set(("ks", "cf", "e", None), ())
+        self.assert_(self.cache.get(("ks", "cf", "c", None)) is cache.MISS)
+        self.assert_(self.cache.get(("ks", "cf", "b", None)) is not
+                     cache.MISS)
+        self.assert_(self.cache.stats()['bytes'] <= 300)
+
+    def test_ttl_generation(self):
+        """Make sure entries expire, and stale sets are dropped."""
+        self.cache.ttl = .01
+        self.cache.set(("ks", "cf", "row", None), ())
+        time.sleep(.02)
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) is cache.MISS)
+
+        self.cache.ttl = None
+        generation = self.cache.generation
+        self.cache.invalidate(("ks", "cf", "row", None))
+        self.cache.set(("ks", "cf", "row", None), (), generation)
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) is cache.MISS)
+
+    def test_threads(self):
+        """Make sure each thread gets its own connection."""
+        self.cache.set(("ks", "cf", "row", None), ())
+        found = []
+        thread = threading.Thread(target=lambda: found.append(
+                self.cache.get(("ks", "cf", "row", None))))
+        thread.start()
+        thread.join()
+        self.assert_(found == [()])
+
+
+if __name__ == '__main__':
+    unittest.main()
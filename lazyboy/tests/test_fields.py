@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.fields."""
+
+import uuid
+import unittest
+
+import lazyboy.fields as fields
+import lazyboy.exceptions as exc
+
+
+class FieldTest(unittest.TestCase):
+
+    """Test the typed fields."""
+
+    def roundtrip(self, field, value):
+        """Return value after encoding and decoding it with field."""
+        data = field.encode(field.validate(value))
+        self.assert_(isinstance(data, str))
+        return field.decode(data)
+
+    def test_int64(self):
+        """Make sure integers are stored as big-endian longs."""
+        field = fields.Int64Field()
+        self.assert_(field.encode(1) == '\x00' * 7 + '\x01')
+        self.assert_(self.roundtrip(field, -2 ** 63) == -2 ** 63)
+        self.assert_(self.roundtrip(field, "42") == 42)
+        # Non-negative values sort bytewise in numeric order
+        nums = [0, 1, 255, 256, 2 ** 40]
+        self.assert_(sorted(nums, key=field.encode) == nums)
+        self.assertRaises(exc.ErrorInvalidValue, field.validate, "forty")
+        self.assertRaises(exc.ErrorInvalidValue, field.encode, 2 ** 63)
+        self.assertRaises(exc.ErrorInvalidValue, field.decode, "\x00")
+
+    def test_double(self):
+        """Make sure doubles are stored in 8 bytes."""
+        field = fields.DoubleField()
+        self.assert_(self.roundtrip(field, 3.25) == 3.25)
+        self.assert_(len(field.encode(1.0)) == 8)
+        self.assertRaises(exc.ErrorInvalidValue, field.validate, None)
+
+    def test_uuid(self):
+        """Make sure UUIDs are stored as 16 bytes."""
+        field = fields.UUIDField()
+        value = uuid.uuid4()
+        self.assert_(field.encode(value) == value.bytes)
+        self.assert_(self.roundtrip(field, str(value)) == value)
+        self.assert_(field.validate(value.bytes) == value)
+        self.assertRaises(exc.ErrorInvalidValue, field.validate, "nope")
+
+    def test_timeuuid(self):
+        """Make sure TimeUUIDField only takes version 1 UUIDs."""
+        field = fields.TimeUUIDField()
+        value = uuid.uuid1()
+        self.assert_(self.roundtrip(field, value) == value)
+        self.assertRaises(exc.ErrorInvalidValue, field.validate, uuid.uuid4())
+
+    def test_json(self):
+        """Make sure JSON values are stored compactly."""
+        field = fields.JSONField()
+        self.assert_(field.encode({'a': [1, 2]}) == '{"a":[1,2]}')
+        self.assert_(self.roundtrip(field, {'a': [1, 2]}) == {'a': [1, 2]})
+
+    def test_strings(self):
+        """Make sure byte and UTF-8 strings round-trip."""
+        self.assert_(self.roundtrip(fields.BytesField(), "\xff") == "\xff")
+        self.assertRaises(exc.ErrorInvalidValue,
+                          fields.BytesField().validate, 1)
+
+        field = fields.UTF8Field()
+        self.assert_(field.encode(u"Ünicode") == "\xc3\x9cnicode")
+        self.assert_(self.roundtrip(field, "\xc3\x9cnicode") == u"Ünicode")
+
+
+if __name__ == '__main__':
+    unittest.main()
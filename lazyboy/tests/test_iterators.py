@@ -6,7 +6,10 @@
 
 """Unit tests for lazyboy.iterators."""
 
+from __future__ import with_statement
+import time
 import unittest
+import threading
 import types
 import uuid
 import random
@@ -154,28 +157,6 @@ class SliceIteratorTest(unittest.TestCase):
             for col in cols:
                 self.assert_(isinstance(col, ttypes.Column))
 
-    def test_key_range(self):
-        """Test key_range."""
-        key = Key(keyspace="eggs", column_family="bacon", key="tomato")
-        keys = ['spam', 'eggs', 'sausage', 'tomato', 'spam']
-        self.client.get_key_range = lambda *args: keys
-        self.assert_(iterators.key_range(key) == keys)
-
-    def test_key_range_iterator(self):
-        """Test key_range_iterator."""
-        key = Key(keyspace="eggs", column_family="bacon", key="tomato")
-        keys = ['spam', 'eggs', 'sausage', 'tomato', 'spam']
-
-        real_key_range = iterators.key_range
-        iterators.key_range = lambda *args: keys
-        try:
-            key_iter = iterators.key_range_iterator(key)
-            self.assert_(isinstance(key_iter, types.GeneratorType))
-            for key in key_iter:
-                self.assert_(isinstance(key, Key))
-        finally:
-            iterators.key_range = real_key_range
-
     def test_pack(self):
         """Test pack."""
         columns = self.client.get_slice()
@@ -194,6 +175,77 @@ class SliceIteratorTest(unittest.TestCase):
             self.assert_(isinstance(obj, ttypes.Column))
 
 
+class PagedSliceIteratorTest(unittest.TestCase):
+
+    """Test lazyboy.iterators.paged_slice_iterator."""
+
+    class Client(object):
+
+        """A client which slices a sorted row."""
+
+        def __init__(self, width):
+            self.row = [Column("col-%04d" % num, str(num), 0)
+                        for num in range(width)]
+            self.counts = []
+
+        def get_slice(self, row_key, parent, predicate, consistency):
+            srange = predicate.slice_range
+            self.counts.append(srange.count)
+            cols = [col for col in self.row if col.name >= srange.start]
+            return iterators.pack(cols[:srange.count])
+
+    def setUp(self):
+        self.__get_pool = iterators.get_pool
+        self.key = Key(keyspace="eggs", column_family="bacon", key="tomato")
+
+    def tearDown(self):
+        iterators.get_pool = self.__get_pool
+
+    def test_paging(self):
+        """Make sure every column is returned, one page at a time."""
+        for (width, prefetch, counts) in ((25, False, [10, 11, 11]),
+                                          (30, True, [10, 11, 11, 11]),
+                                          (7, False, [10]),
+                                          (10, True, [10, 11])):
+            client = self.Client(width)
+            iterators.get_pool = lambda keyspace: client
+            cols = list(iterators.paged_slice_iterator(
+                    self.key, None, page_size=10, prefetch=prefetch))
+            self.assert_(cols == client.row)
+            self.assert_(client.counts == counts)
+
+    def test_first_page(self):
+        """Make sure the first page can be larger than the rest."""
+        for (width, counts) in ((24, [20, 6]), (19, [20])):
+            client = self.Client(width)
+            iterators.get_pool = lambda keyspace: client
+            cols = list(iterators.paged_slice_iterator(
+                    self.key, None, page_size=5, first_page=20))
+            self.assert_(cols == client.row)
+            self.assert_(client.counts == counts)
+
+    def test_missing(self):
+        """Make sure empty rows raise ErrorNoSuchRecord right away."""
+        client = self.Client(0)
+        iterators.get_pool = lambda keyspace: client
+        self.assertRaises(exc.ErrorNoSuchRecord,
+                          iterators.paged_slice_iterator, self.key, None)
+
+    def test_slice_iterator(self):
+        """Make sure slice_iterator pages unless given a count."""
+        client = self.Client(iterators.PAGE_SIZE + 1)
+        iterators.get_pool = lambda keyspace: client
+        self.assert_(len(list(iterators.slice_iterator(self.key, None))) ==
+                     iterators.PAGE_SIZE + 1)
+        self.assert_(client.counts ==
+                     [iterators.PAGE_SIZE, iterators.PAGE_SIZE + 1])
+
+        client.counts = []
+        self.assert_(len(list(iterators.slice_iterator(self.key, None,
+                                                       count=5))) == 5)
+        self.assert_(client.counts == [5])
+
+
 class UtilTest(unittest.TestCase):
 
     """Test suite for iterator utilities."""
@@ -264,5 +316,347 @@ class UtilTest(unittest.TestCase):
             self.assert_(tuples[idx][1] == col.value)
             self.assert_(col.timestamp == 0)
 
+class RangeClient(object):
+
+    """A client which serves get_range_slices from sorted rows."""
+
+    def __init__(self, keys, columns=3, partitioner="RandomPartitioner"):
+        self.rows = dict((row_key, [Column("col-%d" % num, row_key, 0)
+                                    for num in range(columns)])
+                         for row_key in keys)
+        self.partitioner = partitioner
+        self.ranges = []
+
+    def describe_partitioner(self):
+        return "org.apache.cassandra.dht." + self.partitioner
+
+    def _token(self, token):
+        """Return a token in a form which sorts in ring order."""
+        if self.partitioner == "RandomPartitioner":
+            return long(token)
+        return token
+
+    def get_range_slices(self, parent, predicate, key_range, consistency):
+        self.ranges.append(key_range)
+        if key_range.start_token is not None:
+            token = lambda row_key: self._token(
+                iterators.key_token(row_key, self.partitioner))
+            keys = sorted(self.rows, key=token)
+            keys = [row_key for row_key in keys
+                    if self._token(key_range.start_token) < token(row_key)
+                    <= self._token(key_range.end_token)]
+        else:
+            keys = [row_key for row_key in sorted(self.rows)
+                    if row_key >= key_range.start_key and
+                    (not key_range.end_key or row_key <= key_range.end_key)]
+
+        out = []
+        for row_key in keys[:key_range.count]:
+            cols = self.rows[row_key]
+            if predicate.column_names:
+                cols = [col for col in cols
+                        if col.name in predicate.column_names]
+            else:
+                cols = cols[:predicate.slice_range.count]
+            out.append(ttypes.KeySlice(
+                    row_key, [ttypes.ColumnOrSuperColumn(column=col)
+                              for col in cols]))
+        return out
+
+
+class RangeIteratorTest(unittest.TestCase):
+
+    """Test lazyboy.iterators.range_iterator."""
+
+    def setUp(self):
+        self.__get_pool = iterators.get_pool
+        self.keys = ['row-%03d' % num for num in range(50)]
+        self.client = RangeClient(self.keys)
+        iterators.get_pool = lambda pool: self.client
+        self.key = Key("eggs", "bacon")
+
+    def tearDown(self):
+        iterators.get_pool = self.__get_pool
+
+    def test_key_token(self):
+        """Make sure tokens match Cassandra's partitioners."""
+        self.assert_(iterators.key_token("a") ==
+                     "16955237001963240173058271559858726497")
+        self.assert_(iterators.key_token("a", "OrderPreservingPartitioner")
+                     == "a")
+        self.assert_(iterators.key_token("a\xff", "ByteOrderedPartitioner")
+                     == "61ff")
+
+    def test_byte_ordered_tokens(self):
+        """Make sure token ranges resume by hex token with BOP."""
+        self.client.partitioner = "ByteOrderedPartitioner"
+        rows = iterators.range_iterator(self.key, start_token="",
+                                        finish_token="ff", page_size=4)
+        self.assert_([key.key for (key, cols) in rows] == self.keys)
+        self.assert_(self.client.ranges[1].start_token ==
+                     "row-003".encode('hex'))
+
+    def test_key_range(self):
+        """Test key_range."""
+        self.client = RangeClient(['spam', 'eggs', 'sausage'])
+        self.assert_(iterators.key_range(self.key) ==
+                     ['eggs', 'sausage', 'spam'])
+        self.assert_(iterators.key_range(self.key, start="f", count=1) ==
+                     ['sausage'])
+
+    def test_key_range_iterator(self):
+        """Test key_range_iterator."""
+        found = list(iterators.key_range_iterator(self.key, count=10))
+        for key in found:
+            self.assert_(isinstance(key, Key))
+        self.assert_([key.key for key in found] == self.keys[:10])
+        self.assert_(len(self.client.ranges) == 1)
+
+        found = list(iterators.key_range_iterator(self.key, count=None,
+                                                  page_size=10))
+        self.assert_([key.key for key in found] == self.keys)
+        self.assert_(len(self.client.ranges) == 7)
+
+        found = list(iterators.key_range_iterator(self.key, start="row-040",
+                                                  count=25, page_size=4))
+        self.assert_([key.key for key in found] == self.keys[40:])
+
+    def test_pages(self):
+        """Make sure every row is returned once, a page at a time."""
+        rows = list(iterators.range_iterator(self.key, page_size=7))
+        self.assert_([key.key for (key, cols) in rows] == self.keys)
+        for (key, cols) in rows:
+            self.assert_(isinstance(key, Key))
+            self.assert_(key.column_family == "bacon")
+            self.assert_(len(cols) == 3)
+        self.assert_(len(self.client.ranges) == 8)
+        self.assert_(self.client.ranges[1].start_key == "row-006")
+
+        rows = list(iterators.range_iterator(self.key, page_size=10,
+                                             prefetch=True))
+        self.assert_([key.key for (key, cols) in rows] == self.keys)
+
+    def test_bounds(self):
+        """Make sure key bounds and predicates are honored."""
+        rows = list(iterators.range_iterator(
+                self.key, start="row-010", finish="row-019", page_size=4,
+                columns=["col-1"]))
+        self.assert_([key.key for (key, cols) in rows] == self.keys[10:20])
+        for (key, cols) in rows:
+            self.assert_([col.name for col in cols] == ["col-1"])
+
+        rows = list(iterators.range_iterator(self.key, column_count=1))
+        self.assert_(all(len(cols) == 1 for (key, cols) in rows))
+
+    def test_tokens(self):
+        """Make sure token ranges page without repeating rows."""
+        rows = list(iterators.range_iterator(
+                self.key, start_token="0", finish_token=str(2 ** 127),
+                page_size=6))
+        self.assert_(sorted(key.key for (key, cols) in rows) == self.keys)
+        self.assert_(len(rows) == len(self.keys))
+
+    def test_skip_empty(self):
+        """Make sure rows without columns are skipped."""
+        self.client.rows['row-003'] = []
+        rows = list(iterators.range_iterator(self.key))
+        self.assert_('row-003' not in [key.key for (key, cols) in rows])
+        rows = list(iterators.range_iterator(self.key, skip_empty=False))
+        self.assert_(len(rows) == len(self.keys))
+
+    def test_records(self):
+        """Make sure rows can be returned as Records."""
+        from lazyboy.record import Record
+
+        class Row(Record):
+            _keyspace = "eggs"
+            _column_family = "bacon"
+
+        rows = list(iterators.range_iterator(record_class=Row,
+                                             columns=["col-2"]))
+        self.assert_(len(rows) == len(self.keys))
+        for row in rows:
+            self.assert_(isinstance(row, Row))
+            self.assert_(row["col-2"] == row.key.key)
+            self.assert_(row.is_loaded("col-2"))
+            self.assert_(not row.is_loaded("col-1"))
+
+
+class MultigetClient(object):
+
+    """A client which serves multiget_slice from a dict of rows."""
+
+    def __init__(self, rows, delay=0, fail=False):
+        self.rows = rows
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+        self.running = self.max_running = 0
+        self._lock = threading.Lock()
+
+    def describe_partitioner(self):
+        return "org.apache.cassandra.dht.RandomPartitioner"
+
+    def describe_ring(self, keyspace):
+        third = 2 ** 127 / 3
+        return [ttypes.TokenRange(str(third * 2), "0", ["10.0.0.1"]),
+                ttypes.TokenRange("0", str(third), ["10.0.0.2"]),
+                ttypes.TokenRange(str(third), str(third * 2), ["10.0.0.3"])]
+
+    def multiget_slice(self, keys, parent, predicate, consistency):
+        if self.fail:
+            raise exc.ErrorThriftMessage("Connection refused")
+        with self._lock:
+            self.calls.append(sorted(keys))
+            self.running += 1
+            self.max_running = max(self.running, self.max_running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        names = predicate.column_names
+        return dict((key, [ttypes.ColumnOrSuperColumn(column=col)
+                           for col in self.rows.get(key, [])
+                           if not names or col.name in names])
+                    for key in keys)
+
+
+class MultigetteratorTest(unittest.TestCase):
+
+    """Test batching in lazyboy.iterators.multigetterator."""
+
+    def setUp(self):
+        self.row_keys = ['row-%03d' % num for num in range(100)]
+        self.client = MultigetClient(dict(
+                (key, [Column("name", key, 0)]) for key in self.row_keys))
+        self.__get_pool = (iterators.get_pool, iterators.get_host_pool)
+        iterators.get_pool = lambda keyspace: self.client
+        iterators._RINGS.clear()
+
+    def tearDown(self):
+        (iterators.get_pool, iterators.get_host_pool) = self.__get_pool
+        iterators._RINGS.clear()
+
+    def _check(self, res, keyspace="eggs", column_family="bacon"):
+        """Make sure every row is in a multigetterator result."""
+        rows = res[keyspace][column_family]
+        self.assert_(sorted(rows) == self.row_keys)
+        for (row_key, cols) in rows.iteritems():
+            self.assert_([col.value for col in cols] == [row_key])
+
+    def test_batches(self):
+        """Make sure keys are sent in concurrent batches."""
+        self.client.delay = .01
+        keys = [Key("eggs", "bacon", key) for key in self.row_keys]
+        res = iterators.multigetterator(keys, None, batch_size=10,
+                                        parallelism=3)
+        self._check(res)
+        self.assert_(len(self.client.calls) == 10)
+        self.assert_(all(len(call) == 10 for call in self.client.calls))
+        self.assert_(1 < self.client.max_running <= 3)
+
+        self.client.calls = []
+        self.client.max_running = 0
+        res = iterators.multigetterator(keys, None, batch_size=30,
+                                        parallelism=1)
+        self._check(res)
+        self.assert_(len(self.client.calls) == 4)
+        self.assert_(self.client.max_running == 1)
+
+    def test_duplicates(self):
+        """Make sure duplicate keys are only fetched once."""
+        keys = [Key("eggs", "bacon", key) for key in self.row_keys] * 2
+        self._check(iterators.multigetterator(keys, None, batch_size=1000))
+        self.assert_(self.client.calls == [self.row_keys])
+
+    def test_column_family_names(self):
+        """Make sure column families named like their keyspace work."""
+        keys = [Key("bacon_eggs", "eggs", key) for key in self.row_keys]
+        self._check(iterators.multigetterator(keys, None), "bacon_eggs",
+                    "eggs")
+
+    def test_stream(self):
+        """Make sure rows are yielded as batches arrive."""
+        self.client.delay = .01
+        keys = [Key("eggs", "bacon", key) for key in self.row_keys]
+        rows = iterators.multiget_stream(keys, None, batch_size=10,
+                                         parallelism=2)
+        (key, cols) = rows.next()
+        self.assert_(isinstance(key, Key) and key.key in self.row_keys)
+        self.assert_(len(self.client.calls) < 10)
+
+        found = dict([(key.key, cols)] +
+                     [(key.key, cols) for (key, cols) in rows])
+        self.assert_(sorted(found) == self.row_keys)
+        self.assert_(len(self.client.calls) == 10)
+
+    def test_columns(self):
+        """Make sure multigets can fetch named columns."""
+        self.client.rows['row-001'].append(Column("other", "value", 0))
+        keys = [Key("eggs", "bacon", key) for key in self.row_keys]
+        res = iterators.multigetterator(keys, None)
+        self.assert_(len(res['eggs']['bacon']['row-001']) == 2)
+        res = iterators.multigetterator(keys, None, columns=["other"])
+        self.assert_([col.name for col in res['eggs']['bacon']['row-001']]
+                     == ["other"])
+
+        res = iterators.sparse_multiget(keys, ["name"])
+        self.assert_(sorted(res) == self.row_keys)
+        self.assert_([col.name for col in res['row-001']] == ["name"])
+
+    def test_list_multigetterator(self):
+        """Make sure ordered multigets keep key order."""
+        self.client.delay = .01
+        row_keys = list(reversed(self.row_keys)) + ['missing', 'row-050']
+        keys = [Key("eggs", "bacon", key) for key in row_keys]
+        rows = iterators.list_multigetterator(keys, None, batch_size=10,
+                                              parallelism=2)
+        self.assert_(rows.next()[0].key == 'row-099')
+        time.sleep(.05)
+        # Only the batches being read ahead have been fetched
+        self.assert_(len(self.client.calls) <= 3)
+
+        rows = [(key.key, cols) for (key, cols) in rows]
+        self.assert_([key for (key, cols) in rows] == row_keys[1:])
+        self.assert_(dict(rows)['missing'] == [])
+        self.assert_([col.value for col in dict(rows)['row-050']] ==
+                     ['row-050'])
+
+        rows = list(iterators.list_multigetterator(keys, None, batch_size=7,
+                                                   parallelism=1))
+        self.assert_([key.key for (key, cols) in rows] == row_keys)
+
+    def test_token_aware(self):
+        """Make sure batches go to the node owning their keys."""
+        hosts = {}
+
+        def get_host_pool(keyspace, host):
+            return hosts.setdefault(host, MultigetClient(self.client.rows))
+
+        iterators.get_host_pool = get_host_pool
+        keys = [Key("eggs", "bacon", key) for key in self.row_keys]
+        res = iterators.multigetterator(keys, None, token_aware=True,
+                                        batch_size=20)
+        self._check(res)
+        self.assert_(not self.client.calls)
+        self.assert_(sorted(hosts) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+        third = 2 ** 127 / 3
+        owners = {"10.0.0.2": (0, third), "10.0.0.3": (third, third * 2),
+                  "10.0.0.1": (third * 2, 2 ** 127)}
+        for (host, client) in hosts.iteritems():
+            (start, end) = owners[host]
+            for call in client.calls:
+                self.assert_(len(call) <= 20)
+                for row_key in call:
+                    token = long(iterators.key_token(row_key))
+                    self.assert_(start < token <= end)
+
+        # Failed nodes fall back to the pool
+        iterators.get_host_pool = lambda keyspace, host: MultigetClient(
+            {}, fail=True)
+        self._check(iterators.multigetterator(keys, None, token_aware=True))
+        self.assert_(self.client.calls)
+
+
 if __name__ == '__main__':
     unittest.main()
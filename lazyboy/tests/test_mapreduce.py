@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.mapreduce."""
+
+import os
+import unittest
+import operator
+
+from lazyboy.key import Key
+import lazyboy.mapreduce as mapreduce
+import lazyboy.iterators as iterators
+import lazyboy.scan as scan
+import lazyboy.exceptions as exc
+from test_scan import RingClient
+
+
+def count_columns(row):
+    """Return the number of columns in a row."""
+    return len(row[1])
+
+
+def key_pid(row):
+    """Return a dict of row key to the process it was mapped in."""
+    return {row[0].key: os.getpid()}
+
+
+def merge(left, right):
+    """Merge two dicts."""
+    left.update(right)
+    return left
+
+
+class MapReduceTest(unittest.TestCase):
+
+    """Test lazyboy.mapreduce.map_reduce."""
+
+    def setUp(self):
+        self.keys = ['row-%03d' % num for num in range(100)]
+        self.client = RingClient(self.keys)
+        self.__get_pool = (iterators.get_pool, scan.connection.get_pool)
+        iterators.get_pool = scan.connection.get_pool = \
+            lambda keyspace: self.client
+        self.key = Key("eggs", "bacon")
+
+    def tearDown(self):
+        (iterators.get_pool, scan.connection.get_pool) = self.__get_pool
+
+    def test_map_reduce(self):
+        """Make sure rows are mapped in workers and reduced."""
+        splits = []
+        total = mapreduce.map_reduce(
+            self.key, count_columns, operator.add, processes=2,
+            on_split=lambda *args: splits.append(args))
+        self.assert_(total == 3 * len(self.keys))
+        self.assert_(len(splits) == 4)
+        self.assert_(sum(rows for (split, partial, rows) in splits) ==
+                     len(self.keys))
+
+        pids = mapreduce.map_reduce(self.key, key_pid, merge, processes=2)
+        self.assert_(sorted(pids) == self.keys)
+        self.assert_(os.getpid() not in pids.values())
+
+    def test_initial(self):
+        """Make sure empty column families return initial."""
+        self.client.rows.clear()
+        self.assert_(mapreduce.map_reduce(
+                self.key, count_columns, operator.add, 0, processes=1) == 0)
+        self.assert_(mapreduce.map_reduce(
+                self.key, count_columns, operator.add, processes=1) is None)
+        self.assert_(mapreduce.map_reduce(
+                self.key, count_columns, operator.add, 10,
+                splits=[scan.Split("0", "1")], processes=1) == 10)
+
+    def test_errors(self):
+        """Make sure errors in workers are raised."""
+        self.client.fail_after = 0
+        self.assertRaises(exc.ErrorThriftMessage, mapreduce.map_reduce,
+                          self.key, count_columns, operator.add,
+                          splits=[scan.Split("0", "1")], processes=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.query."""
+
+import unittest
+
+from cassandra import ttypes
+from cassandra.ttypes import Column, IndexOperator, TokenRange
+
+from lazyboy.record import Record
+import lazyboy.fields as fields
+import lazyboy.query as query
+import lazyboy.scan as scan
+import lazyboy.iterators as iterators
+from lazyboy.query import eq, gt, gte, lt, lte
+
+_COMPARE = {IndexOperator.EQ: lambda left, right: left == right,
+            IndexOperator.GT: lambda left, right: left > right,
+            IndexOperator.GTE: lambda left, right: left >= right,
+            IndexOperator.LT: lambda left, right: left < right,
+            IndexOperator.LTE: lambda left, right: left <= right}
+
+
+class User(Record):
+
+    """A record with indexed columns."""
+
+    _keyspace = "eggs"
+    _column_family = "users"
+    _fields = {'age': fields.Int64Field()}
+
+
+class IndexClient(object):
+
+    """A client which serves get_indexed_slices."""
+
+    def __init__(self, rows, partitioner="RandomPartitioner"):
+        self.rows = rows
+        self.partitioner = partitioner
+        self.clauses = []
+
+    def describe_partitioner(self):
+        return "org.apache.cassandra.dht." + self.partitioner
+
+    def describe_ring(self, keyspace):
+        return [TokenRange("r", "c", ["10.0.0.1"]),
+                TokenRange("c", "r", ["10.0.0.2"])]
+
+    def describe_splits(self, cf, start_token, end_token, keys_per_split):
+        return [start_token, end_token]
+
+    def _ordered(self):
+        """Return row keys in partitioner order."""
+        if self.partitioner == "RandomPartitioner":
+            return sorted(self.rows,
+                          key=lambda row_key: long(
+                    iterators.key_token(row_key)))
+        return sorted(self.rows)
+
+    def get_indexed_slices(self, parent, clause, predicate, consistency):
+        self.clauses.append(clause)
+        keys = self._ordered()
+        if clause.start_key and self.partitioner == "RandomPartitioner":
+            keys = keys[keys.index(clause.start_key):]
+        elif clause.start_key:
+            keys = [row_key for row_key in keys
+                    if row_key >= clause.start_key]
+
+        out = []
+        for row_key in keys:
+            cols = dict((col.name, col) for col in self.rows[row_key])
+            if not all(expr.column_name in cols and
+                       _COMPARE[expr.op](cols[expr.column_name].value,
+                                         expr.value)
+                       for expr in clause.expressions):
+                continue
+            if predicate.column_names:
+                names = predicate.column_names
+            else:
+                names = sorted(cols)[:predicate.slice_range.count]
+            out.append(ttypes.KeySlice(
+                    row_key, [ttypes.ColumnOrSuperColumn(column=cols[name])
+                              for name in names if name in cols]))
+            if len(out) == clause.count:
+                break
+        return out
+
+
+class QueryTest(unittest.TestCase):
+
+    """Test lazyboy.query.Query."""
+
+    def setUp(self):
+        user = User()
+        self.rows = {}
+        for num in range(40):
+            cols = {'state': "CA" if num % 2 else "NY", 'age': num,
+                    'name': "user-%02d" % num}
+            self.rows["user-%02d" % num] = [
+                Column(name, user._encode(name, user._prepare(name, value)),
+                       0)
+                for (name, value) in cols.iteritems()]
+        self.client = IndexClient(self.rows)
+        self.__get_pool = (query.get_pool, scan.connection.get_pool)
+        query.get_pool = scan.connection.get_pool = \
+            lambda keyspace: self.client
+
+    def tearDown(self):
+        (query.get_pool, scan.connection.get_pool) = self.__get_pool
+
+    def _keys(self, records):
+        """Return the sorted row keys of records."""
+        return sorted(record.key.key for record in records)
+
+    def test_expressions(self):
+        """Make sure expression values are encoded like the record's."""
+        expr = gte('age', 21).index_expression(User)
+        self.assert_(expr.column_name == 'age')
+        self.assert_(expr.op == IndexOperator.GTE)
+        self.assert_(expr.value == fields.Int64Field().encode(21))
+        self.assert_(eq('state', 'CA').index_expression(User).value == 'CA')
+        self.assert_([expr.op for expr in (gt('a', 1), lt('a', 1),
+                                           lte('a', 1))] ==
+                     [IndexOperator.GT, IndexOperator.LT, IndexOperator.LTE])
+        self.assert_(repr(eq('state', 'CA')) == "state EQ 'CA'")
+
+    def test_needs_equality(self):
+        """Make sure queries without an equality are refused."""
+        self.assertRaises(AssertionError, User.query, gt('age', 10))
+
+    def test_query(self):
+        """Make sure matching records are paged through."""
+        users = list(User.query(eq('state', "CA"), gte('age', 21),
+                                page_size=3))
+        self.assert_(self._keys(users) ==
+                     ["user-%02d" % num for num in range(21, 40, 2)])
+        self.assert_(all(isinstance(user, User) for user in users))
+        self.assert_(all(user['age'] >= 21 for user in users))
+        self.assert_(len(self.client.clauses) == 4)
+        self.assert_([clause.count for clause in self.client.clauses] ==
+                     [3, 4, 4, 4])
+
+        self.assert_(list(User.query(eq('state', "TX"))) == [])
+
+    def test_columns(self):
+        """Make sure only the named columns are loaded."""
+        users = list(User.query(eq('state', "NY"), columns=['name']))
+        self.assert_(len(users) == 20)
+        self.assert_(all(user.keys() == ['name'] for user in users))
+
+    def test_limit(self):
+        """Make sure iteration stops after limit records."""
+        users = list(User.query(eq('state', "NY"), limit=5, page_size=2))
+        self.assert_(len(users) == 5)
+        self.assert_(len(self.client.clauses) == 3)
+
+    def test_parallel(self):
+        """Make sure ordered partitioners query the ring in parallel."""
+        self.client.partitioner = "OrderPreservingPartitioner"
+        users = User.query(eq('state', "CA"), parallelism=2, page_size=2)
+        self.assert_(self._keys(users) ==
+                     ["user-%02d" % num for num in range(1, 40, 2)])
+        self.assert_(set(clause.start_key for clause in self.client.clauses)
+                     >= set(["", "c", "r"]))
+
+        self.client.partitioner = "RandomPartitioner"
+        self.client.clauses = []
+        users = User.query(eq('state', "CA"), parallelism=2, limit=3)
+        self.assert_(len(list(users)) == 3)
+        self.assert_([clause.start_key for clause in self.client.clauses] ==
+                     [""])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,7 @@ from cassandra.ttypes import Column, SuperColumn, ColumnOrSuperColumn, \
     ColumnParent
 
 import lazyboy.record
+import lazyboy.fields as fields
 from lazyboy.view import View
 from lazyboy.connection import Client
 from lazyboy.key import Key
@@ -214,7 +215,8 @@ class RecordTest(CassandraBaseTest):
 
         real_slice = lazyboy.record.iterators.slice_iterator
         try:
-            lazyboy.record.iterators.slice_iterator = lambda *args: test_data
+            lazyboy.record.iterators.slice_iterator = \
+                lambda *args, **kwargs: test_data
 
             key = Key(keyspace='eggs', column_family='bacon', key='tomato')
             self.object.make_key = lambda *args, **kwargs: key
@@ -235,6 +237,50 @@ class RecordTest(CassandraBaseTest):
             self.assert_(self.object[col.name] == col.value)
             self.assert_(self.object._columns[col.name] == col)
 
+    def test_load_columns(self):
+        """Make sure partial records only fetch and check some columns."""
+        calls = []
+
+        def slice_iterator(key, consistency, **kwargs):
+            calls.append(kwargs)
+            return [Column(name, name.upper(), 0)
+                    for name in kwargs.get('columns', ['eggs', 'bacon'])]
+
+        class Partial(Record):
+            _required = ('eggs', 'bacon')
+            _projection = ('bacon',)
+
+        key = Key(keyspace='eggs', column_family='bacon', key='tomato')
+        with save(lazyboy.record.iterators, ('slice_iterator',)):
+            lazyboy.record.iterators.slice_iterator = slice_iterator
+            rec = Partial().load(key)
+            self.assert_(calls.pop() == {'columns': ['bacon']})
+            self.assert_(rec == {'bacon': 'BACON'})
+
+            # eggs wasn't loaded, so it isn't missing
+            self.assert_(rec.valid())
+            self.assert_(not rec.is_loaded('eggs'))
+            del rec['bacon']
+            self.assert_(rec.missing() == ('bacon',))
+            rec['eggs'] = 'spam'
+            self.assert_(rec.is_loaded('eggs'))
+
+            rec.load(key, columns=['eggs'])
+            self.assert_(calls.pop() == {'columns': ['eggs']})
+            self.assert_(rec.missing() == ())
+
+            # A full load doesn't pass a predicate, and asks for a
+            # first page big enough for most rows
+            Record().load(key)
+            self.assert_(calls.pop() == {
+                    'first_page': lazyboy.record.iterators.ROW_PAGE_SIZE})
+
+        # Saving only touches the items which were changed
+        rec['eggs'] = 'ham'
+        self.assert_(rec._marshal()['deleted'] == ())
+        self.assert_([col.name for col in rec._marshal()['changed']] ==
+                     ['eggs'])
+
     def test_get_batch_args(self):
         columns = (Column(name="eggs", value="1"),
                    Column(name="bacon", value="2"),
@@ -443,15 +489,101 @@ class RecordTest(CassandraBaseTest):
         self.assertRaises(Exception, self.object.save)
         self.assert_(not self.object.is_modified())
 
+    def test_save_async(self):
+        """Make sure Record.save(async_=True) writes in the background."""
+        calls = []
+
+        class Client(object):
+
+            def remove(self, *args):
+                calls.append(('remove',) + args)
+
+            def batch_mutate(self, *args):
+                calls.append(('batch_mutate',) + args)
+
+        class FakeView(object):
+
+            def __init__(self):
+                self.records = []
+
+            def append(self, record, async_=False):
+                self.records.append((record, async_))
+
+        views = [FakeView()]
+        self.object.get_indexes = lambda: views
+        self.object._inject(Key('eggs', 'bacon', 'tomato'),
+                            (Column("eggs", "1", 0), Column("spam", "2", 0)))
+        self.object['eggs'] = "3"
+        del self.object['spam']
+
+        pool = lazyboy.record.workers.WorkerPool(workers=1)
+        old = lazyboy.record.workers.set_writer(pool)
+        try:
+            with save(lazyboy.record, ('get_pool',)):
+                lazyboy.record.get_pool = lambda keyspace: Client()
+                future = self.object.save(async_=True)
+                self.assert_(not self.object.is_modified())
+                self.assert_(views[0].records == [(self.object, True)])
+
+                # Later changes must not leak into the queued write
+                self.object['eggs'] = "4"
+                self.assert_(future.result(1) is self.object)
+        finally:
+            lazyboy.record.workers.set_writer(old)
+            pool.drain()
+
+        self.assert_([call[0] for call in calls] ==
+                     ['remove', 'batch_mutate'])
+        mutations = calls[1][1]['tomato']['bacon']
+        self.assert_(len(mutations) == 1)
+        self.assert_(mutations[0].column_or_supercolumn.column.value == "3")
+        self.assert_(self.object.is_modified())
+
     def test_revert(self):
         data = {'id': 'eggs', 'title': 'bacon'}
-        for k in data:
-            self.object._original[k] = Column(name=k, value=data[k])
+        self.object._inject(Key('eggs', 'bacon', 'tomato'),
+                            [Column(name=k, value=data[k], timestamp=0)
+                             for k in data])
+        self.object['id'] = 'spam'
+        self.object['new'] = 'sausage'
+        del self.object['title']
 
         self.object.revert()
 
+        self.assert_(not self.object.is_modified())
+        self.assert_(self.object == data)
         for k in data:
             self.assert_(self.object[k] == data[k])
+            self.assert_(self.object._columns[k].timestamp == 0)
+
+    def test_backup(self):
+        """Make sure only changed items are backed up."""
+        self.object._inject(Key('eggs', 'bacon', 'tomato'),
+                            [Column(name="id", value="eggs", timestamp=0),
+                             Column(name="title", value="bacon",
+                                    timestamp=0)])
+        self.assert_(self.object._backup == {})
+        self.object['id'] = "eggs"
+        self.assert_(self.object._backup == {})
+        self.assert_(not self.object.is_modified())
+
+        self.object['id'] = "spam"
+        self.object['new'] = "sausage"
+        self.assert_(self.object._backup == {'id': ("eggs", 0), 'new': None})
+        self.assert_(self.object._original['id'].value == "eggs")
+        self.assert_('new' not in self.object._original)
+
+        # Setting the original value back un-modifies the item
+        self.object['id'] = "eggs"
+        self.assert_(self.object._backup == {'new': None})
+        self.assert_(self.object._columns['id'].timestamp == 0)
+        self.assert_(self.object._modified == set(['new']))
+
+        self.object['id'] = "spam"
+        self.object._saved(self.object._marshal())
+        self.assert_(self.object._backup == {})
+        self.assert_(self.object._original['id'].value == "spam")
+        self.assert_(self.object._original['title'].value == "bacon")
 
     def test_is_modified(self):
         data = {'id': 'eggs', 'title': 'bacon'}
@@ -488,6 +620,158 @@ class RecordTest(CassandraBaseTest):
         rec['username'] = "jcleese"
         self.assert_(rec._original['username'].value == orig)
 
+    def test_typed_fields(self):
+        """Make sure typed items are validated, encoded and decoded."""
+
+        class User(Record):
+            _fields = {'age': fields.Int64Field(),
+                       'prefs': fields.JSONField()}
+
+        rec = User()
+        self.assertRaises(exc.ErrorInvalidValue, rec.__setitem__,
+                          'age', 'old')
+        rec.update({'age': '70', 'prefs': {'theme': 'dark'}, 'name': 70})
+        self.assert_(rec['age'] == 70)
+        self.assert_(rec['name'] == '70')
+
+        cols = dict((col.name, col.value)
+                    for col in rec._marshal()['changed'])
+        self.assert_(cols == {'age': '\x00' * 7 + 'F',
+                              'prefs': '{"theme":"dark"}',
+                              'name': '70'})
+
+    def test_typed_required(self):
+        """Make sure false values of typed items aren't missing."""
+
+        class Counter(Record):
+            _required = ('count', 'tags', 'name')
+            _fields = {'count': fields.Int64Field(),
+                       'tags': fields.JSONField()}
+
+        rec = Counter(count=0, tags=[], name="")
+        self.assert_(rec.missing() == ('name',))
+        rec['name'] = "hits"
+        self.assert_(rec.valid())
+        del rec['count']
+        self.assert_(rec.missing() == ('count',))
+
+    def test_lazy_decode(self):
+        """Make sure typed values are decoded when first accessed."""
+
+        class User(Record):
+            _fields = {'age': fields.Int64Field()}
+
+        rec = User()._inject(Key('eggs', 'bacon', 'tomato'),
+                             [Column('age', '\x00' * 7 + 'F', 0),
+                              Column('name', 'John', 0)])
+        self.assert_(dict.__getitem__(rec, 'age').__class__ is Column)
+        self.assert_(dict.__getitem__(rec, 'name') == 'John')
+
+        self.assert_(rec['age'] == 70)
+        self.assert_(dict.__getitem__(rec, 'age') == 70)
+        self.assert_(not rec.is_modified())
+
+        rec = User()._inject(Key('eggs', 'bacon', 'tomato'),
+                             [Column('age', '\x00' * 7 + 'F', 0)])
+        self.assert_(rec == {'age': 70})
+        self.assert_(rec.items() == [('age', 70)])
+
+        # Setting the same value doesn't modify the record
+        rec._inject(rec.key, [Column('age', '\x00' * 7 + 'F', 0)])
+        rec['age'] = 70
+        self.assert_(not rec.is_modified())
+
+        # Changing it back un-modifies it, and reverting restores it
+        rec['age'] = 71
+        self.assert_(rec._original['age'].value == '\x00' * 7 + 'F')
+        rec['age'] = 70
+        self.assert_(not rec.is_modified())
+        rec['age'] = 71
+        rec.revert()
+        self.assert_(rec['age'] == 70)
+
+    def test_lazy(self):
+        """Make sure lazy records keep fetched Columns until accessed."""
+
+        class User(Record):
+            _lazy = True
+            _fields = {'age': fields.Int64Field()}
+
+        cols = [Column('age', '\x00' * 7 + 'F', 1), Column('name', 'John', 2),
+                Column('city', 'London', 3)]
+        rec = User()._inject(Key('eggs', 'bacon', 'tomato'), cols)
+        self.assert_(rec._timestamps == {})
+        self.assert_(all(dict.__getitem__(rec, col.name) is col
+                         for col in cols))
+        self.assert_(sorted(rec.keys()) == ['age', 'city', 'name'])
+
+        self.assert_(rec['name'] == 'John')
+        self.assert_(rec['age'] == 70)
+        self.assert_(dict.__getitem__(rec, 'city') is cols[2])
+        self.assert_(rec._columns['city'].timestamp == 3)
+        self.assert_(rec._columns['age'].timestamp == 1)
+        self.assert_(not rec.is_modified())
+
+        # Changes to items which were never read are tracked as usual
+        rec['city'] = 'Paris'
+        del rec['name']
+        self.assert_(rec._original['city'].value == 'London')
+        self.assert_(rec._original['name'].timestamp == 2)
+        rec.revert()
+        self.assert_(rec == {'age': 70, 'name': 'John', 'city': 'London'})
+        self.assert_(rec._columns['name'].timestamp == 2)
+
+    def test_compression(self):
+        """Make sure items are compressed on save and read back."""
+        doc = '{"bio": "%s"}' % ("Silly walks. " * 20)
+
+        class Document(Record):
+            _compression = {'body': 'zlib'}
+            _fields = {'meta': fields.JSONField(compression='bz2')}
+
+        rec = Document({'body': doc, 'meta': {'bio': "Silly"}, 'id': doc})
+        cols = dict((col.name, col) for col in rec._marshal()['changed'])
+        self.assert_(cols['body'].value[0] == '\x01')
+        self.assert_(len(cols['body'].value) < len(doc))
+        # Too small to compress
+        self.assert_(cols['meta'].value == '\x00{"bio":"Silly"}')
+        self.assert_(cols['id'].value == doc)
+
+        rec = Document()._inject(rec.key, cols.values())
+        self.assert_(dict.__getitem__(rec, 'body').__class__ is Column)
+        self.assert_(dict.__getitem__(rec, 'id') == doc)
+        self.assert_(rec == {'body': doc, 'meta': {'bio': "Silly"},
+                             'id': doc})
+
+        Document._compression = 'zlib'
+        try:
+            rec = Document()._inject(rec.key, [
+                    Column('id', Document({'id': doc})._column('id').value)])
+            self.assert_(rec['id'] == doc)
+        finally:
+            Document._compression = {'body': 'zlib'}
+
+        # Values stored before compression was enabled
+        old = [Column('body', doc), Column('meta', '{"bio": "Silly"}')]
+        self.assertRaises(exc.ErrorCorruptData,
+                          lambda: Document()._inject(rec.key, old)['body'])
+        Document._compression_legacy = True
+        rec = Document()._inject(rec.key, old)
+        self.assert_(rec == {'body': doc, 'meta': {'bio': "Silly"}})
+
+    def test_pop(self):
+        """Make sure pop decodes the value and records the deletion."""
+
+        class User(Record):
+            _fields = {'age': fields.Int64Field()}
+
+        rec = User()._inject(Key('eggs', 'bacon', 'tomato'),
+                             [Column('age', '\x00' * 7 + 'F', 0)])
+        self.assert_(rec.pop('age') == 70)
+        self.assert_(rec._deleted == set(['age']))
+        self.assert_(rec.pop('age', None) is None)
+        self.assertRaises(KeyError, rec.pop, 'age')
+
 
 class MirroredRecordTest(unittest.TestCase):
 
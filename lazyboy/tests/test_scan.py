@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.scan."""
+
+from __future__ import with_statement
+import unittest
+import threading
+
+from cassandra.ttypes import TokenRange
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+import lazyboy.scan as scan
+import lazyboy.iterators as iterators
+import lazyboy.exceptions as exc
+from lazyboy.util import save
+from test_iterators import RangeClient
+
+MAX_TOKEN = 2 ** 127
+
+
+class RingClient(RangeClient):
+
+    """A client for a two-node ring."""
+
+    def __init__(self, keys, fail_after=None):
+        RangeClient.__init__(self, keys)
+        self.fail_after = fail_after
+        self._lock = threading.Lock()
+
+    def describe_ring(self, keyspace):
+        half = str(MAX_TOKEN / 2)
+        return [TokenRange("0", half, ["10.0.0.1", "10.0.0.2"]),
+                TokenRange(half, str(MAX_TOKEN), ["10.0.0.2", "10.0.0.3"])]
+
+    def describe_splits(self, cf, start_token, end_token, keys_per_split):
+        (start, end) = (long(start_token), long(end_token))
+        mid = (start + end) / 2
+        return [str(token) for token in (start, mid, end)]
+
+    def get_range_slices(self, *args):
+        with self._lock:
+            if self.fail_after is not None:
+                if not self.fail_after:
+                    raise exc.ErrorThriftMessage("Connection refused")
+                self.fail_after -= 1
+            return RangeClient.get_range_slices(self, *args)
+
+
+class ParallelScannerTest(unittest.TestCase):
+
+    """Test lazyboy.scan.ParallelScanner."""
+
+    def setUp(self):
+        self.keys = ['row-%03d' % num for num in range(200)]
+        self.client = RingClient(self.keys)
+        self.replicas = []
+
+        def replica(**kwargs):
+            self.replicas.append(kwargs['servers'])
+            return self.client
+
+        self._saved = save(scan.connection, ('get_pool', 'Client',
+                                             '_SERVERS', '_CLIENTS'))
+        self._saved.__enter__()
+        scan.connection._CLIENTS = {}
+        self._get_pool = iterators.get_pool
+        scan.connection.get_pool = lambda keyspace: self.client
+        iterators.get_pool = scan.connection.get_pool
+        scan.connection.Client = replica
+        scan.connection._SERVERS = {
+            'eggs': {'keyspace': 'eggs', 'servers': ['localhost:9170']}}
+        self.key = Key("eggs", "bacon")
+
+    def tearDown(self):
+        iterators.get_pool = self._get_pool
+        self._saved.__exit__(None, None, None)
+
+    def test_splits(self):
+        """Make sure the ring is divided with describe_splits."""
+        splits = scan.ring_splits("eggs", "bacon")
+        self.assert_(len(splits) == 4)
+        self.assert_(splits[0].start_token == "0")
+        self.assert_(splits[-1].end_token == str(MAX_TOKEN))
+        for (prev, split) in zip(splits, splits[1:]):
+            self.assert_(prev.end_token == split.start_token)
+        self.assert_(splits[0].endpoints == ["10.0.0.1", "10.0.0.2"])
+
+    def test_scan(self):
+        """Make sure every row is returned once."""
+        progress = []
+        scanner = scan.ParallelScanner(self.key, parallelism=3,
+                                       page_size=7, queue_size=5,
+                                       on_progress=progress.append)
+        rows = list(scanner)
+        self.assert_(sorted(key.key for (key, cols) in rows) == self.keys)
+        self.assert_(scanner.stats.rows == len(self.keys))
+        self.assert_(scanner.stats.finished_splits == 4)
+        self.assert_(progress and progress[-1] is scanner.stats)
+
+        # Splits are read from their replicas
+        self.assert_(self.replicas)
+        for servers in self.replicas:
+            self.assert_(servers[0].endswith(":9170"))
+            self.assert_(servers[0].split(":")[0] in
+                         ("10.0.0.1", "10.0.0.2", "10.0.0.3"))
+
+    def _splits(self, num):
+        """Return num Splits covering the ring."""
+        step = MAX_TOKEN / num
+        return [scan.Split(str(step * index), str(step * (index + 1)))
+                for index in range(num)]
+
+    def test_close(self):
+        """Make sure closing the iterator stops the scan."""
+        scanner = scan.ParallelScanner(self.key, parallelism=2,
+                                       page_size=5, queue_size=1,
+                                       use_replicas=False)
+        rows = scanner.scan(self._splits(40))
+        rows.next()
+        rows.close()
+        self.assert_(scanner.stats.rows < len(self.keys))
+        # Only the splits which had started read anything
+        self.assert_(len(self.client.ranges) <= 4)
+
+    def test_run_error(self):
+        """Make sure a failed callback stops the remaining splits."""
+
+        calls = []
+
+        def callback(split, rows):
+            calls.append(split)
+            list(rows)
+            raise RuntimeError("Spam")
+
+        scanner = scan.ParallelScanner(self.key, parallelism=2,
+                                       use_replicas=False)
+        self.assertRaises(RuntimeError, scanner.run, callback,
+                          self._splits(40))
+        # Only the splits which had started ran
+        self.assert_(len(calls) <= 2)
+        self.assert_(len(self.client.ranges) <= 2)
+
+    def test_run(self):
+        """Make sure rows are passed to a callback for each split."""
+        seen = {}
+        lock = threading.Lock()
+
+        def callback(split, rows):
+            found = [key.key for (key, cols) in rows]
+            with lock:
+                seen[split.start_token] = found
+
+        scanner = scan.ParallelScanner(self.key, parallelism=4,
+                                       use_replicas=False)
+        stats = scanner.run(callback)
+        self.assert_(len(seen) == 4)
+        self.assert_(sorted(sum(seen.values(), [])) == self.keys)
+        self.assert_(stats.rows == len(self.keys))
+        self.assert_(not self.replicas)
+
+    def test_records(self):
+        """Make sure rows can be returned as Records."""
+
+        class Row(Record):
+            _keyspace = "eggs"
+            _column_family = "bacon"
+
+        scanner = scan.ParallelScanner(record_class=Row)
+        rows = list(scanner)
+        self.assert_(len(rows) == len(self.keys))
+        self.assert_(all(isinstance(row, Row) for row in rows))
+
+    def test_replica_failure(self):
+        """Make sure failed replicas fall back to the pool."""
+        replica = RingClient(self.keys, fail_after=3)
+        scan.connection.Client = lambda **kwargs: replica
+        scanner = scan.ParallelScanner(self.key, parallelism=1,
+                                       page_size=10)
+        rows = list(scanner)
+        self.assert_(sorted(key.key for (key, cols) in rows) == self.keys)
+
+    def test_errors(self):
+        """Make sure errors are raised from the iterator."""
+        self.client.fail_after = 2
+        scanner = scan.ParallelScanner(self.key, use_replicas=False,
+                                       page_size=10)
+        self.assertRaises(exc.ErrorThriftMessage, list, scanner)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.session."""
+
+from __future__ import with_statement
+import unittest
+
+from cassandra.ttypes import Column
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+from lazyboy.recordset import KeyRecordSet
+import lazyboy.record
+import lazyboy.session as session
+import lazyboy.iterators as iterators
+import lazyboy.exceptions as exc
+from lazyboy.session import Session
+from lazyboy.util import save
+
+
+class User(Record):
+    _keyspace = "eggs"
+    _column_family = "users"
+
+
+class FakeClient(object):
+
+    """A client which serves rows and records writes."""
+
+    def __init__(self):
+        self.batches, self.multigets = [], []
+        self.missing = set()
+
+    def get_slice(self, row_key, parent, predicate, consistency):
+        if row_key in self.missing:
+            return []
+        return list(iterators.pack([Column("name", row_key.upper(), 0),
+                                    Column("age", "70", 0)]))
+
+    def multiget_slice(self, keys, parent, predicate, consistency):
+        self.multigets.append(sorted(keys))
+        return dict((key, self.get_slice(key, parent, predicate,
+                                         consistency)) for key in keys)
+
+    def batch_mutate(self, mutation_map, consistency):
+        self.batches.append(mutation_map)
+
+
+class SessionTest(unittest.TestCase):
+
+    """Test lazyboy.session.Session."""
+
+    def setUp(self):
+        self.client = FakeClient()
+        self._saves = [save(iterators, ('get_pool',)),
+                       save(session.connection, ('get_pool',))]
+        for saved in self._saves:
+            saved.__enter__()
+        iterators.get_pool = session.connection.get_pool = \
+            lambda keyspace: self.client
+
+    def tearDown(self):
+        for saved in reversed(self._saves):
+            saved.__exit__(None, None, None)
+
+    def test_identity_map(self):
+        """Make sure each key maps to one record."""
+        self.assert_(session.current() is None)
+        with Session() as sess:
+            self.assert_(session.current() is sess)
+            user = User().load("cleese")
+            self.assert_(User().load("cleese") is user)
+            self.assert_(User().load(Key("eggs", "users", "cleese")) is user)
+            self.assert_(sess.load(User, "cleese") is user)
+            self.assert_(user in sess)
+            self.assert_(User().load("palin") is not user)
+            self.assert_(len(sess) == 2)
+
+            # Nested sessions have their own maps
+            with Session() as inner:
+                self.assert_(User().load("cleese") is not user)
+            self.assert_(session.current() is sess)
+
+        self.assert_(session.current() is None)
+        self.assert_(User().load("cleese") is not user)
+
+    def test_load_many(self):
+        """Make sure batch loads only fetch unmapped keys."""
+        with Session() as sess:
+            user = User().load("cleese")
+            keys = [Key("eggs", "users", name)
+                    for name in ("palin", "cleese", "idle", "palin")]
+            records = KeyRecordSet(keys, User)
+            self.assert_(self.client.multigets == [["idle", "palin"]])
+            self.assert_(sorted(records.keys()) == ["cleese", "idle", "palin"])
+            self.assert_(records["cleese"] is user)
+            self.assert_(User().load("idle") is records["idle"])
+
+            self.assert_(sess.load_many(User, keys) ==
+                         [records["palin"], user, records["idle"],
+                          records["palin"]])
+            self.assert_(len(self.client.multigets) == 1)
+
+    def test_load_many_missing(self):
+        """Make sure missing rows are left out of batch loads."""
+        self.client.missing.add("chapman")
+        with Session() as sess:
+            keys = [Key("eggs", "users", name)
+                    for name in ("chapman", "cleese")]
+            records = sess.load_many(User, keys)
+            self.assert_([record.key.key for record in records] ==
+                         ["cleese"])
+            self.assert_(sess.get(keys[0]) is None)
+            self.assertRaises(exc.ErrorNoSuchRecord, User().load, "chapman")
+
+    def test_commit(self):
+        """Make sure dirty records are written in one batch."""
+        with Session() as sess:
+            cleese = User().load("cleese")
+            palin = User().load("palin")
+            User().load("idle")
+            cleese['age'] = 71
+            del palin['age']
+            new = sess.add(User({'name': 'Gilliam'}).set_key("gilliam"))
+
+            self.assert_(len(sess.dirty()) == 3)
+        self.assert_(len(self.client.batches) == 1)
+
+        batch = self.client.batches[0]
+        self.assert_(sorted(batch.keys()) == ["cleese", "gilliam", "palin"])
+        self.assert_(batch["cleese"]["users"][0].column_or_supercolumn
+                     .column.value == "71")
+        deletion = batch["palin"]["users"][0].deletion
+        self.assert_(deletion.predicate.column_names == ["age"])
+        self.assert_(not cleese.is_modified() and not palin.is_modified())
+        self.assert_(not new.is_modified())
+
+    def test_rollback(self):
+        """Make sure errors skip the commit, and rollback reverts."""
+        try:
+            with Session() as sess:
+                user = User().load("cleese")
+                user['age'] = 71
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assert_(self.client.batches == [])
+        self.assert_(user.is_modified())
+
+        sess.rollback()
+        self.assert_(user['age'] == "70")
+        self.assert_(sess.commit() == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
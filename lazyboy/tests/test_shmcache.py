@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.shmcache."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from cassandra.ttypes import Column, SuperColumn
+
+import lazyboy.cache as cache
+from lazyboy.exceptions import ErrorInvalidValue
+from lazyboy.shmcache import SharedCache
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    """Test lazyboy.shmcache.SharedCache."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "cache")
+        self.cache = SharedCache(self.path, slots=64, slot_size=512)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_get_set(self):
+        """Make sure rows and super columns are stored."""
+        cols = (Column("name", "John", 1), Column("age", "70", 2, 30))
+        scols = (SuperColumn("x", [Column("a", "b", 3)]),)
+        self.cache.set(("ks", "cf", "row", None), cols)
+        self.cache.set(("ks", "cf", "row", "sup"), scols)
+
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) == cols)
+        self.assert_(self.cache.get(("ks", "cf", "row", "sup")) == scols)
+        self.assert_(self.cache.get(("ks", "cf", "other", None)) is
+                     cache.MISS)
+        self.assert_(len(self.cache) == 1)
+        self.assert_(self.cache.stats()['hits'] == 2)
+
+        self.cache.invalidate(("ks", "cf", "row", "sup"))
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) is
+                     cache.MISS)
+        self.assert_(len(self.cache) == 0)
+
+    def test_limits(self):
+        """Make sure oversized rows are skipped, and entries expire."""
+        self.cache.set(("ks", "cf", "big", None),
+                       (Column("blob", "x" * 1024, 0),))
+        self.assert_(self.cache.get(("ks", "cf", "big", None)) is cache.MISS)
+        self.assert_(self.cache.stats()['oversize'] == 1)
+
+        self.cache.ttl = .01
+        self.cache.set(("ks", "cf", "row", None), ())
+        time.sleep(.02)
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) is cache.MISS)
+
+    def test_generation(self):
+        """Make sure stale reads aren't cached after an invalidation."""
+        generation = self.cache.generation
+        self.cache.invalidate(("ks", "cf", "row", None))
+        self.assert_(self.cache.generation == generation + 1)
+        self.cache.set(("ks", "cf", "row", None), (), generation)
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) is cache.MISS)
+
+    def test_processes(self):
+        """Make sure other processes see sets and invalidations."""
+        cols = (Column("name", "John", 1),)
+        pid = os.fork()
+        if not pid:
+            child = SharedCache(self.path, slots=64, slot_size=512)
+            child.set(("ks", "cf", "row", None), cols)
+            child.set(("ks", "cf", "gone", None), cols)
+            child.invalidate(("ks", "cf", "gone", None))
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) == cols)
+        self.assert_(self.cache.get(("ks", "cf", "gone", None)) is
+                     cache.MISS)
+        self.assert_(self.cache.generation == 1)
+
+        # A different layout leaves the file alone
+        self.assertRaises(ErrorInvalidValue, SharedCache, self.path,
+                          slots=32, slot_size=512)
+        self.assert_(self.cache.get(("ks", "cf", "row", None)) == cols)
+
+    def test_tiered(self):
+        """Make sure invalidations reach other processes' upper tiers."""
+        other = SharedCache(self.path, slots=64, slot_size=512)
+        try:
+            (first, second) = (cache.TieredCache(cache.LRUCache(), self.cache),
+                               cache.TieredCache(cache.LRUCache(), other))
+            (old, new) = ((Column("name", "John", 1),),
+                          (Column("name", "Eric", 2),))
+            key = ("ks", "cf", "row", None)
+            first.set(key, old)
+            self.assert_(first.get(key) == second.get(key) == old)
+
+            generation = second.generation
+            second.invalidate(key)
+            self.assert_(first.get(key) is cache.MISS)
+
+            second.set(key, new, second.generation)
+            self.assert_(first.get(key) == new)
+            first.set(key, old, generation)
+            self.assert_(first.get(key) == second.get(key) == new)
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.throttle."""
+
+import unittest
+
+from cassandra.ttypes import Column, SuperColumn
+
+from lazyboy.key import Key
+from lazyboy.record import Record
+import lazyboy.throttle as throttle
+import lazyboy.iterators as iterators
+import lazyboy.connection as connection
+from test_iterators import RangeClient
+
+
+class FakeTime(object):
+
+    """A clock which only moves when slept on."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+class ThrottleTestCase(unittest.TestCase):
+
+    """Run tests with a fake clock."""
+
+    def setUp(self):
+        self.__time = throttle.time
+        self.clock = throttle.time = FakeTime()
+
+    def tearDown(self):
+        throttle.time = self.__time
+
+
+class TokenBucketTest(ThrottleTestCase):
+
+    """Test lazyboy.throttle.TokenBucket."""
+
+    def test_consume(self):
+        """Make sure bursts are allowed, then consumption is paced."""
+        bucket = throttle.TokenBucket(100)
+        self.assert_(bucket.consume(100) == 0)
+        self.assert_(bucket.consume(50) == .5)
+        self.assert_(self.clock.slept == .5)
+
+        # Debt is paid off before more is allowed
+        self.assert_(bucket.consume(200) == 2)
+
+        self.clock.now += 10
+        self.assert_(bucket.consume(100) == 0)
+
+    def test_factor(self):
+        """Make sure the rate can be scaled."""
+        bucket = throttle.TokenBucket(100, burst=1)
+        bucket.consume(1)
+        self.assert_(bucket.consume(100, .5) == 2)
+
+
+class ThrottleTest(ThrottleTestCase):
+
+    """Test lazyboy.throttle.Throttle."""
+
+    def test_consume(self):
+        """Make sure every limit is applied."""
+        limit = throttle.Throttle(rows=10, bytes_=1000)
+        self.assert_(sorted(limit.buckets) == ['bytes', 'rows'])
+        self.assert_(limit.consume(rows=10, columns=500, bytes_=1000) == 0)
+        self.assert_(limit.consume(rows=5) == .5)
+        # The bytes bucket refilled while waiting for rows
+        self.assert_(limit.consume(bytes_=1500) == 1)
+
+        cols = [Column("name", "value", 0)] * 10
+        self.assert_(limit.consume_columns(cols, rows=10) > 0)
+        self.assertRaises(AssertionError, throttle.Throttle)
+
+    def test_backoff(self):
+        """Make sure rates back off when latency is over the target."""
+        limit = throttle.Throttle(rows=100, latency_target=.1,
+                                  keyspace="eggs", smoothing=1.0)
+        try:
+            self.assert_(limit.observe in connection._LATENCY_OBSERVERS)
+
+            self.clock.now += 1
+            limit.observe("eggs", .5)
+            self.assert_(limit.factor == .5)
+            # At most once per backoff_interval
+            limit.observe("eggs", .5)
+            self.assert_(limit.factor == .5)
+            self.clock.now += 1
+            limit.observe("eggs", .5)
+            self.assert_(limit.factor == .25)
+
+            # Other keyspaces are ignored
+            self.clock.now += 1
+            limit.observe("spam", .5)
+            self.assert_(limit.factor == .25)
+
+            self.clock.now += 2
+            limit.observe("eggs", .01)
+            self.assert_(abs(limit.factor - .4) < 1e-9)
+            self.clock.now += 100
+            limit.observe("eggs", .01)
+            self.assert_(limit.factor == 1.0)
+
+            limit.factor = .5
+            limit.consume(rows=100)
+            self.assert_(limit.consume(rows=50) == 1)
+        finally:
+            limit.close()
+        self.assert_(limit.observe not in connection._LATENCY_OBSERVERS)
+
+
+class ThrottledTest(ThrottleTestCase):
+
+    """Test throttled iteration."""
+
+    def test_item_cost(self):
+        """Make sure item costs are counted."""
+        col = Column("name", "value", 0)
+        self.assert_(throttle.item_cost(col) == (0, 1, 9))
+        self.assert_(throttle.item_cost(SuperColumn("sc", [col, col])) ==
+                     (0, 2, 20))
+        self.assert_(throttle.item_cost((Key("eggs", "bacon"), [col])) ==
+                     (1, 1, 9))
+        record = Record(name="value", other=1)
+        self.assert_(throttle.item_cost(record) == (1, 2, 15))
+
+    def test_throttled(self):
+        """Make sure throttled iterators are paced."""
+        limit = throttle.Throttle(columns=10)
+        cols = [Column("name", "value", 0)] * 30
+        self.assert_(list(throttle.throttled(cols, limit)) == cols)
+        self.assert_(self.clock.slept == 2)
+
+    def test_range_iterator(self):
+        """Make sure range scans are throttled a page at a time."""
+        client = RangeClient(['row-%d' % num for num in range(20)])
+        real_get_pool = iterators.get_pool
+        iterators.get_pool = lambda keyspace: client
+        try:
+            limit = throttle.Throttle(rows=5)
+            rows = list(iterators.range_iterator(
+                    Key("eggs", "bacon"), page_size=5, throttle=limit))
+        finally:
+            iterators.get_pool = real_get_pool
+        self.assert_(len(rows) == 20)
+        # Later pages re-read the previous page's last row
+        self.assert_(abs(self.clock.slept - 3.8) < 1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,18 +5,25 @@
 #
 """Unit tests for Lazyboy views."""
 
+from __future__ import with_statement
 import unittest
 import uuid
 import types
+import threading
 from itertools import islice
 
 from cassandra.ttypes import Column, ColumnOrSuperColumn
 
 import lazyboy.view as view
+import lazyboy.iterators as iterators
+import lazyboy.exceptions as exc
 from lazyboy.key import Key
+from lazyboy.connection import Client
 from lazyboy.iterators import pack, unpack
 from lazyboy.record import Record
+from lazyboy.session import Session
 from test_record import MockClient
+from test_iterators import MultigetClient
 
 
 class IterTimeTest(unittest.TestCase):
@@ -150,6 +157,34 @@ class ViewTest(unittest.TestCase):
         self.object.append(rec)
 
 
+class AsyncAppendTest(unittest.TestCase):
+
+    """Test View.append with async_=True."""
+
+    def test_append_async(self):
+        """Make sure async appends are handed to the background writer."""
+        submitted = []
+        real_submit = view.workers.submit_write
+        try:
+            view.workers.submit_write = \
+                lambda *args: submitted.append(args) or "future"
+            obj = view.View(Key('eggs', 'bacon', 'dummy_view'),
+                            Key('spam', 'tomato'))
+            rec = Record()
+            rec.key = Key(keyspace="spam", column_family="tomato",
+                          key="sausage")
+            rec['name'] = "sausage"
+            self.assert_(obj.append(rec, async_=True) == "future")
+        finally:
+            view.workers.submit_write = real_submit
+
+        (keyspace, method, row_key, path, col, level) = submitted[0]
+        self.assert_((keyspace, method, row_key) ==
+                     ('eggs', 'insert', 'dummy_view'))
+        self.assert_(path.column == "sausage")
+        self.assert_(col.value == "sausage")
+
+
 class FaultTolerantViewTest(unittest.TestCase):
 
     """Test suite for lazyboy.view.FaultTolerantView."""
@@ -172,7 +207,8 @@ class FaultTolerantViewTest(unittest.TestCase):
         ftv._get_cas = lambda: client
 
         ftv.record_class = IntermittentFailureRecord
-        ftv._keys = lambda: range(10)
+        ftv._cols = lambda: [Column(str(x), x) for x in range(10)]
+        ftv.make_key = lambda col: col.value
         res = tuple(ftv)
         self.assert_(len(res) == 5)
         for record in res:
@@ -269,5 +305,128 @@ class PartitionedViewTest(unittest.TestCase):
             self.assert_(self.object._append_view(record) == "one")
 
 
+class ViewCheckpointTest(unittest.TestCase):
+
+    """Test checkpoints of lazyboy.view.View."""
+
+    def test_checkpoint(self):
+        """Make sure views resume after the last column."""
+        view_ = view.View(Key("eggs", "bacon", "view"))
+        self.assert_(view_.checkpoint() is None)
+        view_.last_col = Column("col-10", "row-10", 0)
+        state = view_.checkpoint()
+        self.assert_(state == {'column': "col-10"})
+
+        view_ = view.View(Key("eggs", "bacon", "view"))
+        view_.restore(state)
+        self.assert_(view_.start_col == "col-10")
+        self.assert_(view_.exclusive)
+
+    def test_restore_deleted(self):
+        """Make sure restoring after a deleted column skips nothing."""
+        client = SliceClient([Column("col-%02d" % num, "row-%02d" % num, 0)
+                              for num in range(20) if num != 10])
+        view_ = view.View(Key("eggs", "bacon", "view"))
+        view_._get_cas = lambda: client
+        view_.chunk_size = 4
+        view_.restore({'column': "col-10"})
+        self.assert_([col.name for col in view_._cols()] ==
+                     ["col-%02d" % num for num in range(11, 20)])
+
+        view_.restore({'column': "col-12"})
+        self.assert_([col.name for col in view_._cols()] ==
+                     ["col-%02d" % num for num in range(13, 20)])
+
+
+class SliceClient(Client):
+
+    """A client which serves get_slice from a list of columns."""
+
+    def __init__(self, cols):
+        self.cols = cols
+        self.threads = set()
+
+    def get_slice(self, key, parent, predicate, consistency):
+        self.threads.add(threading.currentThread().getName())
+        cols = [col for col in self.cols
+                if col.name >= predicate.slice_range.start]
+        return [ColumnOrSuperColumn(column=col)
+                for col in cols[:predicate.slice_range.count]]
+
+
+class ViewPrefetchTest(unittest.TestCase):
+
+    """Test read-ahead in lazyboy.view.View."""
+
+    def setUp(self):
+        self.row_keys = ['row-%03d' % num for num in range(50)]
+        self.client = SliceClient([Column("col-%03d" % num, row_key, 0)
+                                   for (num, row_key)
+                                   in enumerate(self.row_keys)])
+        self.records = MultigetClient(dict(
+                (row_key, [Column("name", row_key, 0)])
+                for row_key in self.row_keys))
+        self.__get_pool = (view.connection.get_pool, iterators.get_pool)
+        view.connection.get_pool = lambda keyspace: self.client
+        iterators.get_pool = lambda keyspace: self.records
+
+    def tearDown(self):
+        (view.connection.get_pool, iterators.get_pool) = self.__get_pool
+
+    def _view(self, view_class=view.View, prefetch=2):
+        """Return a view with read-ahead."""
+        view_ = view_class(Key("eggs", "bacon", "view"), Key("eggs", "users"))
+        view_._get_cas = lambda: self.client
+        view_.chunk_size = 7
+        view_.prefetch = prefetch
+        return view_
+
+    def test_prefetch(self):
+        """Make sure pages of records are read ahead in order."""
+        view_ = self._view()
+        records = list(view_)
+        self.assert_([record.key.key for record in records] == self.row_keys)
+        self.assert_(all(record['name'] == record.key.key
+                         for record in records))
+        self.assert_(view_.last_col.name == "col-049")
+        self.assert_(len(self.records.calls) == 8)
+        self.assert_(all(len(keys) <= 7 for keys in self.records.calls))
+        self.assert_("MainThread" not in self.client.threads)
+
+        view_ = self._view()
+        view_.restore({'column': "col-044"})
+        self.assert_([record.key.key for record in view_] ==
+                     self.row_keys[45:])
+
+    def test_missing(self):
+        """Make sure missing records are handled like load() does."""
+        for row_key in self.row_keys[10:15]:
+            del self.records.rows[row_key]
+        self.assertRaises(exc.ErrorNoSuchRecord, list, self._view())
+
+        records = list(self._view(view.FaultTolerantView))
+        self.assert_(len(records) == 45)
+        for prefetch in (2, 0):
+            records = list(self._view(view.BatchLoadingView, prefetch))
+            self.assert_(len(records) == 45)
+            self.assert_(all(records))
+            self.assert_("row-012" not in
+                         [record.key.key for record in records])
+
+    def test_stop(self):
+        """Make sure closing the iterator stops reading ahead."""
+        records = iter(self._view(prefetch=1))
+        self.assert_(records.next().key.key == "row-000")
+        records.close()
+        self.assert_(len(self.records.calls) <= 3)
+
+    def test_session(self):
+        """Make sure records are loaded one by one in a Session."""
+        view_ = self._view()
+        with Session():
+            self.assert_(view_._prefetching() is False)
+        self.assert_(view_._prefetching())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+"""Unit tests for lazyboy.workers."""
+
+from __future__ import with_statement
+import unittest
+import threading
+
+import lazyboy.workers as workers
+import lazyboy.connection as connection
+import lazyboy.exceptions as exc
+from lazyboy.util import save
+
+
+class FutureTest(unittest.TestCase):
+
+    """Test lazyboy.workers.Future."""
+
+    def test_result(self):
+        """Make sure results are returned and callbacks run."""
+        future = workers.Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assert_(not future.done())
+        self.assertRaises(exc.ErrorTimeout, future.result, 0)
+
+        future.set_result("cleese")
+        self.assert_(future.done())
+        self.assert_(future.result() == "cleese")
+        self.assert_(future.exception() is None)
+        self.assert_(called == [future])
+
+        # Callbacks added after completion run right away
+        future.add_done_callback(called.append)
+        self.assert_(called == [future, future])
+
+    def test_exception(self):
+        """Make sure exceptions are raised from result()."""
+        future = workers.Future()
+        try:
+            raise ValueError("Gilliam")
+        except ValueError:
+            import sys
+            future.set_exception(sys.exc_info())
+
+        self.assertRaises(ValueError, future.result)
+        self.assert_(isinstance(future.exception(), ValueError))
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    """Test lazyboy.workers.WorkerPool."""
+
+    def test_submit(self):
+        """Make sure submitted functions run in the background."""
+        pool = workers.WorkerPool(workers=2, queue_size=10)
+        futures = [pool.submit(lambda x: x * x, num) for num in range(10)]
+        self.assert_([future.result(1) for future in futures] ==
+                     [num * num for num in range(10)])
+        pool.drain()
+
+    def test_errors(self):
+        """Make sure failures reach the future and error callbacks."""
+        errors = []
+        pool = workers.WorkerPool(workers=1, queue_size=1,
+                                  on_error=lambda f, ex: errors.append(ex))
+
+        def fail():
+            raise ValueError("Palin")
+
+        future = pool.submit(fail)
+        self.assertRaises(ValueError, future.result, 1)
+        pool.flush()
+        self.assert_(len(errors) == 1)
+        self.assert_(isinstance(errors[0], ValueError))
+        pool.drain()
+
+    def test_backpressure(self):
+        """Make sure a full queue blocks, then raises ErrorQueueFull."""
+        pool = workers.WorkerPool(workers=1, queue_size=1, put_timeout=.01)
+        gate = threading.Event()
+        pool.submit(gate.wait)        # Occupies the worker
+        self.assertRaises(exc.ErrorQueueFull, lambda: [
+                pool.submit(gate.wait) for num in range(3)])
+        gate.set()
+        pool.drain()
+
+    def test_flush_drain(self):
+        """Make sure flush waits for work, and drain stops threads."""
+        done = []
+        pool = workers.WorkerPool(workers=3, queue_size=100)
+        for num in range(50):
+            pool.submit(done.append, num)
+        pool.flush()
+        self.assert_(sorted(done) == range(50))
+
+        pool.drain()
+        self.assert_(pool._threads == [])
+
+        # Submitting after a drain restarts the pool
+        self.assert_(pool.submit(lambda: "idle").result(1) == "idle")
+        pool.drain()
+
+
+class SpawnTest(unittest.TestCase):
+
+    """Test lazyboy.workers.spawn."""
+
+    def test_spawn(self):
+        """Make sure spawned functions report results and errors."""
+        self.assert_(workers.spawn(lambda x: x + 1, 1).result(1) == 2)
+        future = workers.spawn(int, "Chapman")
+        self.assertRaises(ValueError, future.result, 1)
+
+    def test_spawn_clients(self):
+        """Make sure concurrently spawned threads get their own clients."""
+        release = threading.Event()
+
+        def client():
+            pool = connection.get_pool("spawned")
+            release.wait(1)
+            return (threading.currentThread().getName(), pool)
+
+        with save(connection, ('_SERVERS', '_CLIENTS', 'Client')):
+            connection._SERVERS = {'spawned': {}}
+            connection._CLIENTS = {}
+            connection.Client = lambda **kwargs: object()
+            futures = [workers.spawn(client) for num in range(3)]
+            release.set()
+            results = [future.result(1) for future in futures]
+
+        self.assert_(len(set(name for (name, pool) in results)) == 3)
+        self.assert_(len(set(id(pool) for (name, pool) in results)) == 3)
+
+
+class WriterTest(unittest.TestCase):
+
+    """Test the shared background writer."""
+
+    def test_writer(self):
+        """Make sure the shared writer can be replaced and used."""
+        pool = workers.WorkerPool(workers=1)
+        old = workers.set_writer(pool)
+        try:
+            self.assert_(workers.get_writer() is pool)
+
+            calls = []
+
+            class Client(object):
+
+                def insert(self, *args):
+                    calls.append(args)
+                    return True
+
+            with save(workers.connection, ('get_pool',)):
+                workers.connection.get_pool = lambda keyspace: Client()
+                future = workers.submit_write('eggs', 'insert', 'spam', 1)
+                workers.flush()
+                self.assert_(future.result() is True)
+                self.assert_(calls == [('spam', 1)])
+        finally:
+            workers.set_writer(old)
+            pool.drain()
+
+
+if __name__ == '__main__':
+    unittest.main()
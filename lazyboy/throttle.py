@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Rate limits for batch reads.
+
+A Throttle limits the rows, columns and/or bytes read per second:
+
+    throttle = Throttle(rows=500, latency_target=.05)
+    for (key, columns) in range_iterator(key, throttle=throttle):
+        ...
+
+With a latency_target, the rates back off when requests get slow and
+recover when they speed up again, so batch jobs use spare capacity
+without slowing down interactive requests.
+"""
+
+from __future__ import with_statement
+import time
+import threading
+
+import lazyboy.connection as connection
+from cassandra.ttypes import Column, SuperColumn
+
+
+class TokenBucket(object):
+
+    """A token bucket which fills at rate tokens per second.
+
+    It holds up to burst tokens, one second's worth by default.
+    Consuming more tokens than are available puts the bucket in debt,
+    and sleeps until it's paid off."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount, factor=1.0):
+        """Take amount tokens, filling at rate * factor, returns the delay."""
+        rate = self.rate * factor
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= amount
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class Throttle(object):
+
+    """Limit reads to a number of rows, columns and/or bytes per second.
+
+    If latency_target is set, every request from this process (or just
+    those to keyspace) is timed. While the average latency is above the
+    target, the rates are multiplied by backoff, at most once every
+    backoff_interval seconds, down to min_factor; below the target they
+    recover by `recovery' of the full rate per second.
+
+    A Throttle can be shared between threads. close() it when done.
+    """
+
+    def __init__(self, rows=None, columns=None, bytes_=None, burst=1.0,
+                 latency_target=None, keyspace=None, backoff=0.5,
+                 backoff_interval=1.0, recovery=0.05, min_factor=0.01,
+                 smoothing=0.2):
+        rates = (('rows', rows), ('columns', columns), ('bytes', bytes_))
+        self.buckets = dict((name, TokenBucket(rate, rate * burst))
+                            for (name, rate) in rates if rate)
+        assert self.buckets, "A rows, columns or bytes_ rate is required"
+
+        self.latency_target = latency_target
+        self.keyspace = keyspace
+        self.backoff = backoff
+        self.backoff_interval = backoff_interval
+        self.recovery = recovery
+        self.min_factor = min_factor
+        self.smoothing = smoothing
+        self.factor = 1.0
+        self.latency = None
+        self._last_backoff = self._last_observed = time.time()
+        self._lock = threading.Lock()
+        if latency_target:
+            connection.add_latency_observer(self.observe)
+
+    def close(self):
+        """Stop watching request latency."""
+        connection.remove_latency_observer(self.observe)
+
+    def observe(self, keyspace, seconds):
+        """Adjust the rates for the duration of a request."""
+        if self.keyspace and keyspace != self.keyspace:
+            return
+
+        with self._lock:
+            now = time.time()
+            self.latency = (seconds if self.latency is None else
+                            self.latency * (1 - self.smoothing) +
+                            seconds * self.smoothing)
+            if self.latency > self.latency_target:
+                if now - self._last_backoff >= self.backoff_interval:
+                    self.factor = max(self.min_factor,
+                                      self.factor * self.backoff)
+                    self._last_backoff = now
+            else:
+                self.factor = min(1.0, self.factor + self.recovery *
+                                  (now - self._last_observed))
+            self._last_observed = now
+
+    def consume(self, rows=0, columns=0, bytes_=0):
+        """Account for data read, sleeping if it's over the limit.
+
+        Returns the number of seconds slept."""
+        delay = 0
+        for (name, amount) in (('rows', rows), ('columns', columns),
+                               ('bytes', bytes_)):
+            if amount and name in self.buckets:
+                delay += self.buckets[name].consume(amount, self.factor)
+        return delay
+
+    def consume_columns(self, columns, rows=0):
+        """Account for a sequence of Columns or SuperColumns."""
+        (num, size) = column_cost(columns)
+        return self.consume(rows, num, size)
+
+
+def column_cost(columns):
+    """Return (columns, bytes) for a sequence of Columns or SuperColumns."""
+    num = size = 0
+    for col in columns:
+        if col.__class__ is SuperColumn:
+            (sub_num, sub_size) = column_cost(col.columns)
+            num += sub_num
+            size += sub_size + len(col.name)
+        else:
+            num += 1
+            size += len(col.name) + len(col.value)
+    return (num, size)
+
+
+def item_cost(item):
+    """Return (rows, columns, bytes) for an item from an iterator.
+
+    Items may be Columns, SuperColumns, (Key, columns) tuples or
+    Records."""
+    if item.__class__ in (Column, SuperColumn):
+        return (0,) + column_cost((item,))
+    if isinstance(item, tuple):
+        return (1,) + column_cost(item[1])
+    if isinstance(item, dict):
+        size = 0
+        for (name, value) in dict.iteritems(item):
+            if value.__class__ is Column:
+                value = value.value
+            size += len(name) + (len(value) if isinstance(value, str)
+                                 else 0)
+        return (1, len(item), size)
+    return (1, 0, 0)
+
+
+def throttled(iterable, throttle, cost=item_cost):
+    """Yield items from iterable, no faster than throttle allows.
+
+    cost(item) returns the (rows, columns, bytes) an item counts for."""
+    for item in iterable:
+        throttle.consume(*cost(item))
+        yield item
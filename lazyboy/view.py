@@ -5,18 +5,27 @@
 #
 """Lazyboy: Views."""
 
+import sys
 import datetime
 import uuid
 import traceback
+import threading
+import Queue
 from itertools import islice
 
 from cassandra.ttypes import SlicePredicate, SliceRange, Column, ColumnPath
 
 from lazyboy.key import Key
 from lazyboy.base import CassandraBase
-from lazyboy.iterators import multigetterator, unpack, chunk_seq
+from lazyboy.iterators import multigetterator, list_multigetterator, \
+    unpack, chunk_seq, get_multiget_pool, _record
 from lazyboy.record import Record
 from lazyboy.connection import Client
+import lazyboy.connection as connection
+import lazyboy.exceptions as exc
+import lazyboy.workers as workers
+import lazyboy.cache as cache
+import lazyboy.session as session
 
 
 def _iter_time(start=None, **kwargs):
@@ -35,7 +44,16 @@ def _iter_days(start=None):
 
 class View(CassandraBase):
 
-    """A regular view."""
+    """A regular view.
+
+    Set throttle to a lazyboy.throttle.Throttle to limit how fast the
+    view and its records are read.
+
+    Set prefetch to a number of pages to read ahead: the following
+    pages of chunk_size columns, and the records they point to, are
+    then fetched in the background while the current one is consumed.
+    Each page of records is loaded with a single multiget. Read-ahead
+    is off inside a Session, which loads records as they're reached."""
 
     def __init__(self, view_key=None, record_key=None, record_class=None,
                  start_col=None, exclusive=False):
@@ -53,6 +71,8 @@ class View(CassandraBase):
         self.last_col = None
         self.start_col = start_col
         self.exclusive = exclusive
+        self.throttle = None
+        self.prefetch = 0
 
     def __repr__(self):
         return "%s: %s" % (self.__class__.__name__, self.key)
@@ -64,7 +84,13 @@ class View(CassandraBase):
 
     def _cols(self, start_col=None, end_col=None):
         """Yield columns in the view."""
-        client = self._get_cas()
+        for page in self._pages(start_col, end_col):
+            for col in page:
+                yield col
+
+    def _pages(self, start_col=None, end_col=None, client=None):
+        """Yield lists of up to chunk_size columns in the view."""
+        client = client or self._get_cas()
         assert isinstance(client, Client), \
             "Incorrect client instance: %s" % client.__class__
         last_col = start_col or self.start_col or ""
@@ -73,8 +99,9 @@ class View(CassandraBase):
         passes = 0
         while True:
             # When you give Cassandra a start key, it's included in the
-            # results. We want it in the first pass, but subsequent iterations
-            # need to the count adjusted and the first record dropped.
+            # results, if it still exists. We want it in the first pass, but
+            # subsequent iterations need to the count adjusted and the first
+            # record dropped.
             fudge = 1 if self.exclusive else int(passes > 0)
 
             cols = client.get_slice(
@@ -86,15 +113,33 @@ class View(CassandraBase):
             if len(cols) == 0:
                 raise StopIteration()
 
-            for col in unpack(cols[fudge:]):
-                yield col
-                last_col = col.name
+            if self.throttle:
+                self.throttle.consume_columns(unpack(cols))
+
+            page = list(unpack(cols))
+            if fudge and page and page[0].name == last_col:
+                page = page[1:]
+            if page:
+                yield page
+                last_col = page[-1].name
 
             passes += 1
 
             if len(cols) < self.chunk_size:
                 raise StopIteration()
 
+    def checkpoint(self):
+        """Return the position of the last record returned, or None."""
+        if self.last_col is None:
+            return None
+        return {'column': self.last_col.name}
+
+    def restore(self, state):
+        """Start iterating after a checkpoint."""
+        if state is not None:
+            self.start_col = state['column']
+            self.exclusive = True
+
     def _keys(self, start_col=None, end_col=None):
         """Yield keys in this view"""
         return (self.make_key(col) for col in self._cols(start_col, end_col))
@@ -104,29 +149,111 @@ class View(CassandraBase):
         assert isinstance(column, Column)
         return self.record_key.clone(key=column.value)
 
+    def _load_page(self, cols):
+        """Return a record, or None if it's missing, for each column."""
+        keys = [self.make_key(col) for col in cols]
+        columns = self.record_class._projection
+        return [_record(self.record_class, key, data, columns)
+                if data else None
+                for (key, data) in list_multigetterator(
+                keys, self.consistency, len(keys), 1, columns)]
+
+    def _read_ahead(self):
+        """Yield (column, record or None), reading prefetch pages ahead.
+
+        Pages of columns are read by a background thread, which hands
+        each one to the multiget pool to load its records. Closing the
+        iterator stops the thread, once its current read finishes."""
+        pages = Queue.Queue(self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.isSet():
+                try:
+                    pages.put(item, True, .1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def read():
+            loader = get_multiget_pool()
+            try:
+                # Connections are per thread, so don't share the view's
+                client = connection.get_pool(self.key.keyspace)
+                for page in self._pages(client=client):
+                    if not put((page, loader.submit(self._load_page, page))):
+                        return
+            except Exception:
+                put((done, sys.exc_info()))
+                return
+            put((done, None))
+
+        reader = workers.spawn(read)
+        try:
+            while True:
+                (page, loaded) = pages.get()
+                if page is done:
+                    if loaded:
+                        raise loaded[0], loaded[1], loaded[2]
+                    return
+                for item in zip(page, loaded.result()):
+                    yield item
+        finally:
+            stop.set()
+            reader.result()
+
+    def _prefetching(self):
+        """Return True if records should be read ahead."""
+        return self.prefetch > 0 and session.current() is None
+
     def __iter__(self):
         """Iterate over all objects in this view."""
+        if self._prefetching():
+            for (col, record) in self._read_ahead():
+                self.last_col = col
+                if self.throttle:
+                    self.throttle.consume(rows=1)
+                if record is None:
+                    raise exc.ErrorNoSuchRecord(
+                        "No record matching key %s" % self.make_key(col))
+                yield record
+            return
+
         for (key, col) in ((self.make_key(col), col) for col in self._cols()):
             self.last_col = col
+            if self.throttle:
+                self.throttle.consume(rows=1)
             yield self.record_class().load(key)
 
     def _record_key(self, record=None):
         """Return the column name for a given record."""
         return record.key.key if record else str(uuid.uuid1())
 
-    def append(self, record):
-        """Append a record to a view"""
+    def append(self, record, async_=False):
+        """Append a record to a view
+
+        If async_ is True, the insert is handed to the background
+        writer and a Future is returned."""
         assert isinstance(record, Record), \
             "Can't append non-record type %s to view %s" % \
             (record.__class__, self.__class__)
 
         path = self.key.get_path(column=self._record_key(record))
         col = Column(path.column, record.key.key, record.timestamp())
-        
+
+        if async_:
+            cache.invalidate(self.key)
+            return workers.submit_write(self.key.keyspace, 'insert',
+                                        self.key.key, path, col,
+                                        self.consistency)
+
         self._get_cas().insert(
             self.key.key,
             path,
             col, self.consistency)
+        cache.invalidate(self.key)
 
     def remove(self, record):
         """Remove a record from a view"""
@@ -137,6 +264,7 @@ class View(CassandraBase):
             self.key.key,
             self.key.get_path(column=self._record_key(record)),
             record.timestamp(), self.consistency)
+        cache.invalidate(self.key)
 
 
 class FaultTolerantView(View):
@@ -145,13 +273,24 @@ class FaultTolerantView(View):
 
     def __iter__(self):
         """Iterate over all objects in this view, ignoring bad keys."""
-        for key in self._keys():
+        if self._prefetching():
+            for (col, record) in self._read_ahead():
+                self.last_col = col
+                if self.throttle:
+                    self.throttle.consume(rows=1)
+                if record is not None:
+                    yield record
+            return
+
+        for col in self._cols():
+            self.last_col = col
+            if self.throttle:
+                self.throttle.consume(rows=1)
             try:
-                yield self.record_class().load(key)
-            except GeneratorExit:
-                raise
+                record = self.record_class().load(self.make_key(col))
             except Exception:
-                pass
+                continue
+            yield record
 
 
 class BatchLoadingView(View):
@@ -167,6 +306,15 @@ class BatchLoadingView(View):
 
     def __iter__(self):
         """Batch load and iterate over all objects in this view."""
+        if self._prefetching():
+            for (col, record) in self._read_ahead():
+                if self.throttle:
+                    self.throttle.consume(rows=1)
+                if record is not None:
+                    self.last_col = col
+                    yield record
+            return
+
         all_cols = self._cols()
 
         cols = [True]
@@ -175,6 +323,18 @@ class BatchLoadingView(View):
             cols = tuple(islice(all_cols, self.chunk_size))
             fetched += len(cols)
             keys = tuple(self.make_key(col) for col in cols)
+            if self.throttle and keys:
+                self.throttle.consume(rows=len(keys))
+            current = session.current()
+            if current is not None:
+                current.load_many(self.record_class, keys, self.consistency)
+                for (col, key) in zip(cols, keys):
+                    record = current.get(key)
+                    if record is not None:
+                        self.last_col = col
+                        yield record
+                continue
+
             recs = multigetterator(keys, self.consistency)
 
             if (self.record_key.keyspace not in recs
@@ -185,9 +345,12 @@ class BatchLoadingView(View):
             data = recs[self.record_key.keyspace][self.record_key.column_family]
 
             for (index, k) in enumerate(keys):
-                record_data = data[k.key]
-                if k.is_super():
+                record_data = data.get(k.key)
+                if record_data and k.is_super():
                     record_data = record_data[k.super_column]
+                if not record_data:
+                    # Missing rows come back with no columns
+                    continue
 
                 self.last_col = cols[index]
                 yield (self.record_class()._inject(
@@ -226,6 +389,6 @@ class PartitionedView(object):
         key = iter(self.partition_keys()).next()
         return self._get_view(key)
 
-    def append(self, record):
+    def append(self, record, async_=False):
         """Append a record to the view."""
-        return self._append_view(record).append(record)
+        return self._append_view(record).append(record, async_=async_)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# © 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Background worker threads."""
+
+from __future__ import with_statement
+import sys
+import logging
+import threading
+import itertools
+import Queue
+
+import lazyboy.connection as connection
+import lazyboy.exceptions as exc
+
+# Defaults for the shared background writer
+WRITER_THREADS = 4
+WRITER_QUEUE_SIZE = 10000
+
+_STOP = object()
+_SPAWNED = itertools.count()
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+class Future(object):
+
+    """The pending result of a background operation."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result, self._exc_info = None, None
+        self._callbacks = []
+
+    def done(self):
+        """Return True if the operation has finished."""
+        return self._done.isSet()
+
+    def _wait(self, timeout=None):
+        """Wait for the operation, raising ErrorTimeout if it doesn't end."""
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise exc.ErrorTimeout("Timed out waiting for result.")
+
+    def result(self, timeout=None):
+        """Return the result of the operation, raising its exception."""
+        self._wait(timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the operation, or None."""
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, func):
+        """Call func(future) when the operation finishes."""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def set_result(self, result):
+        """Finish the operation with a result."""
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """Finish the operation with an exception, as from sys.exc_info."""
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        """Mark the future as done and run callbacks."""
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                logging.exception("Error in Future callback")
+
+
+class WorkerPool(object):
+
+    """A pool of threads which run functions from a bounded queue.
+
+    submit() blocks while the queue is full, which applies backpressure
+    to the producer. If put_timeout is set and the queue stays full for
+    that long, ErrorQueueFull is raised instead.
+    """
+
+    def __init__(self, workers=WRITER_THREADS, queue_size=WRITER_QUEUE_SIZE,
+                 on_error=None, put_timeout=None, name="lazyboy-worker"):
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.name = name
+        self._queue = Queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._error_callbacks = [on_error] if on_error else []
+
+    def add_error_callback(self, func):
+        """Call func(future, exception) when a submitted function fails."""
+        self._error_callbacks.append(func)
+
+    def _start(self):
+        """Start the worker threads, if they aren't running."""
+        with self._lock:
+            if self._threads:
+                return
+
+            for num in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name="%s-%d" % (self.name, num))
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the background, returns a Future."""
+        self._start()
+        future = Future()
+        try:
+            self._queue.put((future, func, args, kwargs), True,
+                            self.put_timeout)
+        except Queue.Full:
+            raise exc.ErrorQueueFull("Worker queue is full.")
+        return future
+
+    def _work(self):
+        """Run queued functions until told to stop."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._run(*item)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, future, func, args, kwargs):
+        """Run one queued function."""
+        try:
+            result = func(*args, **kwargs)
+        except Exception, ex:
+            future.set_exception(sys.exc_info())
+            for callback in self._error_callbacks:
+                try:
+                    callback(future, ex)
+                except Exception:
+                    logging.exception("Error in WorkerPool error callback")
+        else:
+            future.set_result(result)
+
+    def pending(self):
+        """Return the approximate number of queued functions."""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until everything submitted so far has run."""
+        self._queue.join()
+
+    def drain(self):
+        """Flush the queue, then stop the worker threads.
+
+        The pool restarts its threads if more work is submitted."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        for thread in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join()
+        self.flush()
+
+
+def spawn(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a new daemon thread, returns a Future."""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception:
+            future.set_exception(sys.exc_info())
+
+    thread = threading.Thread(target=run,
+                              name="lazyboy-spawn-%d" % _SPAWNED.next())
+    thread.setDaemon(True)
+    thread.start()
+    return future
+
+
+def get_writer():
+    """Return the shared background writer, creating it if needed."""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = WorkerPool(name="lazyboy-writer")
+        return _WRITER
+
+
+def set_writer(pool):
+    """Replace the shared background writer, returns the old one."""
+    global _WRITER
+    with _WRITER_LOCK:
+        old, _WRITER = _WRITER, pool
+    return old
+
+
+def flush():
+    """Block until all background writes submitted so far are done."""
+    get_writer().flush()
+
+
+def drain():
+    """Finish all background writes and stop the writer threads."""
+    get_writer().drain()
+
+
+def _call_pool(keyspace, method, args):
+    """Call a method on this thread's client for keyspace."""
+    return getattr(connection.get_pool(keyspace), method)(*args)
+
+
+def submit_write(keyspace, method, *args):
+    """Call a client method for keyspace on the background writer."""
+    return get_writer().submit(_call_pool, keyspace, method, args)
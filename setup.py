@@ -26,5 +26,7 @@ setup(name="Lazyboy",
       keywords="database cassandra",
       install_requires=['Thrift', 'Cassandra>=0.5.0rc3'],
       zip_safe=False,
+      entry_points={'console_scripts':
+                        ['lazyboy-load = lazyboy.bulkload:main']},
       tests_require=['nose', 'coverage>=3.2b1'],
       dependency_links=DEPS)